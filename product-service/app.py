@@ -1,30 +1,58 @@
 import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from botocore.exceptions import ClientError
 from flask_cors import CORS
 from util.db_utils import init_dynamodb
-from decimal import Decimal
 from util.metrics import MetricsCollector
-from model.product import ProductModel
+from model.product import ProductModel, StockReservationError
+from model.catalog_snapshot import CatalogSnapshotWriter, load_snapshot, SNAPSHOT_SEED_TTL
+from model.stock_shards import ShardedStock, ShardReconciler, ProductNotFoundError, MAX_SHARDS
+from model.stock_reservations import ReservationConflictError
 from util.auth_utils import require_auth
 from flask_swagger_ui import get_swaggerui_blueprint
 from util.secrets_utils import get_secret
+from util.opensearch_utils import get_opensearch_client
+from util.pagination import encode_cursor, decode_cursor, parse_limit
+from util.fieldsets import parse_fields
+from util.catalog_version import CatalogVersion
+from util.response_cache import ResponseCache, cached_response, encode_json, STALE_WARNING, REFRESH_ENVIRON_KEY
+from util.cache_warmer import CacheWarmer
+from util.compression import init_compression
 from http import HTTPStatus
 from model.product_search import SearchAPI
+from model.product_search_utils import InvalidSearchRequestError
+from model.suggest_index import suggest_index
+from model.local_search import local_search
+from model.search_sync import SearchIndexSyncer, create_change_queue, upsert_event, delete_event, refresh_event
 from flask_caching import Cache
 import json
+import hashlib
 import boto3
 import os
-from opensearchpy import OpenSearch
+import threading
+from urllib.parse import urlencode, quote
 
 
 SWAGGER_URL = '/api/docs'
 API_URL = '/static/swagger.json'
 
+DEFAULT_PAGE_SIZE = 50
+STREAM_PAGE_SIZE = 500
+NDJSON_MIMETYPE = 'application/x-ndjson'
+MAX_BATCH_IDS = 300
+# Sent with a write the search sync pipeline did not accept; it is published again later
+SEARCH_SYNC_WARNING = '199 - "Change not yet queued for search indexing"'
+
 cache_config = {
-    "CACHE_TYPE": "SimpleCache",  # Flask-Caching default is SimpleCache
+    # Flask-Caching default is SimpleCache; a shared backend (e.g. RedisCache
+    # with CACHE_REDIS_URL) also shares the catalog generation between workers
+    "CACHE_TYPE": os.environ.get('CACHE_TYPE', 'SimpleCache'),
     "CACHE_DEFAULT_TIMEOUT": 300  # 5 minutes default timeout
 }
+if os.environ.get('CACHE_REDIS_URL'):
+    cache_config['CACHE_REDIS_URL'] = os.environ['CACHE_REDIS_URL']
+# Backends that live in the worker's own memory
+PROCESS_LOCAL_CACHE_TYPES = ('SimpleCache', 'NullCache')
 
 swaggerui_blueprint = get_swaggerui_blueprint(
     SWAGGER_URL,
@@ -39,55 +67,294 @@ swaggerui_blueprint = get_swaggerui_blueprint(
 app = Flask(__name__)
 app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 cache = Cache(app, config=cache_config)
+if cache_config['CACHE_TYPE'] not in PROCESS_LOCAL_CACHE_TYPES:
+    CatalogVersion().bind(cache.cache)
+response_cache = ResponseCache(default_timeout=cache_config['CACHE_DEFAULT_TIMEOUT'])
+search_api = SearchAPI()
+# Autocomplete ranks names and brands by how often their products are viewed
+suggest_index.popularity = lambda product_id: response_cache.access_tracker.count(f'product:{product_id}')
+
+def search_changes_applied(product_ids):
+    """Searches cached while the changes were queued still hold the old hits"""
+    CatalogVersion().bump()
+
+search_sync = SearchIndexSyncer(create_change_queue(), on_applied=search_changes_applied)
 CORS(app)
+init_compression(app)
+
+# The only query parameters the listing handlers read; anything else must not
+# produce a new cache entry (and a new full scan)
+LISTING_PARAMS = ('limit', 'cursor', 'fields')
+
+def canonical_query_string(names=LISTING_PARAMS):
+    return urlencode(sorted((k, v) for k, v in request.args.items(multi=True) if k in names))
+
+def invalidate_product_cache(product_id=None):
+    """Drop the cached product and every cached product listing"""
+    CatalogVersion().bump()
+    if product_id:
+        response_cache.delete(f'product:{product_id}')
+        response_cache.delete_prefix(f'product:{product_id}?')
+    response_cache.delete_prefix('products:')
+
+def catalog_validators(payload):
+    """
+    Listings are versioned by the shared catalog generation, known before
+    any read, so every worker mints the same ETag. Without a shared cache
+    backend there is no such generation: the ETag is then the hash of the
+    listing body, which is equally the same on every worker.
+    """
+    version = CatalogVersion()
+    if not version.shared:
+        return None
+    return f'catalog-{version.token}', version.last_modified
+
+def product_validators(item, fields=None):
+    """
+    A product is versioned by its updated_at timestamp and its stock; sparse
+    fieldsets get their own ETag. Reservations of a sharded product only
+    write its shards, so it has no Last-Modified while it is sharded.
+    """
+    if not item:
+        return None
+    updated_at = str(item.get('updated_at') or '')
+    version = f"{item['product_id']}:{updated_at}:{item.get('stock', '')}"
+    if fields:
+        version += f":{','.join(fields)}"
+    etag = hashlib.sha1(version.encode('utf-8')).hexdigest()
+    if ShardedStock.is_sharded(item['product_id']):
+        return etag, None
+    try:
+        last_modified = datetime.datetime.fromisoformat(updated_at)
+    except ValueError:
+        last_modified = None
+    return etag, last_modified
+
+def publish_search_change(event):
+    """Hand a product change to the search sync pipeline; returns an error message on failure"""
+    try:
+        search_sync.publish(event)
+        return None
+    except Exception as e:
+        print(f"Error publishing search change for {event['product_id']}: {str(e)}")
+        return f"Error queueing product for indexing: {str(e)}"
+
+def with_sync_warning(response, error):
+    """Tell the client a write was stored but is not on its way to the search index yet"""
+    if error:
+        response.headers['Warning'] = SEARCH_SYNC_WARNING
+    return response
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super(DecimalEncoder, self).default(obj)
-    
 @app.route('/products/create', methods=['POST'])
 @require_auth
 def create_product():
     data = request.get_json()
-
-    for product in data:
-        # Create in DynamoDB
-        ProductModel.create_product(product)
-        # Index in OpenSearch
-        ProductModel.index_product(product)
-    
-    cache.delete_memoized(get_products)
-    return jsonify({'message': 'Product created successfully'})       
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list) or not all(isinstance(product, dict) for product in data):
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': 'Expected a product or a list of products'
+        }), HTTPStatus.BAD_REQUEST
+
+    # Create in DynamoDB
+    results = ProductModel.create_products(data)
+    stored = [data[i] for i, result in enumerate(results) if result['error'] is None]
+
+    # Queue for indexing in OpenSearch; the search sync pipeline applies it in bulk
+    index_errors = {}
+    if stored:
+        for product in stored:
+            error = publish_search_change(upsert_event(product))
+            if error:
+                index_errors[str(product['product_id'])] = error
+        invalidate_product_cache()
+        for product in stored:
+            suggest_index.add_product(product)
+
+    report = []
+    for product, result in zip(data, results):
+        product_id = product.get('product_id')
+        error = result['error'] or index_errors.get(str(product_id))
+        report.append({
+            'product_id': product_id,
+            'stored': result['error'] is None,
+            'queued_for_indexing': result['error'] is None and str(product_id) not in index_errors,
+            'error': error
+        })
+
+    failed = sum(1 for item in report if item['error'])
+    return jsonify({
+        'message': 'Product created successfully' if not failed else 'Some products could not be created',
+        'succeeded': len(report) - failed,
+        'failed': failed,
+        'results': report
+    }), HTTPStatus.OK if not failed else HTTPStatus.MULTI_STATUS
+
+def wants_ndjson():
+    return (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best == NDJSON_MIMETYPE)
+
+def products_cache_key():
+    # Streaming responses are never cached
+    if wants_ndjson():
+        return None
+    return f'products:all?{canonical_query_string()}'
 
 @app.route('/products/get', methods=['GET'])
-@cache.cached(timeout=300)
+@cached_response(response_cache, products_cache_key, validators=catalog_validators)
 def get_products():
-    items = ProductModel.get_all_products()
-    # Convert Decimal to float for JSON response
-    products = json.loads(json.dumps(items, cls=DecimalEncoder))
-    return jsonify(products)
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        start_key = decode_cursor(request.args.get('cursor'))
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': str(e)
+        }), HTTPStatus.BAD_REQUEST
+
+    # Stream the catalog as one JSON document per line, page by page
+    if wants_ndjson():
+        def generate():
+            for item in ProductModel.iter_all_products(page_size=limit or STREAM_PAGE_SIZE, fields=fields):
+                yield encode_json(item) + b'\n'
+        return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+    if limit is not None or start_key is not None:
+        items, last_key = ProductModel.get_products_page(
+            limit=limit or DEFAULT_PAGE_SIZE,
+            exclusive_start_key=start_key,
+            fields=fields
+        )
+        return {
+            'products': items,
+            'next_cursor': encode_cursor(last_key)
+        }
+
+    return ProductModel.get_all_products(fields=fields)
 
 @app.route('/products/productsbycategory/<string:category>', methods=['GET'])
-@cache.cached(timeout=300, query_string=True)
+@cached_response(response_cache, lambda category: f'products:category:{category}?{canonical_query_string()}',
+                 validators=catalog_validators)
 def get_products_by_category(category):
     print(category)
-    items = ProductModel.get_all_products(category)
-    # Convert Decimal to float for JSON response
-    products = json.loads(json.dumps(items, cls=DecimalEncoder))
-    return jsonify(products)
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        start_key = decode_cursor(request.args.get('cursor'))
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': str(e)
+        }), HTTPStatus.BAD_REQUEST
+
+    # Without paging parameters keep returning the whole category as a plain list
+    if limit is None and start_key is None:
+        return ProductModel.get_all_products(category, fields=fields)
+
+    items, last_key = ProductModel.get_products_by_category(
+        category,
+        limit=limit or DEFAULT_PAGE_SIZE,
+        exclusive_start_key=start_key,
+        fields=fields
+    )
+    return {
+        'products': items,
+        'next_cursor': encode_cursor(last_key)
+    }
+
+def product_cache_key(product_id, fields=None):
+    """Full products are cached under product:<id>, sparse ones under product:<id>?fields=..."""
+    if not fields:
+        return f'product:{product_id}'
+    return f"product:{product_id}?fields={','.join(fields)}"
+
+def product_request_cache_key(product_id):
+    try:
+        return product_cache_key(product_id, parse_fields(request.args.get('fields')))
+    except ValueError:
+        # Not cached; the view answers with a 400
+        return None
 
 @app.route('/products/<string:product_id>', methods=['GET'])
-@cache.memoize(timeout=300)
+@cached_response(response_cache, product_request_cache_key,
+                 validators=lambda item: product_validators(item, parse_fields(request.args.get('fields'))))
 def get_product(product_id):
-    item = ProductModel.get_product(product_id)
-    # Convert Decimal to float for JSON response
-    product = json.loads(json.dumps(item, cls=DecimalEncoder))
-    print(product)
-    return jsonify(product)
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': str(e)
+        }), HTTPStatus.BAD_REQUEST
+    return ProductModel.get_product(product_id, fields=fields)
+
+@app.route('/products/batch', methods=['POST'])
+def get_products_batch():
+    """Look up many products at once, serving cached products without touching DynamoDB"""
+    data = request.get_json(silent=True) or {}
+    product_ids = data.get('ids')
+    if (not isinstance(product_ids, list) or not product_ids
+            or not all(isinstance(pid, str) and pid for pid in product_ids)):
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': '"ids" must be a non-empty list of product ids'
+        }), HTTPStatus.BAD_REQUEST
+    try:
+        fields = parse_fields(data.get('fields', request.args.get('fields')))
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': str(e)
+        }), HTTPStatus.BAD_REQUEST
+    # Preserve request order while dropping duplicates
+    product_ids = list(dict.fromkeys(product_ids))
+    if len(product_ids) > MAX_BATCH_IDS:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': f'At most {MAX_BATCH_IDS} ids can be requested at once'
+        }), HTTPStatus.BAD_REQUEST
+
+    bodies = {}
+    to_fetch = []
+    for product_id in product_ids:
+        entry = response_cache.get(product_cache_key(product_id, fields))
+        if entry is None:
+            to_fetch.append(product_id)
+        elif entry.body != b'null':
+            bodies[product_id] = entry.body
+
+    stale = False
+    if to_fetch:
+        try:
+            fetched = ProductModel.batch_get_products(to_fetch, fields=fields)
+        except Exception:
+            # Answer from expired entries if every product still has one
+            stale_entries = {pid: response_cache.get_stale(product_cache_key(pid, fields)) for pid in to_fetch}
+            if any(entry is None for entry in stale_entries.values()):
+                raise
+            fetched = {}
+            stale = True
+            for product_id, entry in stale_entries.items():
+                if entry.body != b'null':
+                    bodies[product_id] = entry.body
+        for product_id, item in fetched.items():
+            # Warm the single product cache with what we just read
+            etag, last_modified = product_validators(item, fields)
+            bodies[product_id] = response_cache.set(
+                product_cache_key(product_id, fields), item, etag=etag, last_modified=last_modified
+            ).body
+
+    missing = [pid for pid in product_ids if pid not in bodies]
+    # Splice the already encoded product bodies into the response without re-encoding them
+    products = b','.join(encode_json(pid) + b':' + bodies[pid] for pid in sorted(bodies))
+    body = b'{"missing":' + encode_json(missing) + b',"products":{' + products + b'}}'
+    response = Response(body, mimetype='application/json')
+    if stale:
+        response.headers['X-Cache'] = 'STALE'
+        response.headers['Warning'] = STALE_WARNING
+    return response
 
 @app.route('/products/<string:product_id>', methods=['PUT'])
 @require_auth
@@ -96,12 +363,14 @@ def update_product(product_id):
         data = request.get_json()
         updated_product = ProductModel.update_product(product_id, data)
 
-        # Invalidate specific product cache
-        cache.delete_memoized(get_product, product_id)
-        # Invalidate products list cache
-        cache.delete_memoized(get_products)
+        # Invalidate product and products list caches
+        invalidate_product_cache(product_id)
+        error = None
+        if updated_product:
+            suggest_index.add_product(updated_product)
+            error = publish_search_change(upsert_event(updated_product))
 
-        return jsonify(json.loads(json.dumps(updated_product, cls=DecimalEncoder)))
+        return with_sync_warning(Response(encode_json(updated_product), mimetype='application/json'), error)
         
     except ClientError as e:
         return jsonify({'error': str(e)}), 500
@@ -114,9 +383,12 @@ def delete_product(product_id):
     try:
         response= ProductModel.delete_product(product_id)
         # Invalidate caches
-        cache.delete_memoized(get_product, product_id)
-        cache.delete_memoized(get_products)
-        return response
+        invalidate_product_cache(product_id)
+        suggest_index.remove_product(product_id)
+        if response == 404:
+            return response
+        error = publish_search_change(delete_event(product_id))
+        return with_sync_warning(app.make_response(response), error)
     except ClientError as e:
         return jsonify({'error': str(e)}), 500
     except Exception as e:
@@ -130,9 +402,14 @@ def update_stock(product_id):
         if 'stock' not in data:
             return jsonify({'error': 'Stock value is required'}), 400
             
-        response = ProductModel.update_stock(product_id, data['stock'])
+        try:
+            response = ProductModel.update_stock(product_id, data['stock'])
+        except ProductNotFoundError:
+            response = None
         if response is not None:
-            return jsonify({'message': 'Stock updated successfully' })
+            # Re-read by the search sync, which indexes the whole stored item
+            error = stock_changed([product_id])
+            return with_sync_warning(jsonify({'message': 'Stock updated successfully' }), error)
         return jsonify({'message': 'Product not found'}), 404
         
     except ClientError as e:
@@ -140,11 +417,158 @@ def update_stock(product_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def parse_stock_items(data):
+    """Validate a list of {product_id, qty}, merging repeated products"""
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValueError('"items" must be a non-empty list of {product_id, qty}')
+    quantities = {}
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('product_id'), str) or not item['product_id']:
+            raise ValueError('Every item needs a product_id')
+        qty = item.get('qty')
+        if not isinstance(qty, int) or isinstance(qty, bool) or qty < 1:
+            raise ValueError(f"qty for {item['product_id']} must be a positive integer")
+        quantities[item['product_id']] = quantities.get(item['product_id'], 0) + qty
+    return list(quantities.items())
+
+def adjust_stock(reserve):
+    data = request.get_json(silent=True)
+    try:
+        items = parse_stock_items(data)
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': str(e)
+        }), HTTPStatus.BAD_REQUEST
+    reservation_id = data.get('reservation_id') if isinstance(data, dict) else None
+    if reservation_id is not None and (not isinstance(reservation_id, str) or not reservation_id):
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': '"reservation_id" must be a non-empty string'
+        }), HTTPStatus.BAD_REQUEST
+
+    try:
+        if reserve:
+            product_ids = ProductModel.reserve_stock(items, reservation_id=reservation_id)
+        else:
+            product_ids = ProductModel.release_stock(items, reservation_id=reservation_id)
+    except StockReservationError as e:
+        return jsonify({
+            'error': str(e),
+            'product_ids': e.failed_product_ids
+        }), HTTPStatus.CONFLICT
+    except ReservationConflictError as e:
+        return jsonify({'error': str(e)}), HTTPStatus.CONFLICT
+    except ProductNotFoundError as e:
+        return jsonify({'error': 'Product not found', 'message': str(e)}), HTTPStatus.NOT_FOUND
+    except ClientError as e:
+        return jsonify({'error': str(e)}), 500
+
+    error = stock_changed(product_ids)
+    return with_sync_warning(jsonify({
+        'message': 'Stock reserved successfully' if reserve else 'Stock released successfully',
+        'items': [{'product_id': product_id, 'qty': qty} for product_id, qty in items]
+    }), error)
+
+@app.route('/products/stock/reserve', methods=['POST'])
+@require_auth
+def reserve_stock():
+    """Reserve stock for a whole cart in one atomic operation"""
+    return adjust_stock(reserve=True)
+
+@app.route('/products/stock/release', methods=['POST'])
+@require_auth
+def release_stock():
+    """Give back stock taken by a reservation"""
+    return adjust_stock(reserve=False)
+
+def stock_changed(product_ids):
+    """Invalidate and re-index products whose stock changed; returns the last publish error"""
+    error = None
+    for product_id in product_ids:
+        invalidate_product_cache(product_id)
+        error = publish_search_change(refresh_event(product_id)) or error
+    return error
+
+stock_shard_reconciler = ShardReconciler(on_reconciled=stock_changed)
+
+@app.route('/products/<string:product_id>/stock', methods=['GET'])
+def get_stock(product_id):
+    """Current stock, summed over the shards of a hot product"""
+    try:
+        return jsonify({
+            'product_id': product_id,
+            'stock': ShardedStock.get_stock(product_id),
+            'sharded': ShardedStock.is_sharded(product_id)
+        })
+    except ValueError as e:
+        return jsonify({'error': 'Product not found', 'message': str(e)}), HTTPStatus.NOT_FOUND
+    except ClientError as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/products/<string:product_id>/stock/shards', methods=['POST'])
+@require_auth
+def enable_stock_shards(product_id):
+    """Spread a hot product's stock over several counters for a flash sale"""
+    data = request.get_json(silent=True) or {}
+    shards = data.get('shards', 10)
+    until = data.get('until')
+    if not isinstance(shards, int) or isinstance(shards, bool) or not 2 <= shards <= MAX_SHARDS:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': f'"shards" must be an integer between 2 and {MAX_SHARDS}'
+        }), HTTPStatus.BAD_REQUEST
+    if until is not None:
+        try:
+            until = datetime.datetime.fromisoformat(until).astimezone(datetime.timezone.utc).isoformat()
+        except (TypeError, ValueError):
+            return jsonify({
+                'error': 'Invalid parameters',
+                'message': '"until" must be an ISO 8601 timestamp'
+            }), HTTPStatus.BAD_REQUEST
+
+    try:
+        stock = ShardedStock.enable(product_id, shards, until=until)
+    except ProductNotFoundError as e:
+        return jsonify({'error': 'Product not found', 'message': str(e)}), HTTPStatus.NOT_FOUND
+    except ValueError as e:
+        return jsonify({'error': str(e)}), HTTPStatus.CONFLICT
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'TransactionCanceledException':
+            return jsonify({'error': 'Stock changed while sharding, please retry'}), HTTPStatus.CONFLICT
+        return jsonify({'error': str(e)}), 500
+
+    invalidate_product_cache(product_id)
+    return jsonify({
+        'message': 'Stock sharded successfully',
+        'product_id': product_id,
+        'shards': shards,
+        'stock': stock,
+        'until': until
+    })
+
+@app.route('/products/<string:product_id>/stock/shards', methods=['DELETE'])
+@require_auth
+def reconcile_stock_shards(product_id):
+    """Fold a product's shards back into a single stock counter"""
+    try:
+        stock = ShardedStock.reconcile(product_id)
+    except ValueError as e:
+        return jsonify({'error': 'Product not found', 'message': str(e)}), HTTPStatus.NOT_FOUND
+    except ClientError as e:
+        return jsonify({'error': str(e)}), 500
+    if stock is None:
+        return jsonify({'error': 'Product stock is not sharded'}), HTTPStatus.CONFLICT
+
+    error = stock_changed([product_id])
+    return with_sync_warning(jsonify({'message': 'Stock shards reconciled successfully', 'product_id': product_id}), error)
+
 @app.route('/products/search', methods=['GET'])
 def search_products():
     try:
         # Get and validate parameters
-        clean_params, error = SearchAPI().validate_search_params(request.args)
+        clean_params, error = search_api.validate_search_params(request.args)
         print(clean_params, error)
         if error:
             return jsonify({
@@ -153,15 +577,20 @@ def search_products():
             }), HTTPStatus.BAD_REQUEST
 
         # Perform search
-        search_results = SearchAPI().product_search.search_products(clean_params)
+        search_results = search_api.product_search.search_products(clean_params)
         
         # Format response
-        response = SearchAPI().format_response(search_results)
+        response = search_api.format_response(search_results, clean_params.get('fields'))
 
         # print(response)
         
         return jsonify(response), HTTPStatus.OK
 
+    except InvalidSearchRequestError as e:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': str(e)
+        }), HTTPStatus.BAD_REQUEST
     except Exception as e:
         return jsonify({
             'error': 'Search failed',
@@ -181,7 +610,7 @@ def suggest_products():
 
         size = min(int(request.args.get('size', 10)), 10)
         
-        suggestions = SearchAPI().product_search.suggest_products(prefix, size)
+        suggestions = search_api.product_search.suggest_products(prefix, size)
 
         print(suggestions)
         
@@ -206,11 +635,24 @@ def circuit_breaker_metrics():
         'failure_count': e.failure_count
     } for e in events])
 
+@app.route('/products/metrics/search-sync', methods=['GET'])
+def search_sync_metrics():
+    """Progress and lag of the DynamoDB to OpenSearch sync pipeline"""
+    return jsonify(search_sync.get_stats())
+
+@app.route('/products/metrics/cache-warmer', methods=['GET'])
+def cache_warmer_metrics():
+    """Refresh counts of the background cache warmer"""
+    return jsonify(cache_warmer.get_stats())
+
 @app.route('/products/cache/clear', methods=['POST'])
 @require_auth
 def clear_cache():
     try:
         cache.clear()
+        response_cache.clear()
+        search_api.product_search.cache.clear()
+        search_api.product_search.facet_cache.clear()
         return jsonify({'message': 'Cache cleared successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -259,27 +701,7 @@ def health_check():
 
     # Check OpenSearch
     try:
-        if os.environ.get('opensearch_secret')=='':
-                os.environ['opensearch_secret'] = get_secret('opensearch/config') 
-
-        secrets = json.loads(os.environ.get('opensearch_secret'))
-        host = secrets.get('host')
-        region = secrets.get('region')
-        master_user_name = secrets.get('master_user_name')
-        master_user_password = secrets.get('master_user_password')
-        
-        opensearch_client = OpenSearch(
-            hosts=[{
-                'host': host,
-                'port': 443
-            }],
-            http_auth=(
-                master_user_name,
-                master_user_password
-            ),
-            use_ssl=True,
-            verify_certs=True
-        )
+        opensearch_client = get_opensearch_client()
         opensearch_health = opensearch_client.cluster.health()
         health_status['checks']['opensearch'] = {
             'status': 'healthy' if opensearch_health['status'] in ['green', 'yellow'] else 'unhealthy',
@@ -388,6 +810,129 @@ def method_not_allowed(e):
         'message': 'The method is not allowed for this endpoint'
     }), HTTPStatus.METHOD_NOT_ALLOWED
 
-if __name__ == '__main__':
+def warm_suggest_index(products=None):
+    """
+    Build the autocomplete index and the local fallback search engine from the
+    catalog; suggest and search use OpenSearch alone until they are ready
+    """
+    try:
+        if products is None:
+            products = list(ProductModel.iter_product_records(page_size=STREAM_PAGE_SIZE))
+        suggest_index.build(products)
+        print(f"Suggest index built with {len(suggest_index)} entries")
+        local_search.build(products)
+        print(f"Local search engine built with {len(local_search)} products")
+    except Exception as e:
+        print(f"Error building suggest index: {str(e)}")
+
+def refresh_cached_path(path):
+    """Recompute the cache entry behind a GET path, outside of any client request"""
+    with app.test_request_context(path, environ_overrides={REFRESH_ENVIRON_KEY: True}):
+        app.full_dispatch_request()
+
+cache_warmer = CacheWarmer(response_cache, refresh_cached_path)
+
+def category_listing_path(category_id):
+    return f"/products/productsbycategory/{quote(category_id, safe='')}"
+
+def prewarm_category_listings(category_ids):
+    """Load every category listing into the cache and let the warmer keep them fresh"""
+    warmed = 0
+    for category_id in sorted(c for c in category_ids if c):
+        response_cache.access_tracker.register(f'products:category:{category_id}?', category_listing_path(category_id))
+        try:
+            refresh_cached_path(category_listing_path(category_id))
+            warmed += 1
+        except Exception as e:
+            print(f"Error pre-warming category {category_id}: {str(e)}")
+    print(f"Pre-warmed {warmed} category listings")
+
+def warm_on_startup():
+    """
+    Cold start without a snapshot: build the local indexes, pre-warm the
+    category listings and write the first snapshot, all from one catalog scan.
+    The snapshot writer is only started afterwards so it does not scan too.
+    """
+    try:
+        products = list(ProductModel.iter_product_records(page_size=STREAM_PAGE_SIZE))
+    except Exception as e:
+        print(f"Error loading the catalog for warm-up: {str(e)}")
+        catalog_snapshot_writer.start()
+        return
+    warm_suggest_index(products)
+    prewarm_category_listings({product.get('category_id') for product in products})
+    try:
+        catalog_snapshot_writer.write(products)
+    except Exception as e:
+        print(f"Error writing the catalog snapshot: {str(e)}")
+    catalog_snapshot_writer.start()
+
+catalog_snapshot_writer = CatalogSnapshotWriter(
+    lambda: ProductModel.iter_product_records(page_size=STREAM_PAGE_SIZE),
+    on_refresh=warm_suggest_index
+)
+
+def warm_caches_from_snapshot():
+    """
+    Pre-populate the response caches from the on-disk catalog snapshot, so a
+    fresh worker does not start cold; the suggest index follows in the background.
+    Returns False when there is no usable snapshot.
+    """
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return False
+    with snapshot:
+        products = list(snapshot)
+    catalog_snapshot_writer.mark_seen()
+
+    categories = {}
+    for item in products:
+        categories.setdefault(item.get('category_id'), []).append(item)
+
+    # The snapshot may lag behind the table: seeded listings are versioned by
+    # their own bodies and seeded products get an ETag no live item has, so a
+    # client revalidating a seeded body is always sent the current one
+    response_cache.set('products:all?', products, timeout=SNAPSHOT_SEED_TTL)
+    response_cache.access_tracker.register('products:all?', '/products/get')
+    for category_id, items in categories.items():
+        if category_id:
+            key = f'products:category:{category_id}?'
+            response_cache.set(key, items, timeout=SNAPSHOT_SEED_TTL)
+            response_cache.access_tracker.register(key, category_listing_path(category_id))
+
+    # Only as many products as the cache can hold next to the listings
+    room = max(response_cache.max_entries - len(categories) - 1, 0)
+    for item in products[:room]:
+        etag, _ = product_validators(item)
+        response_cache.set(f'product:{item["product_id"]}', item, timeout=SNAPSHOT_SEED_TTL,
+                           etag=f'snapshot-{etag}')
+
+    # The indexes are not needed to serve, so they are built after startup
+    threading.Thread(target=warm_suggest_index, args=(products,), name='suggest-warm-up', daemon=True).start()
+    print(f"Warmed caches with {len(products)} products from the catalog snapshot")
+    return True
+
+def background_services():
+    return [search_sync, stock_shard_reconciler, catalog_snapshot_writer, cache_warmer]
+
+def start_background_services():
+    """
+    Create the tables, warm the caches and start the background workers of
+    this process. Every entry point (app.py, asgi.py) calls this once.
+    """
     init_dynamodb()
-    app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
+    cold = not warm_caches_from_snapshot()
+    for service in background_services():
+        # On a cold start warm_on_startup starts the snapshot writer once it has written the first snapshot
+        if not (cold and service is catalog_snapshot_writer):
+            service.start()
+    if cold:
+        threading.Thread(target=warm_on_startup, daemon=True).start()
+
+def stop_background_services():
+    for service in background_services():
+        service.stop()
+
+if __name__ == '__main__':
+    start_background_services()
+    app.run(host='0.0.0.0', port=5002)
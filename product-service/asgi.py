@@ -0,0 +1,112 @@
+# ASGI entry point: search and suggest are served by async handlers backed by
+# AsyncOpenSearch, every other route is delegated to the Flask app.
+# Run with: uvicorn asgi:app --host 0.0.0.0 --port 5002
+from contextlib import asynccontextmanager
+from http import HTTPStatus
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.wsgi import WSGIMiddleware
+from fastapi.responses import JSONResponse, Response
+from app import app as flask_app, search_api, start_background_services, stop_background_services
+from model.async_product_search import AsyncProductSearch
+from model.product_search_utils import InvalidSearchRequestError
+from util.compression import COMPRESS_MIN_SIZE, choose_encoding, compress
+from util.opensearch_utils import close_async_opensearch_client
+from util.response_cache import encode_json
+
+# Shares the Flask search caches, so /products/cache/clear and catalog writes reach both
+async_product_search = AsyncProductSearch(
+    cache=search_api.product_search.cache,
+    facet_cache=search_api.product_search.facet_cache
+)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    start_background_services()
+    try:
+        yield
+    finally:
+        stop_background_services()
+        await close_async_opensearch_client()
+
+
+app = FastAPI(title="Product Service API", lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+
+
+def json_response(request, payload):
+    """JSON response compressed with the encoding negotiated for this request, when large enough"""
+    body = encode_json(payload)
+    headers = {}
+    if len(body) >= COMPRESS_MIN_SIZE:
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = choose_encoding(request.headers.get('accept-encoding'))
+        if encoding:
+            body = compress(body, encoding)
+            headers['Content-Encoding'] = encoding
+    return Response(body, status_code=HTTPStatus.OK, media_type='application/json', headers=headers)
+
+
+@app.get('/products/search')
+async def search_products(request: Request):
+    try:
+        # Get and validate parameters
+        clean_params, error = search_api.validate_search_params(request.query_params)
+        if error:
+            return JSONResponse({
+                'error': 'Invalid parameters',
+                'message': error
+            }, status_code=HTTPStatus.BAD_REQUEST)
+
+        # Perform search
+        search_results = await async_product_search.search_products(clean_params)
+
+        # Format response
+        return json_response(request, search_api.format_response(search_results, clean_params.get('fields')))
+
+    except InvalidSearchRequestError as e:
+        return JSONResponse({
+            'error': 'Invalid parameters',
+            'message': str(e)
+        }, status_code=HTTPStatus.BAD_REQUEST)
+    except Exception as e:
+        return JSONResponse({
+            'error': 'Search failed',
+            'message': str(e)
+        }, status_code=HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
+@app.get('/products/suggest')
+async def suggest_products(request: Request):
+    """Get search suggestions"""
+    try:
+        prefix = request.query_params.get('q', '').strip()
+        if not prefix:
+            return JSONResponse({
+                'error': 'Missing query parameter',
+                'message': 'Query parameter "q" is required'
+            }, status_code=HTTPStatus.BAD_REQUEST)
+
+        size = min(int(request.query_params.get('size', 10)), 10)
+
+        suggestions = await async_product_search.suggest_products(prefix, size)
+
+        return json_response(request, {
+            'suggestions': suggestions
+        })
+
+    except Exception as e:
+        return JSONResponse({
+            'error': 'Suggestion failed',
+            'message': str(e)
+        }, status_code=HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
+# Everything else (product CRUD, health, metrics, swagger) stays on Flask
+app.mount('/', WSGIMiddleware(flask_app))
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5002)
@@ -0,0 +1,76 @@
+"""
+Memory and conversion time of a catalog held as boto3 items, Product
+dataclasses and ProductRecords.
+
+    python benchmarks/product_records.py [--products 100000]
+
+Items are generated in the shape boto3 returns them (Decimal numbers,
+repeated categories and brands). Each representation is measured with
+tracemalloc while the source items stay alive, so the numbers are what a
+conversion adds on top of a scanned page.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from model.product_data import Product, load_product_records  # noqa: E402
+
+
+def make_items(count):
+    items = []
+    for i in range(count):
+        items.append({
+            'product_id': os.urandom(8).hex(),
+            'name': f'Product {i} deluxe edition',
+            'price': Decimal(f'{i % 5000}.99'),
+            'stock': Decimal(i % 250),
+            'category_id': f'category-{i % 40}',
+            'brand_name': f'Brand {i % 300}',
+            'description': f'Description of product {i}',
+            'product_image_url': f'https://images.example.com/{i}.jpg',
+            'created_at': '2024-01-01T00:00:00+00:00',
+            'updated_at': '2024-06-01T00:00:00+00:00'
+        })
+    return items
+
+
+def copy_items(items):
+    # What a DynamoDB scan hands back: fresh dicts for every page
+    return [dict(item) for item in items]
+
+
+def dataclasses(items):
+    return [Product.from_dict(item) for item in items]
+
+
+def measure(name, convert, items, count):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = convert(items)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<16} {current / count:>10.1f} {elapsed / count * 1e6:>12.2f}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100000)
+    args = parser.parse_args()
+
+    items = make_items(args.products)
+    print(f"{args.products} products")
+    print(f"{'representation':<16} {'bytes/product':>10} {'us/product':>12}")
+    measure('boto3 dict', copy_items, items, args.products)
+    measure('Product', dataclasses, items, args.products)
+    measure('ProductRecord', load_product_records, items, args.products)
+
+
+if __name__ == '__main__':
+    main()
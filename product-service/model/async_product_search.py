@@ -0,0 +1,82 @@
+from starlette.concurrency import run_in_threadpool
+from model.product_search_utils import ProductSearch, PIT_KEEP_ALIVE, SEARCH_REQUEST_TIMEOUT
+from model.local_search import local_search
+from model.suggest_index import suggest_index
+from util.catalog_version import CatalogVersion
+from util.opensearch_utils import get_async_opensearch_client
+
+
+class AsyncProductSearch(ProductSearch):
+    """
+    ProductSearch for the ASGI entry point.
+    Query building, caching and response processing are shared with the
+    synchronous class; only the OpenSearch I/O is awaited. The local
+    fallback engine is CPU bound and runs in the threadpool.
+    """
+
+    @property
+    def client(self):
+        return get_async_opensearch_client()
+
+    async def search_products(self, query_params):
+        try:
+            # Check cache first
+            generation = CatalogVersion().generation
+            cached_results = self.get_cached_search(query_params)
+            if cached_results:
+                return cached_results
+
+            if not self.search_available():
+                return await run_in_threadpool(local_search.search, query_params)
+
+            search_request = self.build_search_request(query_params)
+            try:
+                if search_request['needs_pit']:
+                    pit = await self.client.create_pit(index='products', keep_alive=PIT_KEEP_ALIVE)
+                    self.attach_pit(search_request, pit['pit_id'])
+
+                response = await self.client.search(
+                    index=search_request['index'],
+                    body=search_request['body'],
+                    request_timeout=SEARCH_REQUEST_TIMEOUT
+                )
+            except Exception as e:
+                return await run_in_threadpool(self.search_failed, query_params, e)
+            self.breaker.record_success()
+
+            return self.process_search_response(query_params, search_request, response, generation)
+
+        except Exception as e:
+            print(f"Search error: {str(e)}")
+            raise e
+
+    async def suggest_products(self, prefix: str, size: int = 5) -> list:
+        try:
+            suggestions = self.get_cached_suggestions(prefix, size)
+            if suggestions is not None:
+                return suggestions
+
+            generation = CatalogVersion().generation
+
+            if not self.suggest_available():
+                return suggest_index.lookup(prefix, size)
+
+            try:
+                response = await self.client.msearch(
+                    body=self.build_suggest_msearch(prefix, size),
+                    request_timeout=SEARCH_REQUEST_TIMEOUT
+                )
+            except Exception as e:
+                return self.suggest_failed(prefix, size, e)
+            self.breaker.record_success()
+            suggest_response, popular_searches = self._split_suggest_msearch(response)
+
+            suggestions = self._process_suggestions(suggest_response, prefix, size, popular_searches=popular_searches)
+
+            self.cache_suggestions(prefix, size, suggestions, generation)
+
+            return suggestions
+
+        except Exception as e:
+            print(f"Suggestion error: {str(e)}")
+            raise e
@@ -0,0 +1,286 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+import numpy as np
+from util.response_cache import json_default
+
+SNAPSHOT_PATH = os.environ.get(
+    'CATALOG_SNAPSHOT_PATH', os.path.join(tempfile.gettempdir(), 'product-catalog.snap')
+)
+SNAPSHOT_INTERVAL = int(os.environ.get('CATALOG_SNAPSHOT_INTERVAL', 600))
+SNAPSHOT_MAX_AGE = int(os.environ.get('CATALOG_SNAPSHOT_MAX_AGE', 3600))
+# Cache entries seeded from a snapshot may be up to SNAPSHOT_MAX_AGE old, so they
+# only live this long before they are recomputed (or served stale if DynamoDB is down)
+SNAPSHOT_SEED_TTL = int(os.environ.get('CATALOG_SNAPSHOT_SEED_TTL', 30))
+
+MAGIC = b'PCSNAP1\n'
+ALIGNMENT = 64
+NULL_LENGTH = 0xFFFFFFFF
+STRING_FIELDS = (
+    'product_id', 'name', 'price', 'category_id', 'brand_name',
+    'description', 'product_image_url', 'created_at', 'updated_at'
+)
+# Every other attribute of a product (tags, specifications, variants, ...)
+# is kept as one JSON document per product, so a snapshot holds the whole item
+ATTRIBUTES_COLUMN = 'attributes'
+COLUMNS = STRING_FIELDS + (ATTRIBUTES_COLUMN,)
+STOCK_NULL = np.iinfo(np.int64).min
+SNAPSHOT_DTYPE = np.dtype(
+    [('stock', '<i8')]
+    + [(f'{field}_offset', '<u4') for field in COLUMNS]
+    + [(f'{field}_length', '<u4') for field in COLUMNS]
+)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(products, path=SNAPSHOT_PATH):
+    """
+    Write products as a fixed-width record array plus a shared UTF-8 string table.
+    Repeated strings (categories, brands, timestamps) are stored once; the
+    remaining attributes of each product are stored as JSON. The file
+    is written next to the target and renamed over it, so readers never see a
+    partial snapshot.
+    """
+    products = list(products)
+    records = np.zeros(len(products), dtype=SNAPSHOT_DTYPE)
+    strings = bytearray()
+    interned = {}
+
+    for i, product in enumerate(products):
+        item = product.to_dict() if hasattr(product, 'to_dict') else product
+        stock = item.get('stock')
+        records[i]['stock'] = STOCK_NULL if stock is None else int(stock)
+        attributes = {k: v for k, v in item.items() if k not in STRING_FIELDS and k != 'stock'}
+        for field in COLUMNS:
+            if field == ATTRIBUTES_COLUMN:
+                value = json.dumps(attributes, default=json_default, sort_keys=True,
+                                   separators=(',', ':'), ensure_ascii=False) if attributes else None
+            else:
+                value = item.get(field)
+            if value is None:
+                records[i][f'{field}_length'] = NULL_LENGTH
+                continue
+            encoded = str(value).encode('utf-8')
+            offset = interned.get(encoded)
+            if offset is None:
+                offset = interned[encoded] = len(strings)
+                strings.extend(encoded)
+            records[i][f'{field}_offset'] = offset
+            records[i][f'{field}_length'] = len(encoded)
+
+    header = {
+        'count': len(products),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'fields': list(COLUMNS),
+        'strings_length': len(strings)
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    records_offset = _align(len(MAGIC) + 4 + len(header_bytes))
+    strings_offset = _align(records_offset + records.nbytes)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.catalog-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b'\0' * (records_offset - f.tell()))
+            f.write(records.tobytes())
+            f.write(b'\0' * (strings_offset - f.tell()))
+            f.write(strings)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(products)
+
+
+class CatalogSnapshot:
+    """
+    Read-only, memory-mapped view of a catalog snapshot.
+    Opening it only maps the file; records are decoded as they are iterated.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotError(f"Catalog snapshot {path} is empty")
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise SnapshotError(f"{path} is not a catalog snapshot")
+        header_length = struct.unpack_from('<I', self._mmap, len(MAGIC))[0]
+        header_start = len(MAGIC) + 4
+        self.header = json.loads(self._mmap[header_start:header_start + header_length].decode('utf-8'))
+        if tuple(self.header['fields']) != COLUMNS:
+            self.close()
+            raise SnapshotError(f"Catalog snapshot {path} has an unsupported layout")
+
+        self.count = self.header['count']
+        records_offset = _align(header_start + header_length)
+        self._strings_offset = _align(records_offset + self.count * SNAPSHOT_DTYPE.itemsize)
+        if self._strings_offset + self.header['strings_length'] > len(self._mmap):
+            self.close()
+            raise SnapshotError(f"Catalog snapshot {path} is truncated")
+        self.records = np.frombuffer(self._mmap, dtype=SNAPSHOT_DTYPE, count=self.count, offset=records_offset)
+        self._strings = memoryview(self._mmap)[self._strings_offset:self._strings_offset + self.header['strings_length']]
+
+    @property
+    def created_at(self):
+        return datetime.fromisoformat(self.header['created_at'])
+
+    @property
+    def age(self):
+        return (datetime.now(timezone.utc) - self.created_at).total_seconds()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # Pull whole columns out of the mapping at once; per-record numpy access is slow
+        strings = bytes(self._strings)
+        stock = self.records['stock'].tolist()
+        columns = [
+            (field, self.records[f'{field}_offset'].tolist(), self.records[f'{field}_length'].tolist())
+            for field in COLUMNS
+        ]
+        for i in range(self.count):
+            item = {} if stock[i] == STOCK_NULL else {'stock': Decimal(stock[i])}
+            for field, offsets, lengths in columns:
+                length = lengths[i]
+                if length != NULL_LENGTH:
+                    item[field] = strings[offsets[i]:offsets[i] + length].decode('utf-8')
+            if 'price' in item:
+                item['price'] = Decimal(item['price'])
+            attributes = item.pop(ATTRIBUTES_COLUMN, None)
+            if attributes:
+                # Numbers come back as Decimals, like boto3 returns them
+                item.update(json.loads(attributes, parse_float=Decimal, parse_int=Decimal))
+            yield item
+
+    def close(self):
+        # Views into the mapping must be released before it can be closed
+        self.records = None
+        self._strings = None
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_snapshot(path=SNAPSHOT_PATH, max_age=SNAPSHOT_MAX_AGE):
+    """Open the snapshot if there is a usable one, otherwise return None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = CatalogSnapshot(path)
+    except (OSError, ValueError, KeyError, SnapshotError) as e:
+        print(f"Ignoring catalog snapshot {path}: {str(e)}")
+        return None
+    if max_age and snapshot.age > max_age:
+        print(f"Ignoring catalog snapshot {path}: {int(snapshot.age)}s old")
+        snapshot.close()
+        return None
+    return snapshot
+
+
+class CatalogSnapshotWriter:
+    """
+    Background thread that rewrites the catalog snapshot every interval seconds.
+    Several workers can share one snapshot file; a worker skips its turn if
+    another one wrote the file recently. on_refresh, if given, is called with
+    the products of every new snapshot, whichever worker wrote it.
+    """
+
+    def __init__(self, load_products, path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL, on_refresh=None):
+        self.load_products = load_products
+        self.path = path
+        self.interval = interval
+        self.on_refresh = on_refresh
+        self._seen_mtime = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_fresh(self):
+        try:
+            return time.time() - os.path.getmtime(self.path) < self.interval
+        except OSError:
+            return False
+
+    def write(self, products=None):
+        """Write a snapshot of products, scanning the catalog when none are given"""
+        started = time.time()
+        products = list(self.load_products() if products is None else products)
+        count = write_snapshot(products, self.path)
+        self._seen_mtime = os.path.getmtime(self.path)
+        print(f"Wrote catalog snapshot with {count} products in {time.time() - started:.2f}s")
+        return products
+
+    def read(self):
+        """Products of a snapshot another worker wrote since we last looked, or None"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        if mtime == self._seen_mtime:
+            return None
+        snapshot = load_snapshot(self.path, max_age=None)
+        if snapshot is None:
+            return None
+        with snapshot:
+            products = list(snapshot)
+        self._seen_mtime = mtime
+        return products
+
+    def mark_seen(self):
+        try:
+            self._seen_mtime = os.path.getmtime(self.path)
+        except OSError:
+            pass
+
+    def run_forever(self):
+        while True:
+            try:
+                products = self.read() if self.is_fresh() else self.write()
+                if products is not None and self.on_refresh:
+                    self.on_refresh(products)
+            except Exception as e:
+                print(f"Error refreshing catalog snapshot: {str(e)}")
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='catalog-snapshot', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,280 @@
+import bisect
+import json
+import re
+import threading
+from datetime import datetime
+import numpy as np
+from util.pagination import encode_cursor, decode_cursor
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# Same field boosts as the fuzzy multi_match in ProductSearch.build_fuzzy_query
+FIELD_WEIGHTS = {
+    'name': 5.0,
+    'brand_name': 4.0,
+    'category_id': 4.0,
+    'description': 0.2
+}
+# Expansions for the last query term, which is matched as a prefix
+MAX_PREFIX_EXPANSIONS = 50
+PRICE_BUCKETS = [(None, 100), (100, 500), (500, 1000), (1000, 4000), (4000, 10000), (10000, None)]
+BRAND_FACET_SIZE = 50
+CATEGORY_FACET_SIZE = 20
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower()) if text else []
+
+
+def _epoch_millis(value):
+    # OpenSearch sorts dates by epoch milliseconds; use the same values for search_after
+    try:
+        return int(datetime.fromisoformat(str(value)).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _range_key(low, high):
+    return f"{'*' if low is None else float(low)}-{'*' if high is None else float(high)}"
+
+
+class LocalSearchEngine:
+    """
+    Degraded-mode product search over an in-memory copy of the catalog.
+    Numeric and keyword fields are NumPy columns and text fields go into a
+    per-field inverted index, so filters, scoring and facets are vectorized.
+    Results have the same shape as ProductSearch.process_search_response,
+    at lower relevance (exact and prefix terms only, no fuzziness or phrases).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    @property
+    def ready(self):
+        return self._state is not None
+
+    def __len__(self):
+        return 0 if self._state is None else len(self._state['product_ids'])
+
+    def build(self, products):
+        """Rebuild the engine from an iterable of catalog items; searches keep using the old copy until done"""
+        sources = []
+        for product in products:
+            if not product.get('product_id'):
+                continue
+            sources.append({
+                'product_id': product['product_id'],
+                'name': product.get('name'),
+                'brand_name': product.get('brand_name'),
+                'category_id': product.get('category_id'),
+                'description': product.get('description'),
+                'product_image_url': product.get('product_image_url'),
+                'price': float(product['price']) if product.get('price') is not None else 0.0,
+                'stock': int(product.get('stock') or 0),
+                'created_at': product.get('created_at'),
+                'updated_at': product.get('updated_at')
+            })
+        # Row order is product_id order, which is also the final tie-breaker
+        sources.sort(key=lambda s: s['product_id'])
+
+        brands, brand_codes = np.unique([s['brand_name'] or '' for s in sources], return_inverse=True)
+        categories, category_codes = np.unique([s['category_id'] or '' for s in sources], return_inverse=True)
+        names = [s['name'] or '' for s in sources]
+
+        postings = {}
+        for row, source in enumerate(sources):
+            for field in FIELD_WEIGHTS:
+                for token in set(tokenize(source[field])):
+                    postings.setdefault(token, {}).setdefault(field, []).append(row)
+        index = {
+            token: {field: np.array(rows, dtype=np.int32) for field, rows in fields.items()}
+            for token, fields in postings.items()
+        }
+
+        state = {
+            'sources': sources,
+            'product_ids': [s['product_id'] for s in sources],
+            'price': np.array([s['price'] for s in sources], dtype=np.float64),
+            'stock': np.array([s['stock'] for s in sources], dtype=np.int64),
+            'created_at': np.array([_epoch_millis(s['created_at']) for s in sources], dtype=np.int64),
+            'name_rank': np.argsort(np.argsort(np.array(names, dtype=object), kind='stable'), kind='stable'),
+            'names': names,
+            'brands': brands.tolist(),
+            'brand_codes': brand_codes.astype(np.int32),
+            'categories': categories.tolist(),
+            'category_codes': category_codes.astype(np.int32),
+            'index': index,
+            'vocabulary': sorted(index)
+        }
+        with self._lock:
+            self._state = state
+
+    def _expand(self, state, token, prefix):
+        if not prefix:
+            return [token] if token in state['index'] else []
+        vocabulary = state['vocabulary']
+        i = bisect.bisect_left(vocabulary, token)
+        terms = []
+        while i < len(vocabulary) and vocabulary[i].startswith(token) and len(terms) < MAX_PREFIX_EXPANSIONS:
+            terms.append(vocabulary[i])
+            i += 1
+        return terms
+
+    def _score(self, state, search_term):
+        """BM25-free scoring: sum of field boosts of the matched terms; every term must match"""
+        tokens = tokenize(search_term)
+        count = len(state['product_ids'])
+        scores = np.zeros(count, dtype=np.float64)
+        mask = np.ones(count, dtype=bool)
+        for position, token in enumerate(tokens):
+            term_scores = np.zeros(count, dtype=np.float64)
+            for term in self._expand(state, token, prefix=position == len(tokens) - 1):
+                for field, rows in state['index'][term].items():
+                    np.maximum.at(term_scores, rows, FIELD_WEIGHTS[field])
+            mask &= term_scores > 0
+            scores += term_scores
+        return scores, mask
+
+    @staticmethod
+    def _filter(state, query_params, mask):
+        if query_params.get('category_id'):
+            try:
+                code = state['categories'].index(query_params['category_id'])
+                mask &= state['category_codes'] == code
+            except ValueError:
+                mask[:] = False
+
+        price_ranges = query_params.get('price_ranges')
+        if price_ranges:
+            if isinstance(price_ranges, str):
+                price_ranges = json.loads(price_ranges)
+            price = state['price']
+            in_range = np.zeros(len(price), dtype=bool)
+            for price_range in price_ranges:
+                selected = np.ones(len(price), dtype=bool)
+                if price_range.get('min') is not None:
+                    selected &= price >= float(price_range['min'])
+                if price_range.get('max') is not None:
+                    selected &= price <= float(price_range['max'])
+                in_range |= selected
+            mask &= in_range
+        return mask
+
+    @staticmethod
+    def _facets(state, rows):
+        price = state['price'][rows]
+        price_buckets = []
+        for low, high in PRICE_BUCKETS:
+            selected = np.ones(len(price), dtype=bool)
+            bucket = {'key': _range_key(low, high)}
+            if low is not None:
+                selected &= price >= low
+                bucket['from'] = float(low)
+            if high is not None:
+                selected &= price < high
+                bucket['to'] = float(high)
+            bucket['doc_count'] = int(selected.sum())
+            price_buckets.append(bucket)
+
+        def terms(codes, labels, size):
+            counts = np.bincount(codes[rows], minlength=len(labels))
+            ranked = sorted(
+                ((labels[code], int(n)) for code, n in enumerate(counts) if n and labels[code]),
+                key=lambda bucket: (-bucket[1], bucket[0])
+            )
+            return {'buckets': [{'key': key, 'doc_count': n} for key, n in ranked[:size]]}
+
+        return {
+            'price_ranges': {'buckets': price_buckets},
+            'brands': terms(state['brand_codes'], state['brands'], BRAND_FACET_SIZE),
+            'categories': terms(state['category_codes'], state['categories'], CATEGORY_FACET_SIZE)
+        }
+
+    @staticmethod
+    def _sort_values(state, sort_field, scores):
+        if sort_field == 'price':
+            return state['price'], state['price']
+        if sort_field == 'created_at':
+            return state['created_at'], state['created_at']
+        if sort_field == 'name.keyword':
+            return state['name_rank'], state['names']
+        return scores, scores
+
+    def search(self, query_params):
+        """Answer validated search params (see SearchAPI.validate_search_params)"""
+        with self._lock:
+            state = self._state
+        if state is None:
+            raise Exception("Local search index is not ready")
+
+        count = len(state['product_ids'])
+        if query_params.get('search_term'):
+            scores, mask = self._score(state, query_params['search_term'])
+        else:
+            scores, mask = np.ones(count, dtype=np.float64), np.ones(count, dtype=bool)
+        mask = self._filter(state, query_params, mask)
+        rows = np.flatnonzero(mask)
+
+        sort_field = query_params.get('sort_by', '_score')
+        descending = query_params.get('sort_order', 'desc') == 'desc'
+        keys, values = self._sort_values(state, sort_field, scores)
+        primary = keys[rows]
+        # lexsort sorts by the last key first; rows are already in product_id order
+        order = rows[np.lexsort((rows, -primary if descending else primary))]
+
+        page = int(query_params.get('page', 1))
+        size = int(query_params.get('size', 20))
+        cursor_mode = 'cursor' in query_params
+        if cursor_mode:
+            cursor = decode_cursor(query_params['cursor']) or {}
+            search_after = cursor.get('search_after')
+            if search_after:
+                order = self._after(state, order, values, search_after, descending)
+            selected = order[:size]
+        else:
+            selected = order[(page - 1) * size:page * size]
+
+        fields = query_params.get('fields')
+        hits = []
+        for row in selected.tolist():
+            value = values[row]
+            source = state['sources'][row]
+            hits.append({
+                '_source': {k: v for k, v in source.items() if k in fields} if fields else source,
+                '_score': float(scores[row]),
+                'sort': [value.item() if hasattr(value, 'item') else value, state['product_ids'][row]]
+            })
+
+        results = {
+            'hits': hits,
+            'total': int(len(rows)),
+            'aggregations': self._facets(state, rows),
+            'page': page,
+            'size': size,
+            'degraded': True
+        }
+        if cursor_mode:
+            results['next_cursor'] = encode_cursor({'search_after': hits[-1]['sort']}) if len(hits) == size else None
+        return results
+
+    @staticmethod
+    def _after(state, order, values, search_after, descending):
+        """Drop the rows up to and including the search_after position"""
+        after_value, after_id = search_after[0], search_after[-1]
+        for position, row in enumerate(order.tolist()):
+            value = values[row]
+            value = value.item() if hasattr(value, 'item') else value
+            try:
+                if value == after_value:
+                    later = state['product_ids'][row] > after_id
+                else:
+                    later = value < after_value if descending else value > after_value
+            except TypeError:
+                return order[:0]
+            if later:
+                return order[position:]
+        return order[:0]
+
+
+local_search = LocalSearchEngine()
@@ -1,40 +1,41 @@
 from datetime import datetime, timezone
 from util.db_utils import DynamoDB, DynamoDBError
-from model.product_data import Product
-from opensearchpy import OpenSearch, RequestsHttpConnection
-from requests_aws4auth import AWS4Auth
-from util.secrets_utils import get_secret
-import boto3
-import json
+from model.product_data import Product, PRODUCT_FIELDS, load_product_records
+from model.stock_shards import (ShardedStock, InsufficientShardedStockError, NotShardedError,
+                                LinkedConditionError, check_linked)
+from model.stock_reservations import (StockReservations, ReservationConflictError, items_digest,
+                                      RESERVING, RESERVED, FAILED, RELEASING, RELEASED)
+from util.opensearch_utils import get_opensearch_client
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from opensearchpy import helpers
 import os
+import time
+
+BATCH_GET_CHUNK_SIZE = 100
+BATCH_WRITE_CHUNK_SIZE = 25
+BULK_CHUNK_SIZE = 500
+TRANSACT_MAX_ITEMS = 100
+# Products per stock transaction, leaving one item for the reservation record
+STOCK_CHUNK_ITEMS = TRANSACT_MAX_ITEMS - 1
+BULK_MAX_CHUNK_BYTES = 5 * 1024 * 1024
+
+class StockReservationError(Exception):
+    """Raised when stock could not be reserved for some of the requested products"""
+    def __init__(self, message, failed_product_ids, sharded_product_ids=()):
+        super().__init__(message)
+        self.failed_product_ids = failed_product_ids
+        # Failed because their stock lives in shards, not because it ran out
+        self.sharded_product_ids = list(sharded_product_ids)
 
 class ProductModel:
+    _index_ready = False
    
-    # Initialize OpenSearch client
-    def  get_opensearch_client():
-        # Get OpenSearch configuration from Secrets Manager
+    # Shared, pooled OpenSearch client for this worker process
+    @staticmethod
+    def get_opensearch_client():
         try:
-            if os.environ.get('opensearch_secret')=='':
-                os.environ['opensearch_secret'] = get_secret('opensearch/config') 
-
-            secrets = json.loads(os.environ.get('opensearch_secret'))
-
-            host = secrets.get('host')
-            region = secrets.get('region')
-            master_user_name = secrets.get('master_user_name')
-            master_user_password = secrets.get('master_user_password')
-
-
-            return OpenSearch(
-                hosts=[{'host': host, 'port': 443}],
-                http_auth=(master_user_name, master_user_password),  # Replace with your master user credentials
-                use_ssl=True,
-                verify_certs=True,
-                connection_class=RequestsHttpConnection,
-                timeout=30,  # Increase timeout to 30 seconds
-                retry_on_timeout=True,
-                max_retries=3
-            )
+            return get_opensearch_client()
         except Exception as e:
             print(f"Error initializing OpenSearch client: {str(e)}")
             raise e
@@ -99,6 +100,8 @@ class ProductModel:
                     },
                     "sku": {"type": "keyword"},
                     "stock": {"type": "integer"},
+                    # Version of the last change applied by the search sync
+                    "sync_version": {"type": "long"},
                     "created_at": {"type": "date"},
                     "updated_at": {"type": "date"},
                     "specifications": {
@@ -164,126 +167,336 @@ class ProductModel:
 
             
     @staticmethod
-    def index_product(product):
+    def build_search_document(product):
         # Prepare document with enhanced data
-        document = {
+        return {
             'product_id': product['product_id'],
             'name': product['name'],
             'brand_name': product['brand_name'],
             'category_id': product['category_id'],
-            'description': product['description'],
-            'product_image_url': product['product_image_url'],
+            'description': product.get('description', ''),
+            'product_image_url': product.get('product_image_url', ''),
             'price': float(product['price']),
             'tags': product.get('tags', []),
             'specifications': product.get('specifications', []),
             'variants': product.get('variants', []),
             'stock': product.get('stock', 0),
             'created_at': product.get('created_at', datetime.now().isoformat()),
-            'updated_at': datetime.now().isoformat()
+            # The stored timestamp, which is also the document's sync version
+            'updated_at': product.get('updated_at') or datetime.now().isoformat()
         }
-        
-        try:
-            opensearch_client = ProductModel.get_opensearch_client()
-            print("OpenSearch Client Configuration:", opensearch_client.transport.hosts)
-            
 
-            # Create index with mapping if it doesn't exist
-            if not opensearch_client.indices.exists(index='products'):
-                opensearch_client.indices.create(
-                    index='products',
-                    body=ProductModel.create_index_mapping()
-                )
+    @staticmethod
+    def search_version(product):
+        """External search document version of a stored product: its updated_at in microseconds"""
+        try:
+            updated_at = datetime.fromisoformat(str(product.get('updated_at')))
+        except ValueError:
+            return 1
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        return int(updated_at.timestamp() * 1000000)
 
-            # Index the document
-            print("Indexing document:", document)
-            response = opensearch_client.index(
+    @staticmethod
+    def ensure_products_index(opensearch_client):
+        # Create index with mapping if it doesn't exist, checked once per process
+        if ProductModel._index_ready:
+            return
+        if not opensearch_client.indices.exists(index='products'):
+            opensearch_client.indices.create(
                 index='products',
-                body=document,
-                id=str(product['product_id']),
-                refresh=True
+                body=ProductModel.create_index_mapping()
             )
+        ProductModel._index_ready = True
 
-            # # Verify the document was indexed
-            # verify = opensearch_client.get(
-            #     index='products',
-            #     id=str(product['product_id'])
-            # )
-            # print("Verification response:", verify)
+    @staticmethod
+    def index_products(products, index='products', refresh=True, versioned=False):
+        """
+        Index many products through the _bulk API in chunks capped by size,
+        refreshing the index once at the end unless refresh is False.
+        versioned writes use the product's updated_at as an external version,
+        so they never replace a newer document written by the search sync.
+        Returns a dict of product_id -> error message for documents that failed.
+        """
+        opensearch_client = ProductModel.get_opensearch_client()
+        if index == 'products':
+            ProductModel.ensure_products_index(opensearch_client)
 
-            print('indexed the product successfully')
-            return response
-        
-        except Exception as e:
-            print(f"Error indexing product: {str(e)}")
-            print(f"Error type: {type(e)}")
-            print(f"Full error details: {e.__dict__}")
-            raise e
-        
-    
+        def action(product):
+            document = {
+                '_index': index,
+                '_id': str(product['product_id']),
+                '_source': ProductModel.build_search_document(product)
+            }
+            if versioned:
+                version = ProductModel.search_version(product)
+                document['_source']['sync_version'] = version
+                document.update(version=version, version_type='external')
+            return document
+
+        actions = (action(product) for product in products)
+
+        errors = {}
+        for ok, info in helpers.streaming_bulk(
+            opensearch_client,
+            actions,
+            chunk_size=BULK_CHUNK_SIZE,
+            max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+            raise_on_error=False,
+            raise_on_exception=False,
+            max_retries=3
+        ):
+            if not ok:
+                result = info.get('index', {})
+                # A newer version is already indexed
+                if versioned and result.get('status') == 409:
+                    continue
+                errors[result.get('_id')] = str(result.get('error', result))
+
+        if refresh:
+            opensearch_client.indices.refresh(index=index)
+        return errors
 
     @staticmethod
-    def create_product(product_data):
+    def create_products(products_data):
+        """
+        Write many products with a DynamoDB batch writer.
+        Returns one result per input product, in order, with the stored Product
+        or the error that prevented it from being stored.
+        """
         table_name = 'Products'
         con = DynamoDB.get_connection()
         table = con.Table(table_name)
         current_time = datetime.now(timezone.utc).isoformat()
-        product_data['product_id'] = product_data.get('product_id', os.urandom(8).hex())
-        product_data['created_at'] = current_time
-        product_data['updated_at'] = current_time
 
-        
-        product = Product.from_dict(product_data)
-        
-        try:
-            table.put_item(Item=product.to_dict())
-            return product
-        except DynamoDBError as e:
-            # amazonq-ignore-next-line
-            raise Exception(f"Error creating and inserting the product: {str(e)}")
+        results = []
+        for product_data in products_data:
+            try:
+                product_data['product_id'] = product_data.get('product_id', os.urandom(8).hex())
+                product_data['created_at'] = current_time
+                product_data['updated_at'] = current_time
+                results.append({'product': Product.from_dict(product_data), 'error': None})
+            except (TypeError, ValueError, ArithmeticError) as e:
+                results.append({'product': None, 'error': f"Invalid product: {str(e)}"})
+
+        valid = [result for result in results if result['product'] is not None]
+        # One batch writer per chunk so that a failure is attributed to that chunk only
+        for i in range(0, len(valid), BATCH_WRITE_CHUNK_SIZE):
+            chunk = valid[i:i + BATCH_WRITE_CHUNK_SIZE]
+            try:
+                with table.batch_writer(overwrite_by_pkeys=['product_id']) as batch:
+                    for result in chunk:
+                        batch.put_item(Item=result['product'].to_dict())
+            except Exception as e:
+                for result in chunk:
+                    result['error'] = f"Error creating and inserting the product: {str(e)}"
+                    result['product'] = None
+        return results
+
+    @staticmethod
+    def _projection(fields):
+        """
+        ProjectionExpression kwargs for a sparse fieldset. Names are aliased
+        because several attributes (name, description) are reserved words.
+        """
+        if not fields:
+            return {}
+        # Sharded stock is summed from the cached shard counts, see ShardedStock.overlay
+        names = {f'#f{i}': attribute for i, attribute in enumerate(fields)}
+        return {
+            'ProjectionExpression': ', '.join(names),
+            'ExpressionAttributeNames': names
+        }
+
+    @staticmethod
+    def _finish_items(items):
+        ShardedStock.overlay(items)
+        # Shard bookkeeping is internal to the stock counters
+        for item in items:
+            item.pop('stock_shards', None)
+            item.pop('stock_sharded_until', None)
+        return items
 
     @staticmethod
-    def get_all_products(category_id=None):
+    def get_all_products(category_id=None, fields=None):
+        if category_id:
+            items = []
+            start_key = None
+            while True:
+                page, start_key = ProductModel.get_products_by_category(
+                    category_id, exclusive_start_key=start_key, fields=fields
+                )
+                items.extend(page)
+                if not start_key:
+                    return items
+
         table_name = 'Products'
         con = DynamoDB.get_connection()
         table = con.Table(table_name)
-        print(category_id)
         try:
-            if category_id:
-                response = table.scan(
-                    FilterExpression='category_id = :category_id',
-                    ExpressionAttributeValues={':category_id': category_id}
-                )
-            else:
-                response = table.scan()
-
+            scan_kwargs = ProductModel._projection(fields)
+            response = table.scan(**scan_kwargs)
             items = response.get('Items', [])
             
             while 'LastEvaluatedKey' in response:
                 response = table.scan(
-                    ExclusiveStartKey=response['LastEvaluatedKey']
+                    ExclusiveStartKey=response['LastEvaluatedKey'],
+                    **scan_kwargs
                 )
                 items.extend(response['Items'])
             
-            return items
+            return ProductModel._finish_items(items)
             # return [Product.from_dict(item) for item in items]
         except DynamoDBError as e:
             # amazonq-ignore-next-line
             raise Exception(f"Error fetching products from the db: {str(e)}")
 
+    @staticmethod
+    def get_products_page(limit=None, exclusive_start_key=None, fields=None):
+        """
+        Scan one page of the Products table, optionally projected to a fieldset.
+        Returns the items and the LastEvaluatedKey to resume from (None on the last page).
+        """
+        table_name = 'Products'
+        con = DynamoDB.get_connection()
+        table = con.Table(table_name)
+        try:
+            scan_kwargs = ProductModel._projection(fields)
+            if limit:
+                scan_kwargs['Limit'] = limit
+            if exclusive_start_key:
+                scan_kwargs['ExclusiveStartKey'] = exclusive_start_key
+
+            response = table.scan(**scan_kwargs)
+            return ProductModel._finish_items(response.get('Items', [])), response.get('LastEvaluatedKey')
+        except DynamoDBError as e:
+            # amazonq-ignore-next-line
+            raise Exception(f"Error fetching products from the db: {str(e)}")
+
+    @staticmethod
+    def iter_all_products(page_size=None, fields=None):
+        """Yield every product, fetching one DynamoDB page at a time"""
+        start_key = None
+        while True:
+            items, start_key = ProductModel.get_products_page(
+                limit=page_size, exclusive_start_key=start_key, fields=fields
+            )
+            for item in items:
+                yield item
+            if not start_key:
+                return
+
+    @staticmethod
+    def iter_product_records(page_size=None):
+        """Like iter_all_products, but each page is converted to compact ProductRecords"""
+        start_key = None
+        while True:
+            items, start_key = ProductModel.get_products_page(limit=page_size, exclusive_start_key=start_key)
+            yield from load_product_records(items)
+            if not start_key:
+                return
+
+    @staticmethod
+    def scan_segment(segment, total_segments, page_size=None):
+        """
+        Yield the pages of one segment of a parallel Scan of the Products table.
+        Each of total_segments workers scans a disjoint part of the table.
+        """
+        table_name = 'Products'
+        con = DynamoDB.get_connection()
+        table = con.Table(table_name)
+        try:
+            scan_kwargs = {'Segment': segment, 'TotalSegments': total_segments}
+            if page_size:
+                scan_kwargs['Limit'] = page_size
+            while True:
+                response = table.scan(**scan_kwargs)
+                yield ProductModel._finish_items(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    return
+                scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except DynamoDBError as e:
+            # amazonq-ignore-next-line
+            raise Exception(f"Error scanning products segment {segment}: {str(e)}")
+
+    @staticmethod
+    def get_products_by_category(category_id, limit=None, exclusive_start_key=None, fields=None):
+        """
+        Query one page of a category from the CategoryIndex GSI, optionally projected to a fieldset.
+        Returns the items and the LastEvaluatedKey to resume from (None on the last page).
+        """
+        table_name = 'Products'
+        con = DynamoDB.get_connection()
+        table = con.Table(table_name)
+        try:
+            query_kwargs = {
+                'IndexName': 'CategoryIndex',
+                'KeyConditionExpression': Key('category_id').eq(category_id),
+                **ProductModel._projection(fields)
+            }
+            if limit:
+                query_kwargs['Limit'] = limit
+            if exclusive_start_key:
+                query_kwargs['ExclusiveStartKey'] = exclusive_start_key
+
+            response = table.query(**query_kwargs)
+            return ProductModel._finish_items(response.get('Items', [])), response.get('LastEvaluatedKey')
+        except DynamoDBError as e:
+            # amazonq-ignore-next-line
+            raise Exception(f"Error fetching products for category {category_id}: {str(e)}")
+
     @staticmethod        
-    def get_product(product_id):
+    def get_product(product_id, fields=None):
         table_name = 'Products'
         con = DynamoDB.get_connection()
         table = con.Table(table_name)
         try:
-            response = table.get_item(Key={'product_id': product_id})
+            response = table.get_item(Key={'product_id': product_id}, **ProductModel._projection(fields))
             item = response.get('Item')
+            if item:
+                ProductModel._finish_items([item])
             return item
         
         except DynamoDBError as e:
             # amazonq-ignore-next-line
             raise Exception(f"Error fetching products from the db for id {product_id}: {str(e)}")
 
+    @staticmethod
+    def batch_get_products(product_ids, max_attempts=5, fields=None):
+        """
+        Fetch many products with BatchGetItem, 100 keys per request, optionally projected to a fieldset.
+        Unprocessed keys are retried with exponential backoff.
+        Returns a dict of product_id -> item; ids that do not exist are absent.
+        """
+        table_name = 'Products'
+        con = DynamoDB.get_connection()
+        products = {}
+        try:
+            for i in range(0, len(product_ids), BATCH_GET_CHUNK_SIZE):
+                request_items = {
+                    table_name: {
+                        'Keys': [{'product_id': pid} for pid in product_ids[i:i + BATCH_GET_CHUNK_SIZE]],
+                        **ProductModel._projection(fields)
+                    }
+                }
+                attempt = 0
+                while request_items:
+                    response = con.batch_get_item(RequestItems=request_items)
+                    for item in response.get('Responses', {}).get(table_name, []):
+                        products[item['product_id']] = item
+
+                    request_items = response.get('UnprocessedKeys') or {}
+                    if request_items:
+                        attempt += 1
+                        if attempt >= max_attempts:
+                            raise Exception(f"Unprocessed keys remained after {max_attempts} attempts")
+                        time.sleep(min(0.05 * (2 ** attempt), 1.0))
+            ProductModel._finish_items(list(products.values()))
+            return products
+        except DynamoDBError as e:
+            # amazonq-ignore-next-line
+            raise Exception(f"Error batch fetching products from the db: {str(e)}")
+
     @staticmethod
     def delete_product(product_id):
         table_name = 'Products'
@@ -308,21 +521,41 @@ class ProductModel:
             current_time = datetime.now(timezone.utc).isoformat()
             updated_data['updated_at'] = current_time
             product = Product.from_dict(updated_data)
+            attributes = {
+                'price': product.price,
+                'updated_at': product.updated_at,
+                'description': product.description
+            }
 
-            response = table.update_item(
-                Key={'product_id': product_id},
-                UpdateExpression="SET  price = :price, stock = :stock, updated_at = :updated_at, description = :description",
-                ExpressionAttributeValues={
-                    ':price': product.price,    
-                    ':stock': product.stock,
-                    ':updated_at': product.updated_at,
-                    ':description': product.description
-                },
-                ReturnValues="ALL_NEW"
-            )
+            if ShardedStock.is_sharded(product_id):
+                try:
+                    return ProductModel._update_sharded(table, product_id, product.stock, attributes)
+                except NotShardedError:
+                    # Folded back since this worker loaded its shard registry
+                    pass
+
+            try:
+                response = table.update_item(
+                    Key={'product_id': product_id},
+                    UpdateExpression="SET  price = :price, stock = :stock, updated_at = :updated_at, description = :description",
+                    ConditionExpression="attribute_not_exists(stock_shards)",
+                    ExpressionAttributeValues={
+                        ':price': product.price,    
+                        ':stock': product.stock,
+                        ':updated_at': product.updated_at,
+                        ':description': product.description
+                    },
+                    ReturnValues="ALL_NEW"
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                # Sharded since this worker loaded its shard registry
+                ShardedStock.shard_counts(refresh=True)
+                return ProductModel._update_sharded(table, product_id, product.stock, attributes)
 
             if 'Attributes' in response:
-                return response['Attributes']
+                return ProductModel._finish_items([response['Attributes']])[0]
             return None
         except DynamoDBError as e:
             # amazonq-ignore-next-line
@@ -334,17 +567,281 @@ class ProductModel:
         con = DynamoDB.get_connection()
         table = con.Table(table_name)
         try:
-            response = table.update_item(
-                Key={'product_id': product_id},
-                UpdateExpression="SET stock = :stock",
-                ExpressionAttributeValues={':stock': updated_stock},
-                ReturnValues="ALL_NEW"
-            )
+            if ShardedStock.is_sharded(product_id):
+                try:
+                    return ProductModel._stored_product(ProductModel._update_sharded(table, product_id, updated_stock))
+                except NotShardedError:
+                    # Folded back since this worker loaded its shard registry
+                    pass
+
+            # Touch updated_at too, it is the product's version for ETags
+            try:
+                response = table.update_item(
+                    Key={'product_id': product_id},
+                    UpdateExpression="SET stock = :stock, updated_at = :updated_at",
+                    ConditionExpression="attribute_not_exists(stock_shards)",
+                    ExpressionAttributeValues={
+                        ':stock': updated_stock,
+                        ':updated_at': datetime.now(timezone.utc).isoformat()
+                    },
+                    ReturnValues="ALL_NEW"
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                # Sharded since this worker loaded its shard registry
+                ShardedStock.shard_counts(refresh=True)
+                return ProductModel._stored_product(ProductModel._update_sharded(table, product_id, updated_stock))
 
             if 'Attributes' in response:
-                return Product.from_dict(response['Attributes'])
+                return ProductModel._stored_product(response['Attributes'])
             return None
         except DynamoDBError as e:
             # amazonq-ignore-next-line
             raise Exception(f"Error updating stock for product {product_id}: {str(e)}")
 
+    @staticmethod
+    def _stored_product(item):
+        """Product of a stored item; attributes that are not product fields (tags, shard bookkeeping) are left out"""
+        return Product.from_dict({k: v for k, v in item.items() if k in PRODUCT_FIELDS})
+
+    @staticmethod
+    def _update_sharded(table, product_id, updated_stock, attributes=None):
+        """
+        Hot product: spread the new total over its shards, base stock stays 0.
+        The other attributes are set on the base item; returns it with the summed stock.
+        """
+        ShardedStock.set_stock(product_id, updated_stock)
+        attributes = {'updated_at': datetime.now(timezone.utc).isoformat(), **(attributes or {})}
+        # Aliased, description is a reserved word
+        names = {f'#a{i}': name for i, name in enumerate(attributes)}
+        response = table.update_item(
+            Key={'product_id': product_id},
+            UpdateExpression="SET " + ", ".join(f"#a{i} = :a{i}" for i in range(len(names))),
+            ConditionExpression="attribute_exists(product_id)",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={f':a{i}': value for i, value in enumerate(attributes.values())},
+            ReturnValues="ALL_NEW"
+        )
+        return ProductModel._finish_items([response['Attributes']])[0]
+
+    @staticmethod
+    def _stock_transaction(items, reserve, linked=()):
+        """
+        Adjust stock for up to STOCK_CHUNK_ITEMS products in one TransactWriteItems,
+        together with the linked transact items (the reservation record).
+        Reservations only succeed if every product has at least qty in stock.
+        """
+        table_name = 'Products'
+        con = DynamoDB.get_connection()
+        current_time = datetime.now(timezone.utc).isoformat()
+        transact_items = []
+        for product_id, qty in items:
+            update = {
+                'TableName': table_name,
+                'Key': {'product_id': product_id},
+                'UpdateExpression': 'SET updated_at = :updated_at ADD stock :delta',
+                'ConditionExpression': 'attribute_exists(product_id)',
+                'ExpressionAttributeValues': {
+                    ':delta': -qty if reserve else qty,
+                    ':updated_at': current_time
+                }
+            }
+            if reserve:
+                update['ConditionExpression'] += ' AND stock >= :qty'
+                update['ExpressionAttributeValues'][':qty'] = qty
+                # Shows whether a failed product ran out or had its stock moved to shards
+                update['ReturnValuesOnConditionCheckFailure'] = 'ALL_OLD'
+            transact_items.append({'Update': update})
+
+        try:
+            con.meta.client.transact_write_items(TransactItems=transact_items + list(linked))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            check_linked(e, len(transact_items))
+            reasons = e.response.get('CancellationReasons', [])
+            failed = []
+            sharded = []
+            for (product_id, _), reason in zip(items, reasons):
+                if reason.get('Code') == 'ConditionalCheckFailed':
+                    failed.append(product_id)
+                    if 'stock_shards' in reason.get('Item', {}):
+                        sharded.append(product_id)
+            if not failed:
+                raise
+            raise StockReservationError(
+                'Insufficient stock' if reserve else 'Product not found', failed, sharded
+            )
+
+    @staticmethod
+    def _split_sharded(items, refresh=False):
+        sharded_ids = ShardedStock.sharded_product_ids(refresh=refresh)
+        hot = [(pid, qty) for pid, qty in items if pid in sharded_ids]
+        regular = [(pid, qty) for pid, qty in items if pid not in sharded_ids]
+        return hot, regular
+
+    @staticmethod
+    def _reserve(items, reservation_id=None, attempt=None):
+        """
+        Take stock for a list of (product_id, qty), all or nothing.
+        Each worker caches which products are sharded; when that cache turns
+        out to be stale (a product was just sharded or folded back) the cart
+        is retried once on the other path.
+        """
+        hot, regular = ProductModel._split_sharded(items)
+        try:
+            ProductModel._reserve_parts(hot, regular, reservation_id, attempt)
+            return
+        except StockReservationError as e:
+            if not e.sharded_product_ids:
+                raise
+            # Sharded since the registry was loaded: their base stock is 0
+            hot, regular = ProductModel._split_sharded(items, refresh=True)
+        except NotShardedError:
+            # Folded back since the registry was loaded; it was dropped from the cache
+            hot, regular = ProductModel._split_sharded(items)
+        ProductModel._reserve_parts(hot, regular, reservation_id, attempt)
+
+    @staticmethod
+    def _reserve_parts(hot, regular, reservation_id=None, attempt=None):
+        """
+        Carts up to STOCK_CHUNK_ITEMS products are one transaction; larger carts
+        are reserved chunk by chunk and everything taken is given back if one fails.
+        Sharded (hot) products are taken from their shards first.
+        For a recorded reservation every change also updates the products it
+        holds. Products an interrupted attempt already took are skipped, and a
+        failure gives back whatever the record holds, including a chunk whose
+        transaction failed without saying whether it was applied.
+        """
+        items = hot + regular
+        if reservation_id:
+            held = StockReservations.held(reservation_id)
+            hot = [(pid, qty) for pid, qty in hot if pid not in held]
+            regular = [(pid, qty) for pid, qty in regular if pid not in held]
+
+        taken = []
+        reserved = []
+        try:
+            for product_id, qty in hot:
+                ShardedStock.decrement(product_id, qty,
+                                       linked=StockReservations.hold(reservation_id, attempt, [product_id]))
+                taken.append((product_id, qty))
+            for i in range(0, len(regular), STOCK_CHUNK_ITEMS):
+                chunk = regular[i:i + STOCK_CHUNK_ITEMS]
+                linked = StockReservations.hold(reservation_id, attempt, [pid for pid, _ in chunk])
+                ProductModel._stock_transaction(chunk, reserve=True, linked=linked)
+                reserved.extend(chunk)
+        except LinkedConditionError:
+            # Another attempt took the reservation over, along with what it holds
+            raise
+        except InsufficientShardedStockError:
+            ProductModel._compensate(items, taken, reserved, reservation_id, attempt)
+            raise StockReservationError('Insufficient stock', [hot[len(taken)][0]])
+        except Exception:
+            ProductModel._compensate(items, taken, reserved, reservation_id, attempt)
+            raise
+
+    @staticmethod
+    def _compensate(items, taken, reserved, reservation_id=None, attempt=None):
+        """Give back what a failed reservation took: per its record, or what this call knows it took"""
+        if reservation_id:
+            ProductModel._release(items, reservation_id, attempt)
+        else:
+            ProductModel._release_parts(taken, reserved)
+
+    @staticmethod
+    def _return_sharded(product_id, qty, linked=()):
+        try:
+            ShardedStock.increment(product_id, qty, linked=linked)
+        except NotShardedError:
+            # Folded back meanwhile: the base item now holds the stock
+            ProductModel._stock_transaction([(product_id, qty)], reserve=False, linked=linked)
+
+    @staticmethod
+    def _release_parts(hot, regular, reservation_id=None, attempt=None):
+        for i in range(0, len(regular), STOCK_CHUNK_ITEMS):
+            chunk = regular[i:i + STOCK_CHUNK_ITEMS]
+            linked = StockReservations.unhold(reservation_id, attempt, [pid for pid, _ in chunk])
+            ProductModel._stock_transaction(chunk, reserve=False, linked=linked)
+        for product_id, qty in hot:
+            ProductModel._return_sharded(product_id, qty,
+                                         linked=StockReservations.unhold(reservation_id, attempt, [product_id]))
+
+    @staticmethod
+    def _release(items, reservation_id=None, attempt=None):
+        """Return stock for a list of (product_id, qty); for a recorded reservation only what it still holds"""
+        if reservation_id:
+            held = StockReservations.held(reservation_id)
+            items = [(pid, qty) for pid, qty in items if pid in held]
+        hot, regular = ProductModel._split_sharded(items)
+        ProductModel._release_parts(hot, regular, reservation_id, attempt)
+
+    @staticmethod
+    def reserve_stock(items, reservation_id=None):
+        """
+        Atomically decrement stock for a list of (product_id, qty).
+        With a reservation_id the outcome is recorded: a retry of a reservation
+        that succeeded returns without touching stock again, and a retry of one
+        that was interrupted or rolled back takes over and finishes it. A
+        reservation that is being or was released cannot be reserved again.
+        """
+        product_ids = [product_id for product_id, _ in items]
+        if not reservation_id:
+            ProductModel._reserve(items)
+            return product_ids
+
+        attempt = StockReservations.new_attempt()
+        existing = StockReservations.begin(reservation_id, items, attempt)
+        if existing is not None:
+            if existing.get('status') == RESERVED and existing.get('items_digest') == items_digest(items):
+                return product_ids
+            if not StockReservations.claim(reservation_id, (RESERVING, FAILED), RESERVING, attempt, items):
+                raise ReservationConflictError(
+                    f"Reservation {reservation_id} is {existing.get('status', 'unknown')} "
+                    f"and cannot be reserved again"
+                )
+        try:
+            ProductModel._reserve(items, reservation_id, attempt)
+        except LinkedConditionError:
+            raise ReservationConflictError(f"Reservation {reservation_id} was taken over by another request")
+        except Exception:
+            # Whatever the compensation could not give back stays held until a retry or release
+            StockReservations.transition(reservation_id, RESERVING, FAILED, attempt)
+            raise
+        if not StockReservations.transition(reservation_id, RESERVING, RESERVED, attempt):
+            raise ReservationConflictError(f"Reservation {reservation_id} was taken over by another request")
+        return product_ids
+
+    @staticmethod
+    def release_stock(items, reservation_id=None):
+        """
+        Return previously reserved stock for a list of (product_id, qty).
+        With a reservation_id only what the reservation holds is returned, so a
+        reservation that is still reserving or failed half way can be released
+        too, an interrupted release can be retried, and releasing it again is a no-op.
+        """
+        product_ids = [product_id for product_id, _ in items]
+        if not reservation_id:
+            ProductModel._release(items)
+            return product_ids
+
+        attempt = StockReservations.new_attempt()
+        releasable = (RESERVED, RESERVING, FAILED, RELEASING)
+        if not StockReservations.claim(reservation_id, releasable, RELEASING, attempt, items):
+            existing = StockReservations.get(reservation_id) or {}
+            if existing.get('items_digest') and existing['items_digest'] != items_digest(items):
+                raise ReservationConflictError(f"Items do not match reservation {reservation_id}")
+            if existing.get('status') == RELEASED:
+                return product_ids
+            raise ReservationConflictError(
+                f"Reservation {reservation_id} is {existing.get('status', 'unknown')} and cannot be released"
+            )
+        try:
+            # On failure the reservation stays releasing and a retry of the release picks it up
+            ProductModel._release(items, reservation_id, attempt)
+        except LinkedConditionError:
+            raise ReservationConflictError(f"Reservation {reservation_id} was taken over by another request")
+        if not StockReservations.transition(reservation_id, RELEASING, RELEASED, attempt):
+            raise ReservationConflictError(f"Reservation {reservation_id} was taken over by another request")
+        return product_ids
@@ -1,7 +1,13 @@
+import sys
 from decimal import Decimal
 from typing import Optional
 from dataclasses import dataclass
 
+PRODUCT_FIELDS = (
+    'product_id', 'name', 'price', 'stock', 'category_id', 'brand_name',
+    'description', 'product_image_url', 'created_at', 'updated_at'
+)
+
 @dataclass
 class Product:
     product_id: str
@@ -34,4 +40,92 @@ class Product:
             'brand_name': self.brand_name,
             'created_at': self.created_at,
             'updated_at': self.updated_at
-        }
\ No newline at end of file
+        }
+
+
+class ProductRecord:
+    """
+    Compact, read-only product for catalog-wide work (scans, snapshots,
+    reindexing, cache warming). It has no per-instance __dict__, keeps the
+    Decimal price DynamoDB already decoded, stores stock as an int and
+    interns category and brand strings, which repeat across the catalog.
+    Any other attributes (tags, specifications, variants) are kept as they
+    were read in one dict, so a record holds the whole item.
+    get() and [] mirror a DynamoDB item, so code that reads items works on
+    records unchanged.
+    """
+    __slots__ = PRODUCT_FIELDS + ('extra',)
+
+    def __init__(self, product_id, name=None, price=None, stock=None, category_id=None, brand_name=None,
+                 description=None, product_image_url=None, created_at=None, updated_at=None, extra=None):
+        self.product_id = product_id
+        self.name = name
+        self.price = price
+        self.stock = stock
+        self.category_id = category_id
+        self.brand_name = brand_name
+        self.description = description
+        self.product_image_url = product_image_url
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.extra = extra
+
+    def get(self, field, default=None):
+        if field not in PRODUCT_FIELDS:
+            return self.extra.get(field, default) if self.extra else default
+        value = getattr(self, field)
+        return default if value is None else value
+
+    def __getitem__(self, field):
+        value = self.get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field):
+        return self.get(field) is not None
+
+    def to_dict(self):
+        """The equivalent DynamoDB item; unset fields are left out"""
+        item = {}
+        for field in PRODUCT_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                item[field] = Decimal(value) if field == 'stock' else value
+        if self.extra:
+            item.update(self.extra)
+        return item
+
+    def __repr__(self):
+        return f"ProductRecord(product_id={self.product_id!r}, name={self.name!r})"
+
+
+def load_product_records(items):
+    """
+    Convert a page of DynamoDB items into ProductRecords in one pass.
+    Prices are kept as the Decimals boto3 returned; only stock is converted.
+    """
+    intern = sys.intern
+    known = frozenset(PRODUCT_FIELDS)
+    records = []
+    append = records.append
+    for item in items:
+        get = item.get
+        price = get('price')
+        stock = get('stock')
+        category_id = get('category_id')
+        brand_name = get('brand_name')
+        append(ProductRecord(
+            item['product_id'],
+            get('name'),
+            price if price is None or isinstance(price, Decimal) else Decimal(str(price)),
+            int(stock) if stock is not None else None,
+            intern(category_id) if category_id else category_id,
+            intern(brand_name) if brand_name else brand_name,
+            get('description'),
+            get('product_image_url'),
+            get('created_at'),
+            get('updated_at'),
+            {k: v for k, v in item.items() if k not in known} or None
+        ))
+    return records
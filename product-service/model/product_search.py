@@ -3,6 +3,8 @@ from flask_cors import CORS
 from http import HTTPStatus
 from typing import Dict, Any
 from model.product_search_utils import ProductSearch
+from util.pagination import decode_cursor
+from util.fieldsets import parse_fields, SEARCH_HIT_FIELDS
 
 class SearchAPI:
 
@@ -32,6 +34,16 @@ class SearchAPI:
             if clean_params['size'] < 1 or clean_params['size'] > 100:
                 return None, "Size must be between 1 and 100"
 
+            # Cursor (search_after) pagination; an empty cursor starts from the first page
+            if 'cursor' in params:
+                cursor = decode_cursor(params['cursor']) or {}
+                if (not isinstance(cursor.get('search_after', []), list)
+                        or not isinstance(cursor.get('pit_id') or '', str)):
+                    return None, "Invalid cursor"
+                clean_params['cursor'] = str(params['cursor'])
+                if str(params.get('pit', 'false')).lower() == 'true':
+                    clean_params['pit'] = True
+
             # Sorting
             if 'sort_by' in params:
                 allowed_sort_fields = ['price', 'created_at', '_score', 'name.keyword']
@@ -42,6 +54,12 @@ class SearchAPI:
                 if clean_params['sort_order'] not in ['asc', 'desc']:
                     return None, "Sort order must be 'asc' or 'desc'"
 
+            # Sparse fieldset for the returned products
+            if 'fields' in params:
+                fields = parse_fields(params['fields'], extra=SEARCH_HIT_FIELDS)
+                if fields:
+                    clean_params['fields'] = list(fields)
+
             # Filters
             if 'category_id' in params:
                 clean_params['category_id'] = str(params['category_id'])
@@ -62,16 +80,20 @@ class SearchAPI:
         except Exception as e:
             return None, f"Error processing parameters: {str(e)}"
 
-    def format_response(self, search_results: Dict[str, Any]) -> Dict[str, Any]:
-        """Format search results for API response"""
+    def format_response(self, search_results: Dict[str, Any], fields=None) -> Dict[str, Any]:
+        """
+        Format search results for API response. With a sparse fieldset, score
+        and highlights are only added to the products when they are in it.
+        """
         try:
             products = []
             for hit in search_results['hits']:
-                product = hit['_source']
-                product.update({
-                    'score': hit['_score'],
-                    'highlights': hit.get('highlight', {})
-                })
+                # Copy so cached search results are never modified
+                product = dict(hit['_source'])
+                if not fields or 'score' in fields:
+                    product['score'] = hit['_score']
+                if not fields or 'highlights' in fields:
+                    product['highlights'] = hit.get('highlight', {})
                 products.append(product)
 
             response = {
@@ -81,7 +103,10 @@ class SearchAPI:
                     'page': search_results['page'],
                     'size': search_results['size'],
                     'total_pages': (search_results['total'] + search_results['size'] - 1) 
-                                 // search_results['size']
+                                 // search_results['size'],
+                    'next_cursor': search_results.get('next_cursor'),
+                    # Served by the local fallback engine while OpenSearch is unavailable
+                    'degraded': search_results.get('degraded', False)
                 },
                 'aggregations': {
                     'price_ranges': search_results['aggregations']['price_ranges']['buckets'],
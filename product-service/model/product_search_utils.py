@@ -1,10 +1,85 @@
-from model.product import ProductModel
+from util.opensearch_utils import get_search_opensearch_client
+from model.suggest_index import suggest_index
+from model.local_search import local_search
+from util.catalog_version import CatalogVersion
+from util.circuit_breaker import CircuitBreakerRegistry
+from util.search_cache import SearchCache, make_cache_key
+from util.pagination import encode_cursor, decode_cursor
+from util.fieldsets import SEARCH_HIT_FIELDS
+from opensearchpy.exceptions import ConnectionError, TransportError, RequestError, NotFoundError
 import json
+import os
+
+FACET_CACHE_TTL = 300
+# Fail over to the local engine after one timeout; the search client does not retry
+SEARCH_REQUEST_TIMEOUT = int(os.environ.get('SEARCH_REQUEST_TIMEOUT', 5))
+# Params that change which hits are returned or how, but not the facets
+PAGING_PARAMS = ('page', 'size', 'sort_by', 'sort_order', 'cursor', 'pit', 'fields')
+HIGHLIGHT_FIELDS = ('name', 'description', 'brand_name')
+PIT_KEEP_ALIVE = '1m'
+
+FACET_AGGREGATIONS = {
+    "price_ranges": {
+        "range": {
+            "field": "price",
+            "ranges": [
+                {"to": 100},
+                {"from": 100, "to": 500},
+                {"from": 500, "to": 1000},
+                {"from": 1000, "to": 4000},
+                {"from": 4000, "to": 10000},
+                {"from": 10000}
+            ]
+        }
+    },
+    "brands": {
+        "terms": {"field": "brand_name.keyword",
+                  "size": 50 }
+    },
+    "categories": {
+        "terms": {"field": "category_id",
+                  "size": 20}
+    }
+}
+
+
+class InvalidSearchRequestError(ValueError):
+    """Raised when OpenSearch rejects a search as malformed, e.g. a tampered cursor"""
+    pass
+
+
+def is_search_outage(error):
+    """
+    True when a search error means OpenSearch is unavailable rather than the
+    request being bad. Only these count towards the circuit breaker.
+    """
+    if isinstance(error, ConnectionError):
+        # Includes ConnectionTimeout
+        return True
+    if isinstance(error, NotFoundError):
+        return error.error == 'index_not_found_exception'
+    return isinstance(error, TransportError) and isinstance(error.status_code, int) and error.status_code >= 500
+
 
 class ProductSearch:
-    def __init__(self):
-        self.client = ProductModel.get_opensearch_client()
-        # self.cache = SearchCache()
+    def __init__(self, cache=None, facet_cache=None):
+        # Pass the caches of another instance to share them (and their clearing)
+        self.cache = cache if cache is not None else SearchCache()
+        self.facet_cache = facet_cache if facet_cache is not None else SearchCache(ttl=FACET_CACHE_TTL)
+        self.breaker = CircuitBreakerRegistry().get_circuit_breaker(
+            'opensearch-search', failure_threshold=5, reset_timeout=30
+        )
+
+    @staticmethod
+    def facet_signature(query_params):
+        """Cache key for the facets of a query: the params minus paging and sorting"""
+        params = {k: v for k, v in query_params.items() if k not in PAGING_PARAMS}
+        return f"facets:{make_cache_key(params)}"
+
+    @property
+    def client(self):
+        # No retries, so SEARCH_REQUEST_TIMEOUT bounds a search before the breaker counts it
+        return get_search_opensearch_client()
 
     def build_fuzzy_query(self, search_term, fields=None, fuzzy_params=None):
         """
@@ -70,222 +145,281 @@ class ProductSearch:
         Enhanced search with fuzzy matching
         """
         try:
-            # # Check cache first
-            # cached_results = self.cache.get_cached_results(query_params)
-            # if cached_results:
-            #     return cached_results
+            # Check cache first
+            generation = CatalogVersion().generation
+            cached_results = self.get_cached_search(query_params)
+            if cached_results:
+                return cached_results
+
+            if not self.search_available():
+                return local_search.search(query_params)
+
+            search_request = self.build_search_request(query_params)
+            try:
+                if search_request['needs_pit']:
+                    pit = self.client.create_pit(index='products', keep_alive=PIT_KEEP_ALIVE)
+                    self.attach_pit(search_request, pit['pit_id'])
+
+                # Execute search
+                response = self.client.search(
+                    index=search_request['index'],
+                    body=search_request['body'],
+                    request_timeout=SEARCH_REQUEST_TIMEOUT
+                )
+            except Exception as e:
+                return self.search_failed(query_params, e)
+            self.breaker.record_success()
 
-            search_query = {
-                "bool": {
-                    "must": [],
-                    "filter": []
-                }
+            return self.process_search_response(query_params, search_request, response, generation)
+
+        except Exception as e:
+            print(f"Search error: {str(e)}")
+            raise e
+
+    def search_available(self):
+        """
+        False while the OpenSearch circuit is open and the local engine can answer.
+        Without a local engine OpenSearch is always tried.
+        """
+        return self.breaker.can_execute() or not local_search.ready
+
+    def search_failed(self, query_params, error):
+        """
+        Count an OpenSearch outage and answer from the local engine if it is ready.
+        Rejected requests (an expired point in time, a bogus search_after) are
+        the client's fault: they raise InvalidSearchRequestError and leave the
+        breaker alone, as do other errors.
+        """
+        if not is_search_outage(error):
+            if isinstance(error, (RequestError, NotFoundError)):
+                raise InvalidSearchRequestError(f"Invalid search request: {error.error}") from error
+            raise error
+        self.breaker.record_failure()
+        if not local_search.ready:
+            raise error
+        print(f"OpenSearch search failed, using local search: {str(error)}")
+        return local_search.search(query_params)
+
+    def get_cached_search(self, query_params):
+        # Point-in-time cursors expire, so those pages are never cached
+        if query_params.get('pit'):
+            return None
+        return self.cache.get_cached_results(query_params)
+
+    @staticmethod
+    def attach_pit(search_request, pit_id):
+        # A point-in-time search must not name the index
+        search_request['pit_id'] = pit_id
+        search_request['index'] = None
+        search_request['needs_pit'] = False
+        search_request['body']["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+
+    def build_search_request(self, query_params):
+        """
+        Build the OpenSearch request for validated search params, without any I/O
+        """
+        search_query = {
+            "bool": {
+                "must": [],
+                "filter": []
             }
+        }
 
-            # Text search with fuzzy matching
-            if query_params.get('search_term'):
-                search_term = query_params['search_term']
-                fuzzy_params = {
-                    "fuzziness": query_params.get('fuzziness', 'AUTO'),
-                    "prefix_length": int(query_params.get('prefix_length', 2)),
-                    "max_expansions": int(query_params.get('max_expansions', 50))
-                }
-                
-                search_query["bool"]["must"].append(
-                    self.build_fuzzy_query(search_term, fuzzy_params=fuzzy_params)
-                )
-            print('after search filter',search_query)
+        # Text search with fuzzy matching
+        if query_params.get('search_term'):
+            search_term = query_params['search_term']
+            fuzzy_params = {
+                "fuzziness": query_params.get('fuzziness', 'AUTO'),
+                "prefix_length": int(query_params.get('prefix_length', 2)),
+                "max_expansions": int(query_params.get('max_expansions', 50))
+            }
+            
+            search_query["bool"]["must"].append(
+                self.build_fuzzy_query(search_term, fuzzy_params=fuzzy_params)
+            )
+        print('after search filter',search_query)
 
-            # Add category filter
-            if query_params.get('category_id'):
-                search_query["bool"]["filter"].append(
-                    {"match": {"category_id": query_params['category_id']}}
-                )
+        # Add category filter
+        if query_params.get('category_id'):
+            search_query["bool"]["filter"].append(
+                {"match": {"category_id": query_params['category_id']}}
+            )
 
-            # Add filters
-            if query_params.get('price_ranges'):
-                # Parse the price ranges if it's a string
-                if isinstance(query_params['price_ranges'], str):
-                    price_ranges = json.loads(query_params['price_ranges'])
-                else:
-                    price_ranges = query_params['price_ranges']
-
-                # Create a bool query with should clauses for price ranges
-                price_filter = {
-                    "bool": {
-                        "should": []
-                    }
+        # Add filters
+        if query_params.get('price_ranges'):
+            # Parse the price ranges if it's a string
+            if isinstance(query_params['price_ranges'], str):
+                price_ranges = json.loads(query_params['price_ranges'])
+            else:
+                price_ranges = query_params['price_ranges']
+
+            # Create a bool query with should clauses for price ranges
+            price_filter = {
+                "bool": {
+                    "should": []
                 }
+            }
 
-                # Add each price range to the should clause
-                for price_range in price_ranges:
-                    range_query = {
-                        "range": {
-                            "price": {}
-                        }
+            # Add each price range to the should clause
+            for price_range in price_ranges:
+                range_query = {
+                    "range": {
+                        "price": {}
                     }
-                    
-                    if price_range.get('min') is not None:
-                        range_query["range"]["price"]["gte"] = float(price_range['min'])
-                    if price_range.get('max') is not None:
-                        range_query["range"]["price"]["lte"] = float(price_range['max'])
-                        
-                    price_filter["bool"]["should"].append(range_query)
-
-                # Add minimum_should_match to ensure at least one range matches
-                price_filter["bool"]["minimum_should_match"] = 1
+                }
                 
-                # Add the price filter to the main query
-                search_query["bool"]["filter"].append(price_filter)
-
-            # Build complete search body
-            search_body = {
-                # "min_score": 0.5,
-                "query": search_query,
-                "aggs": {
-                    "price_ranges": {
-                        "range": {
-                            "field": "price",
-                            "ranges": [
-                                {"to": 100},
-                                {"from": 100, "to": 500},
-                                {"from": 500, "to": 1000},
-                                {"from": 1000, "to": 4000},
-                                {"from": 4000, "to": 10000},
-                                {"from": 10000}
-                            ]
-                        }
-                    },
-                    "brands": {
-                        "terms": {"field": "brand_name.keyword",
-                                  "size": 50 }
-                    },
-                    "categories": {
-                        "terms": {"field": "category_id",
-                                  "size": 20}
-                    }
-                },
-                "highlight": {
-                    "fields": {
-                        "name": {"pre_tags": ["<em>"], "post_tags": ["</em>"]},
-                        "description": {"pre_tags": ["<em>"], "post_tags": ["</em>"]},
-                        "brand_name": {"pre_tags": ["<em>"], "post_tags": ["</em>"]}
-                    }
+                if price_range.get('min') is not None:
+                    range_query["range"]["price"]["gte"] = float(price_range['min'])
+                if price_range.get('max') is not None:
+                    range_query["range"]["price"]["lte"] = float(price_range['max'])
+                    
+                price_filter["bool"]["should"].append(range_query)
+
+            # Add minimum_should_match to ensure at least one range matches
+            price_filter["bool"]["minimum_should_match"] = 1
+            
+            # Add the price filter to the main query
+            search_query["bool"]["filter"].append(price_filter)
+
+        # Build complete search body
+        search_body = {
+            # "min_score": 0.5,
+            "query": search_query
+        }
+
+        # Sparse fieldsets: return only the requested source fields and only
+        # highlight the requested text fields
+        fields = query_params.get('fields')
+        if fields:
+            search_body["_source"] = {"includes": [f for f in fields if f not in SEARCH_HIT_FIELDS]}
+        else:
+            # sync_version is bookkeeping for the search index sync, not product data
+            search_body["_source"] = {"excludes": ["sync_version"]}
+        if not fields:
+            highlight_fields = HIGHLIGHT_FIELDS
+        elif 'highlights' in fields:
+            highlight_fields = [f for f in HIGHLIGHT_FIELDS if f in fields] or HIGHLIGHT_FIELDS
+        else:
+            highlight_fields = []
+        if highlight_fields:
+            search_body["highlight"] = {
+                "fields": {
+                    field: {"pre_tags": ["<em>"], "post_tags": ["</em>"]}
+                    for field in highlight_fields
                 }
             }
 
-            # Add sorting
-            sort_field = query_params.get('sort_by', '_score')
-            sort_order = query_params.get('sort_order', 'desc')
-            search_body["sort"] = [{sort_field: {"order": sort_order}}]
-
-            # Add pagination
-            page = int(query_params.get('page', 1))
-            size = int(query_params.get('size', 20))
+        # Facets only depend on the query and filters, so compute them once per
+        # signature and let every other page and sort order reuse them
+        facet_key = self.facet_signature(query_params)
+        facets = self.facet_cache.get_cached_results(facet_key)
+        if facets is None:
+            search_body["aggs"] = FACET_AGGREGATIONS
+
+        # Add sorting
+        sort_field = query_params.get('sort_by', '_score')
+        sort_order = query_params.get('sort_order', 'desc')
+        search_body["sort"] = [{sort_field: {"order": sort_order}}]
+
+        # Add pagination
+        page = int(query_params.get('page', 1))
+        size = int(query_params.get('size', 20))
+        search_body["size"] = size
+        search_request = {
+            'body': search_body,
+            'index': 'products',
+            'facet_key': facet_key,
+            'facets': facets,
+            'page': page,
+            'size': size,
+            'cursor_mode': 'cursor' in query_params,
+            'pit_id': None,
+            'needs_pit': False
+        }
+        if search_request['cursor_mode']:
+            # search_after needs a total order, so break ties on product_id
+            search_body["sort"].append({"product_id": {"order": "asc"}})
+            cursor = decode_cursor(query_params['cursor']) or {}
+            if cursor.get('search_after'):
+                search_body["search_after"] = cursor['search_after']
+            if cursor.get('pit_id'):
+                self.attach_pit(search_request, cursor['pit_id'])
+            elif query_params.get('pit'):
+                search_request['needs_pit'] = True
+        else:
             search_body["from"] = (page - 1) * size
-            search_body["size"] = size
 
-            print(search_body)
+        print(search_body)
+        return search_request
 
-            # Execute search
-            response = self.client.search(
-                index='products',
-                body=search_body,
-                explain=True
-            )
-
-            print("*********************************************************")
-            print(response)
-
-            results = {
-                'hits': response['hits']['hits'],
-                'total': response['hits']['total']['value'],
-                'aggregations': response['aggregations'],
-                'page': page,
-                'size': size
-            }
-
-            # # Cache results
-            # self.cache.cache_results(query_params, results)
+    def process_search_response(self, query_params, search_request, response, generation):
+        """
+        Turn an OpenSearch response into search results and cache them
+        """
+        facets = search_request['facets']
+        facet_key = search_request['facet_key']
+        page = search_request['page']
+        size = search_request['size']
+        pit_id = search_request['pit_id']
+
+        if facets is None:
+            facets = response['aggregations']
+            self.facet_cache.cache_results(facet_key, facets, generation=generation)
+
+        results = {
+            'hits': response['hits']['hits'],
+            'total': response['hits']['total']['value'],
+            'aggregations': facets,
+            'page': page,
+            'size': size
+        }
+
+        if search_request['cursor_mode']:
+            hits = response['hits']['hits']
+            next_cursor = None
+            if len(hits) == size:
+                next_cursor = encode_cursor({
+                    'search_after': hits[-1]['sort'],
+                    'pit_id': response.get('pit_id', pit_id)
+                })
+            results['next_cursor'] = next_cursor
 
-            return results
+        # Cache results; point-in-time cursors expire, so those pages are not cached
+        if not query_params.get('pit'):
+            self.cache.cache_results(query_params, results, generation=generation)
 
-        except Exception as e:
-            print(f"Search error: {str(e)}")
-            raise e
+        return results
 
     def suggest_products(self, prefix: str, size: int = 5) -> list:
         """
         Get search suggestions using multiple suggestion strategies
         """
         try:
-            # # Check cache first
-            # cache_key = f"suggest:{prefix}:{size}"
-            # cached_suggestions = self.cache.get_cached_results(cache_key)
-            # if cached_suggestions:
-            #     return cached_suggestions
-
-            # Build suggestion query
-            suggest_body = {
-                # Completion suggester for product names
-                "name_completion": {
-                    "prefix": prefix,
-                    "completion": {
-                        "field": "name.completion",
-                        "size": size,
-                        "skip_duplicates": True,
-                        "fuzzy": {
-                            "fuzziness": "AUTO",
-                            "min_length": 3
-                        }
-                    }
-                },
-                # Phrase suggester for spell checking
-                "name_phrase": {
-                    "text": prefix,
-                    "phrase": {
-                        "field": "name.fuzzy",
-                        "size": size,
-                        "gram_size": 3,
-                        "confidence": 0.0,
-                        "max_errors": 2,
-                        "direct_generator": [{
-                            "field": "name.fuzzy",
-                            "suggest_mode": "always"
-                        }],
-                        "highlight": {
-                            "pre_tag": "<em>",
-                            "post_tag": "</em>"
-                        }
-                    }
-                },
-                # Term suggester for similar terms
-                "name_term": {
-                    "text": prefix,
-                    "term": {
-                        "field": "name.fuzzy",
-                        "suggest_mode": "always",
-                        "sort": "frequency",
-                        "size": size
-                    }
-                }
-            }
+            suggestions = self.get_cached_suggestions(prefix, size)
+            if suggestions is not None:
+                return suggestions
 
-            # Execute suggestion query
-            response = self.client.search(
-                index='products',
-                body={
-                    "suggest": suggest_body,
-                    "_source": ["name", "brand_name", "price", "category_id"],
-                    "size": 0  # We don't need search results
-                }
-            )
+            generation = CatalogVersion().generation
+
+            if not self.suggest_available():
+                return suggest_index.lookup(prefix, size)
+
+            # Execute suggestion and popular searches queries in one round trip
+            try:
+                response = self.client.msearch(
+                    body=self.build_suggest_msearch(prefix, size),
+                    request_timeout=SEARCH_REQUEST_TIMEOUT
+                )
+            except Exception as e:
+                return self.suggest_failed(prefix, size, e)
+            self.breaker.record_success()
+            suggest_response, popular_searches = self._split_suggest_msearch(response)
 
             # Process suggestions
-            suggestions = self._process_suggestions(response, prefix, size)
+            suggestions = self._process_suggestions(suggest_response, prefix, size, popular_searches=popular_searches)
 
-            # # Cache results
-            # self.cache.cache_results(cache_key, suggestions, ttl=300)  # Cache for 5 minutes
+            # Cache results
+            self.cache_suggestions(prefix, size, suggestions, generation)
 
             return suggestions
 
@@ -293,9 +427,121 @@ class ProductSearch:
             print(f"Suggestion error: {str(e)}")
             raise e
 
-    def _process_suggestions(self, response: dict, prefix: str, size: int) -> list:
+    def suggest_available(self):
+        """Like search_available, for suggestions and the local suggest index"""
+        return self.breaker.can_execute() or not suggest_index.ready
+
+    def suggest_failed(self, prefix, size, error):
+        """Count an OpenSearch outage and answer from the local suggest index if it is ready"""
+        if not is_search_outage(error):
+            raise error
+        self.breaker.record_failure()
+        if not suggest_index.ready:
+            raise error
+        print(f"OpenSearch suggest failed, using the local suggest index: {str(error)}")
+        return suggest_index.lookup(prefix, size)
+
+    @staticmethod
+    def _suggest_cache_key(prefix, size):
+        return f"suggest:{' '.join(prefix.lower().split())}:{size}"
+
+    def get_cached_suggestions(self, prefix, size):
         """
-        Process and combine different types of suggestions
+        Suggestions that need no OpenSearch round trip, or None
+        """
+        # Answer exact prefixes from the in-process index; only fuzzy or
+        # misspelled prefixes, which match nothing locally, go to OpenSearch
+        if suggest_index.ready:
+            local_suggestions = suggest_index.lookup(prefix, size)
+            if local_suggestions:
+                return local_suggestions
+
+        # Check cache first
+        return self.cache.get_cached_results(self._suggest_cache_key(prefix, size))
+
+    def cache_suggestions(self, prefix, size, suggestions, generation):
+        # Cache for 5 minutes
+        self.cache.cache_results(self._suggest_cache_key(prefix, size), suggestions, ttl=300, generation=generation)
+
+    def build_suggest_request(self, prefix, size):
+        # Build suggestion query
+        suggest_body = {
+            # Completion suggester for product names
+            "name_completion": {
+                "prefix": prefix,
+                "completion": {
+                    "field": "name.completion",
+                    "size": size,
+                    "skip_duplicates": True,
+                    "fuzzy": {
+                        "fuzziness": "AUTO",
+                        "min_length": 3
+                    }
+                }
+            },
+            # Phrase suggester for spell checking
+            "name_phrase": {
+                "text": prefix,
+                "phrase": {
+                    "field": "name.fuzzy",
+                    "size": size,
+                    "gram_size": 3,
+                    "confidence": 0.0,
+                    "max_errors": 2,
+                    "direct_generator": [{
+                        "field": "name.fuzzy",
+                        "suggest_mode": "always"
+                    }],
+                    "highlight": {
+                        "pre_tag": "<em>",
+                        "post_tag": "</em>"
+                    }
+                }
+            },
+            # Term suggester for similar terms
+            "name_term": {
+                "text": prefix,
+                "term": {
+                    "field": "name.fuzzy",
+                    "suggest_mode": "always",
+                    "sort": "frequency",
+                    "size": size
+                }
+            }
+        }
+
+        return {
+            "suggest": suggest_body,
+            "_source": ["name", "brand_name", "price", "category_id"],
+            "size": 0  # We don't need search results
+        }
+
+    def build_suggest_msearch(self, prefix, size):
+        """
+        _msearch body carrying the suggest query and the popular searches
+        fallback together; popular searches are only used when suggestions
+        leave room for them, but fetching both saves a second round trip
+        """
+        return [
+            {"index": "products"},
+            self.build_suggest_request(prefix, size),
+            {"index": "products"},
+            self.build_popular_searches_request(prefix, size)
+        ]
+
+    def _split_suggest_msearch(self, response):
+        suggest_response, popular_response = response['responses']
+        if 'error' in suggest_response:
+            raise Exception(f"Suggest query failed: {suggest_response['error']}")
+        if 'error' in popular_response:
+            print(f"Error getting popular searches: {popular_response['error']}")
+            return suggest_response, []
+        return suggest_response, self._parse_popular_searches(popular_response)
+
+    def _process_suggestions(self, response: dict, prefix: str, size: int, popular_searches=None) -> list:
+        """
+        Process and combine different types of suggestions.
+        popular_searches are fetched when not supplied and there is room for them.
         """
         results = []
         seen = set()
@@ -355,7 +601,8 @@ class ProductSearch:
 
         # Add popular searches if we have space
         if len(results) < size:
-            popular_searches = self._get_popular_searches(prefix, size - len(results))
+            if popular_searches is None:
+                popular_searches = self._get_popular_searches(prefix, size - len(results))
             for search in popular_searches:
                 if search['text'].lower() not in seen:
                     results.append(search)
@@ -368,47 +615,53 @@ class ProductSearch:
         Get popular searches starting with the prefix
         """
         try:
-            query = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "prefix": {
-                                    "name.keyword": prefix.lower()
-                                }
-                            }
-                        ]
-                    }
-                },
-                "aggs": {
-                    "popular_searches": {
-                        "terms": {
-                            "field": "name.keyword",
-                            "size": size,
-                            "order": {
-                                "_count": "desc"
-                            }
-                        }
-                    }
-                },
-                "size": 0
-            }
-
             response = self.client.search(
                 index='products',
-                body=query
+                body=self.build_popular_searches_request(prefix, size)
             )
-
-            popular = []
-            for bucket in response['aggregations']['popular_searches']['buckets']:
-                popular.append({
-                    'text': bucket['key'],
-                    'type': 'popular',
-                    'score': bucket['doc_count']
-                })
-
-            return popular
+            return self._parse_popular_searches(response)
 
         except Exception as e:
             print(f"Error getting popular searches: {str(e)}")
-            return []
\ No newline at end of file
+            return []
+
+    @staticmethod
+    def build_popular_searches_request(prefix: str, size: int) -> dict:
+        query = {
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "prefix": {
+                                "name.keyword": prefix.lower()
+                            }
+                        }
+                    ]
+                }
+            },
+            "aggs": {
+                "popular_searches": {
+                    "terms": {
+                        "field": "name.keyword",
+                        "size": size,
+                        "order": {
+                            "_count": "desc"
+                        }
+                    }
+                }
+            },
+            "size": 0
+        }
+        return query
+
+    @staticmethod
+    def _parse_popular_searches(response: dict) -> list:
+        popular = []
+        for bucket in response['aggregations']['popular_searches']['buckets']:
+            popular.append({
+                'text': bucket['key'],
+                'type': 'popular',
+                'score': bucket['doc_count']
+            })
+
+        return popular
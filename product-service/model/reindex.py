@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from model.product import ProductModel
+from model.search_sync import REINDEX_ALIAS, SYNC_TARGETS_TTL
+
+PRODUCTS_ALIAS = 'products'
+REINDEX_SEGMENTS = int(os.environ.get('REINDEX_SEGMENTS', 8))
+REINDEX_PAGE_SIZE = int(os.environ.get('REINDEX_PAGE_SIZE', 1000))
+REINDEX_PROGRESS_INTERVAL = int(os.environ.get('REINDEX_PROGRESS_INTERVAL', 5))
+# Delete tombstones must outlive the load, so a product deleted during the scan
+# cannot be brought back by the copy read before the delete
+REINDEX_GC_DELETES = os.environ.get('REINDEX_GC_DELETES', '6h')
+
+
+class ReindexError(Exception):
+    """Raised when a rebuilt index is not complete enough to be swapped in"""
+    pass
+
+
+class ProductReindexer:
+    """
+    Rebuilds the products search index from DynamoDB without downtime.
+    A parallel Scan (one thread per segment) streams pages straight into _bulk
+    requests against a fresh index created from create_index_mapping(). The
+    products alias is then moved to the new index in a single _aliases call,
+    so searches switch over atomically and never see a half-built index.
+
+    While the index is built it carries REINDEX_ALIAS, and the search sync
+    writes every change (deletes included) to it as well. Scanned copies are
+    versioned by updated_at and changes by event time, so whichever arrives
+    last, the newer state wins and nothing written before the swap is lost.
+    """
+
+    def __init__(self, segments=REINDEX_SEGMENTS, page_size=REINDEX_PAGE_SIZE, alias=PRODUCTS_ALIAS,
+                 max_errors=0, keep_old=False, replace_concrete=False,
+                 progress_interval=REINDEX_PROGRESS_INTERVAL):
+        self.segments = segments
+        self.page_size = page_size
+        self.alias = alias
+        self.max_errors = max_errors
+        self.keep_old = keep_old
+        self.replace_concrete = replace_concrete
+        self.progress_interval = progress_interval
+        self.client = ProductModel.get_opensearch_client()
+        self.stats = {'scanned': 0, 'pages': 0, 'segments_done': 0, 'errors': 0}
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._started = None
+
+    def new_index_name(self):
+        return f"{self.alias}-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}"
+
+    def create_index(self, index):
+        body = ProductModel.create_index_mapping()
+        # Bulk loading is much faster without refreshes and replicas; both are restored before the swap
+        body['settings']['index'] = {
+            'refresh_interval': '-1',
+            'number_of_replicas': 0,
+            'gc_deletes': REINDEX_GC_DELETES
+        }
+        # The alias makes the search sync write changes to the new index from now on
+        body['aliases'] = {REINDEX_ALIAS: {}}
+        self.client.indices.create(index=index, body=body)
+
+    def finish_index(self, index):
+        # null resets the load-time settings to the cluster defaults
+        self.client.indices.put_settings(
+            index=index,
+            body={'index': {'refresh_interval': None, 'number_of_replicas': None, 'gc_deletes': None}}
+        )
+        self.client.indices.refresh(index=index)
+
+    def _products(self, pages):
+        for items in pages:
+            with self._lock:
+                self.stats['scanned'] += len(items)
+                self.stats['pages'] += 1
+            yield from items
+
+    def index_segment(self, index, segment):
+        pages = ProductModel.scan_segment(segment, self.segments, self.page_size)
+        errors = ProductModel.index_products(self._products(pages), index=index, refresh=False, versioned=True)
+        with self._lock:
+            self.errors.update(errors)
+            self.stats['errors'] = len(self.errors)
+            self.stats['segments_done'] += 1
+
+    def load(self, index):
+        """Scan every segment in parallel into index; re-raises the first segment failure"""
+        with ThreadPoolExecutor(max_workers=self.segments, thread_name_prefix='reindex') as pool:
+            futures = [pool.submit(self.index_segment, index, segment)
+                       for segment in range(self.segments)]
+            done = threading.Event()
+            reporter = threading.Thread(target=self._report_progress, args=(done,), daemon=True)
+            reporter.start()
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                done.set()
+                reporter.join()
+
+    def _report_progress(self, done):
+        while not done.wait(self.progress_interval):
+            self.report()
+
+    def report(self):
+        elapsed = time.time() - self._started
+        with self._lock:
+            stats = dict(self.stats)
+        print(f"Reindex: {stats['scanned']} products in {elapsed:.1f}s "
+              f"({stats['scanned'] / max(elapsed, 0.001):.0f}/s), "
+              f"segments {stats['segments_done']}/{self.segments}, errors {stats['errors']}")
+        return stats
+
+    def current_indices(self):
+        """Indices the alias points at, or the concrete index of that name from before aliases were used"""
+        if self.client.indices.exists_alias(name=self.alias):
+            return list(self.client.indices.get_alias(name=self.alias).keys()), False
+        if self.client.indices.exists(index=self.alias):
+            return [self.alias], True
+        return [], False
+
+    def check_swappable(self):
+        """
+        The first swap replaces the original concrete index, which has to be
+        deleted in the swap because an alias cannot share its name. Refuse
+        that unless it was asked for, and never with keep_old.
+        """
+        _, concrete = self.current_indices()
+        if not concrete:
+            return
+        if self.keep_old:
+            raise ReindexError(f"{self.alias} is a concrete index and cannot be kept: "
+                               f"the alias swap has to delete it")
+        if not self.replace_concrete:
+            raise ReindexError(f"{self.alias} is a concrete index; the alias swap deletes it. "
+                               f"Confirm with replace_concrete (--replace-concrete-index)")
+
+    def swap_alias(self, index):
+        """
+        Point the alias at index and drop the reindex alias in one atomic
+        _aliases request; returns the indices the alias left.
+        """
+        old_indices, concrete = self.current_indices()
+        if concrete:
+            self.check_swappable()
+            actions = [{'remove_index': {'index': self.alias}}]
+        else:
+            actions = [{'remove': {'index': old, 'alias': self.alias}} for old in old_indices]
+        actions.append({'add': {'index': index, 'alias': self.alias}})
+        actions.append({'remove': {'index': index, 'alias': REINDEX_ALIAS}})
+        self.client.indices.update_aliases(body={'actions': actions})
+        return [] if concrete else old_indices
+
+    def run(self):
+        """
+        Rebuild the index and swap it in. Returns the stats of the run.
+        The new index is deleted and the alias left alone when more than
+        max_errors products failed to index.
+        """
+        self.check_swappable()
+        index = self.new_index_name()
+        self._started = time.time()
+        print(f"Reindex: building {index} from {self.segments} scan segments")
+        self.create_index(index)
+        try:
+            # Let every syncer notice the new index before the scan starts, so
+            # each change is either seen by the scan or written by a syncer
+            time.sleep(SYNC_TARGETS_TTL * 2)
+            self.load(index)
+            self.finish_index(index)
+
+            if self.stats['errors'] > self.max_errors:
+                raise ReindexError(f"{self.stats['errors']} products failed to index, "
+                                   f"allowed {self.max_errors}")
+        except BaseException:
+            print(f"Reindex: failed, deleting {index}")
+            self.client.indices.delete(index=index, ignore=[404])
+            raise
+
+        old_indices = self.swap_alias(index)
+        print(f"Reindex: alias {self.alias} now points at {index}")
+        if not self.keep_old:
+            for old in old_indices:
+                self.client.indices.delete(index=old, ignore=[404])
+                print(f"Reindex: deleted {old}")
+
+        stats = self.report()
+        stats.update(index=index, previous=old_indices, seconds=round(time.time() - self._started, 3),
+                     documents=self.client.count(index=index)['count'])
+        return stats
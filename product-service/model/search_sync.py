@@ -0,0 +1,437 @@
+import collections
+import json
+import os
+import queue
+import threading
+import time
+import boto3
+from opensearchpy import helpers, NotFoundError
+from model.product import ProductModel
+from util.response_cache import encode_json
+from util.secrets_utils import get_secret
+
+PRODUCT_CHANGES_QUEUE_URL = os.environ.get('PRODUCT_CHANGES_QUEUE_URL')
+# Looked up by name when no queue URL is configured
+PRODUCT_CHANGES_QUEUE_NAME = os.environ.get('PRODUCT_CHANGES_QUEUE_NAME', 'product-changes')
+# 'local' keeps changes in process memory: single worker development and tests only
+SEARCH_SYNC_QUEUE = os.environ.get('SEARCH_SYNC_QUEUE', 'sqs')
+SYNC_BATCH_SIZE = int(os.environ.get('SEARCH_SYNC_BATCH_SIZE', 100))
+SYNC_MAX_RETRIES = int(os.environ.get('SEARCH_SYNC_MAX_RETRIES', 5))
+
+# Statuses that are worth retrying; anything else is a permanent failure
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# Indices being rebuilt by reindex.py carry this alias; changes are written to them too
+REINDEX_ALIAS = 'products-reindex'
+# How often the syncer looks for indices being rebuilt
+SYNC_TARGETS_TTL = int(os.environ.get('SEARCH_SYNC_TARGETS_TTL', 5))
+# Changes that could not be published, kept for the next batch to publish again
+MAX_UNPUBLISHED = int(os.environ.get('SEARCH_SYNC_MAX_UNPUBLISHED', 10000))
+
+
+class ChangeMessage:
+    def __init__(self, event, receipt=None):
+        self.event = event
+        self.receipt = receipt
+
+
+class LocalChangeQueue:
+    """
+    In-process change queue for development and tests. Every worker has its
+    own and pending changes are lost on restart; use SQS in production.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def publish(self, event):
+        self._queue.put(ChangeMessage(event))
+
+    def receive(self, max_messages=SYNC_BATCH_SIZE, wait_seconds=1):
+        messages = []
+        try:
+            messages.append(self._queue.get(timeout=wait_seconds))
+            while len(messages) < max_messages:
+                messages.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return messages
+
+    def ack(self, messages):
+        pass
+
+    def release(self, messages):
+        # Put failed changes back so a later batch retries them
+        for message in messages:
+            self._queue.put(message)
+
+    def pending(self):
+        return self._queue.qsize()
+
+
+class SQSChangeQueue:
+    """Change queue backed by SQS, so every worker publishes to one shared outbox"""
+
+    def __init__(self, queue_url=None, queue_name=PRODUCT_CHANGES_QUEUE_NAME):
+        self._queue_url = queue_url
+        self.queue_name = queue_name
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            if os.environ.get('dynamo_db_secret') is None:
+                os.environ['dynamo_db_secret'] = json.dumps(get_secret("dev/dynamodb/config"))
+            secret = json.loads(os.environ.get('dynamo_db_secret'))
+            self._client = boto3.client('sqs',
+                region_name=secret['region'],
+                aws_access_key_id=secret['AWS_ACCESS_KEY_ID'],
+                aws_secret_access_key=secret['AWS_SECRET_ACCESS_KEY']
+            )
+        return self._client
+
+    @property
+    def queue_url(self):
+        if self._queue_url is None:
+            self._queue_url = self.client.get_queue_url(QueueName=self.queue_name)['QueueUrl']
+        return self._queue_url
+
+    def publish(self, event):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=encode_json(event).decode('utf-8'))
+
+    def receive(self, max_messages=SYNC_BATCH_SIZE, wait_seconds=1):
+        messages = []
+        # SQS hands out at most 10 messages per call
+        while len(messages) < max_messages:
+            response = self.client.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=min(10, max_messages - len(messages)),
+                WaitTimeSeconds=wait_seconds if not messages else 0
+            )
+            received = response.get('Messages', [])
+            if not received:
+                break
+            for message in received:
+                messages.append(ChangeMessage(json.loads(message['Body']), message['ReceiptHandle']))
+        return messages
+
+    def ack(self, messages):
+        for i in range(0, len(messages), 10):
+            self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(n), 'ReceiptHandle': m.receipt} for n, m in enumerate(messages[i:i + 10])]
+            )
+
+    def release(self, messages):
+        # Unacknowledged messages become visible again after the visibility timeout
+        pass
+
+    def pending(self):
+        attributes = self.client.get_queue_attributes(
+            QueueUrl=self.queue_url,
+            AttributeNames=['ApproximateNumberOfMessages']
+        )
+        return int(attributes['Attributes']['ApproximateNumberOfMessages'])
+
+
+def upsert_event(product):
+    """Change event carrying the full search document of a stored product"""
+    return {
+        'product_id': str(product['product_id']),
+        'op': 'index',
+        'doc': ProductModel.build_search_document(product),
+        'version': ProductModel.search_version(product),
+        'ts': time.time()
+    }
+
+
+def delete_event(product_id):
+    return {'product_id': str(product_id), 'op': 'delete', 'ts': time.time()}
+
+
+def refresh_event(product_id):
+    """Change event for writes whose new values are not known to the writer, e.g. stock reservations"""
+    return {'product_id': str(product_id), 'op': 'refresh', 'ts': time.time()}
+
+
+def coalesce(events):
+    """
+    Fold a batch of events into one change per product_id, in event order.
+    A product refreshed in the batch is re-read, which also covers any
+    document an earlier event carried, and a delete wins over earlier
+    writes, so each product costs a single bulk action.
+    """
+    changes = {}
+    for event in sorted(events, key=lambda e: e.get('ts', 0)):
+        product_id = event['product_id']
+        current = changes.get(product_id)
+        if event['op'] == 'update':
+            # Partial updates queued by earlier releases are re-read instead
+            event = dict(event, op='refresh')
+        if current and event['op'] == 'refresh' and current['op'] == 'delete':
+            continue
+        if current and event['op'] == 'index' and current['op'] == 'refresh':
+            # The re-read returns this document or a newer one
+            continue
+        changes[product_id] = dict(event)
+        # Lag is measured from the oldest change folded into this one
+        changes[product_id]['first_ts'] = current['first_ts'] if current else event.get('ts', time.time())
+    return changes
+
+
+def resolve_refreshes(changes):
+    """Replace refreshes with the current DynamoDB items, read with one BatchGetItem"""
+    product_ids = [pid for pid, change in changes.items() if change['op'] == 'refresh']
+    if not product_ids:
+        return changes
+    items = ProductModel.batch_get_products(product_ids)
+    for product_id in product_ids:
+        item = items.get(product_id)
+        if item is None:
+            # Deleted since; its delete event removes the document
+            del changes[product_id]
+            continue
+        event = upsert_event(item)
+        changes[product_id] = dict(changes[product_id], op='index', doc=event['doc'], version=event['version'])
+    return changes
+
+
+def change_version(change):
+    """
+    External document version of a change. Writes carry the stored item's
+    updated_at; a delete has no item left and uses its event time.
+    """
+    if change.get('version') is not None:
+        return change['version']
+    return int(change['ts'] * 1000000)
+
+
+def to_bulk_action(change, index='products'):
+    """
+    Bulk action for a change. Every write is the whole document versioned
+    by the item's updated_at, so a redelivered or released older event
+    cannot overwrite a newer document in a later batch. external_gte lets a
+    re-read with the same updated_at through: sharded stock changes without
+    touching the item.
+    """
+    version = change_version(change)
+    if change['op'] == 'delete':
+        return {'_op_type': 'delete', '_index': index, '_id': change['product_id'],
+                'version': version, 'version_type': 'external'}
+    return {'_op_type': 'index', '_index': index, '_id': change['product_id'],
+            '_source': dict(change['doc'], sync_version=version),
+            'version': version, 'version_type': 'external_gte'}
+
+
+class SearchIndexSyncer:
+    """
+    Applies product change events to the products index in bulk.
+    Changes are read from a change queue, coalesced per product, and written
+    with the _bulk API; transient failures are retried with exponential backoff.
+    on_applied is called with the ids of the products each batch wrote.
+    Changes the queue refused are kept and published again before each batch.
+    """
+
+    def __init__(self, change_queue, index='products', batch_size=SYNC_BATCH_SIZE,
+                 max_retries=SYNC_MAX_RETRIES, client_factory=None, on_applied=None):
+        self.queue = change_queue
+        self.index = index
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.client_factory = client_factory or ProductModel.get_opensearch_client
+        self.on_applied = on_applied
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._index_ready = False
+        self._targets = [index]
+        self._targets_loaded_at = 0
+        self._unpublished = collections.deque(maxlen=MAX_UNPUBLISHED)
+        self.stats = {
+            'applied': 0,
+            'failed': 0,
+            'batches': 0,
+            'last_lag_seconds': None,
+            'max_lag_seconds': 0.0,
+            'last_applied_at': None,
+            'publish_failed': 0
+        }
+
+    def publish(self, event):
+        """Publish a change; on failure it is kept for a later attempt and the error re-raised"""
+        try:
+            self.queue.publish(event)
+        except Exception:
+            with self._lock:
+                self.stats['publish_failed'] += 1
+                self._unpublished.append(event)
+            raise
+
+    def republish(self):
+        """Publish again the changes the queue refused; stops at the first failure"""
+        while True:
+            with self._lock:
+                if not self._unpublished:
+                    return
+                event = self._unpublished.popleft()
+            try:
+                self.queue.publish(event)
+            except Exception as e:
+                with self._lock:
+                    self._unpublished.appendleft(event)
+                print(f"Error publishing search change for {event['product_id']}: {str(e)}")
+                return
+
+    def ensure_index(self):
+        """
+        Create the products index with its mapping before the first write;
+        a bulk write would otherwise auto-create it with a dynamic mapping.
+        """
+        if self._index_ready:
+            return
+        if self.index == 'products':
+            ProductModel.ensure_products_index(self.client_factory())
+        self._index_ready = True
+
+    def target_indices(self):
+        """
+        The index to write to, plus any index a running reindex is building, so
+        changes made during the rebuild are not lost when the alias is swapped.
+        """
+        if self.index != 'products' or time.time() - self._targets_loaded_at < SYNC_TARGETS_TTL:
+            return self._targets
+        try:
+            rebuilding = list(self.client_factory().indices.get_alias(name=REINDEX_ALIAS))
+        except NotFoundError:
+            rebuilding = []
+        except Exception as e:
+            print(f"Error looking up indices being rebuilt: {str(e)}")
+            return self._targets
+        self._targets = [self.index] + rebuilding
+        self._targets_loaded_at = time.time()
+        return self._targets
+
+    def _bulk(self, changes):
+        """Apply changes once; returns product_id -> (retryable, error) for failures"""
+        failures = {}
+        actions = [to_bulk_action(change, index)
+                   for index in self.target_indices() for change in changes.values()]
+        # Wait until the writes are searchable, so on_applied runs after they are visible
+        for ok, item in helpers.streaming_bulk(
+            self.client_factory(),
+            actions,
+            raise_on_error=False,
+            raise_on_exception=False,
+            refresh='wait_for'
+        ):
+            if ok:
+                continue
+            op_type, info = next(iter(item.items()))
+            status = info.get('status')
+            # A delete of a document that is not indexed is a no-op
+            if status == 404 and op_type == 'delete':
+                continue
+            # The index already holds a newer version of the document
+            if status == 409:
+                continue
+            retryable = not isinstance(status, int) or status in RETRYABLE_STATUSES
+            failures[info.get('_id')] = (retryable, str(info.get('error', info)))
+        return failures
+
+    def apply(self, changes):
+        """
+        Apply coalesced changes with retry.
+        Returns product_id -> retryable for the changes that still failed.
+        """
+        pending = dict(changes)
+        failed = {}
+        for attempt in range(self.max_retries + 1):
+            try:
+                failures = self._bulk(pending)
+            except Exception as e:
+                failures = {product_id: (True, str(e)) for product_id in pending}
+
+            retry = {}
+            for product_id, (retryable, error) in failures.items():
+                if retryable and attempt < self.max_retries:
+                    retry[product_id] = pending[product_id]
+                else:
+                    failed[product_id] = retryable
+                    print(f"Error syncing product {product_id} to search index: {error}")
+            if not retry:
+                break
+            time.sleep(min(0.1 * (2 ** attempt), 5.0))
+            pending = retry
+        return failed
+
+    def run_once(self, wait_seconds=1):
+        """Process one batch from the queue; returns the number of messages handled"""
+        self.ensure_index()
+        self.republish()
+        messages = self.queue.receive(self.batch_size, wait_seconds)
+        if not messages:
+            return 0
+
+        changes = coalesce([message.event for message in messages])
+        try:
+            changes = resolve_refreshes(changes)
+        except Exception as e:
+            # Leave the whole batch for a later attempt
+            print(f"Error reading refreshed products: {str(e)}")
+            self.queue.release(messages)
+            return 0
+        failed = self.apply(changes)
+
+        # Transient failures go back on the queue; permanent ones are dropped and counted
+        retry_later = [m for m in messages if failed.get(m.event['product_id'])]
+        self.queue.ack([m for m in messages if not failed.get(m.event['product_id'])])
+        self.queue.release(retry_later)
+
+        now = time.time()
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['applied'] += len(changes) - len(failed)
+            self.stats['failed'] += len(failed)
+            applied = [c['first_ts'] for pid, c in changes.items() if pid not in failed]
+            if applied:
+                lag = now - min(applied)
+                self.stats['last_lag_seconds'] = round(lag, 3)
+                self.stats['max_lag_seconds'] = round(max(self.stats['max_lag_seconds'], lag), 3)
+                self.stats['last_applied_at'] = now
+        applied_ids = [product_id for product_id in changes if product_id not in failed]
+        if applied_ids and self.on_applied:
+            self.on_applied(applied_ids)
+        return len(messages)
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Search sync error: {str(e)}")
+                time.sleep(1)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='search-sync', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['unpublished'] = len(self._unpublished)
+        try:
+            stats['pending'] = self.queue.pending()
+        except Exception:
+            stats['pending'] = None
+        return stats
+
+
+def create_change_queue():
+    """The shared SQS queue, unless the in-process queue is asked for explicitly"""
+    if SEARCH_SYNC_QUEUE == 'local':
+        return LocalChangeQueue()
+    return SQSChangeQueue(PRODUCT_CHANGES_QUEUE_URL)
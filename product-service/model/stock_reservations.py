@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from util.db_utils import DynamoDB
+
+RESERVATIONS_TABLE = 'StockReservations'
+# How long a reservation_id is remembered, and so how long retries stay idempotent
+RESERVATION_RETENTION = int(os.environ.get('STOCK_RESERVATION_RETENTION', 7 * 24 * 3600))
+
+RESERVING = 'reserving'
+RESERVED = 'reserved'
+FAILED = 'failed'
+RELEASING = 'releasing'
+RELEASED = 'released'
+
+
+class ReservationConflictError(Exception):
+    """Raised when a reservation_id is reused for a different or finished operation"""
+    pass
+
+
+def items_digest(items):
+    """Order independent fingerprint of a list of (product_id, qty)"""
+    return hashlib.md5(json.dumps(sorted(items)).encode('utf-8')).hexdigest()
+
+
+class StockReservations:
+    """
+    Durable state of each reservation_id, shared by every worker.
+    A reservation moves reserving -> reserved -> releasing -> released, or
+    reserving -> failed when it was rolled back. The record also keeps the
+    ids of the products whose stock it currently holds; every stock change
+    made for the reservation updates that set in the same transaction, so
+    an interrupted reserve or release can be retried, or rolled back, without
+    taking or returning anything twice.
+    Each attempt at a reservation claims the record with a fresh attempt id;
+    writes of an older attempt fail from then on, so two requests for one
+    reservation_id never work on it at the same time.
+    """
+
+    @staticmethod
+    def _table():
+        return DynamoDB.get_connection().Table(RESERVATIONS_TABLE)
+
+    @staticmethod
+    def new_attempt():
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def get(reservation_id):
+        return StockReservations._table().get_item(
+            Key={'reservation_id': reservation_id}, ConsistentRead=True
+        ).get('Item')
+
+    @staticmethod
+    def held(reservation_id):
+        """Ids of the products the reservation currently holds stock for"""
+        return set((StockReservations.get(reservation_id) or {}).get('held', ()))
+
+    @staticmethod
+    def begin(reservation_id, items, attempt):
+        """
+        Record a new reservation in the reserving state, owned by attempt.
+        Returns None when it was recorded, or the existing record when the id was already used.
+        """
+        try:
+            StockReservations._table().put_item(
+                Item={
+                    'reservation_id': reservation_id,
+                    'status': RESERVING,
+                    'attempt': attempt,
+                    'items_digest': items_digest(items),
+                    'updated_at': datetime.now(timezone.utc).isoformat(),
+                    'expires_at': int(time.time()) + RESERVATION_RETENTION
+                },
+                ConditionExpression='attribute_not_exists(reservation_id)'
+            )
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        return StockReservations.get(reservation_id) or {}
+
+    @staticmethod
+    def claim(reservation_id, from_statuses, to_status, attempt, items):
+        """
+        Hand the reservation to a new attempt and move it to to_status. False
+        if it is in none of from_statuses or was made for different items.
+        """
+        values = {f':from{i}': status for i, status in enumerate(from_statuses)}
+        return StockReservations._update(reservation_id, attempt, to_status, {
+            'ConditionExpression': f"#status IN ({', '.join(values)}) AND items_digest = :digest",
+            'ExpressionAttributeValues': dict(values, **{':digest': items_digest(items)})
+        })
+
+    @staticmethod
+    def transition(reservation_id, from_status, to_status, attempt):
+        """Move a reservation from one state to the next. False if it was not in from_status or attempt lost it"""
+        return StockReservations._update(reservation_id, attempt, to_status, {
+            'ConditionExpression': '#status = :from AND #attempt = :attempt',
+            'ExpressionAttributeValues': {':from': from_status}
+        })
+
+    @staticmethod
+    def _update(reservation_id, attempt, to_status, condition):
+        try:
+            StockReservations._table().update_item(
+                Key={'reservation_id': reservation_id},
+                UpdateExpression='SET #status = :to, #attempt = :attempt, updated_at = :updated_at',
+                ConditionExpression=condition['ConditionExpression'],
+                ExpressionAttributeNames={'#status': 'status', '#attempt': 'attempt'},
+                ExpressionAttributeValues=dict(condition['ExpressionAttributeValues'], **{
+                    ':to': to_status,
+                    ':attempt': attempt,
+                    ':updated_at': datetime.now(timezone.utc).isoformat()
+                })
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return False
+
+    @staticmethod
+    def hold(reservation_id, attempt, product_ids):
+        """
+        Transact items recording that the reservation took stock for product_ids,
+        to be written in the same transaction as the stock change. They fail
+        if attempt lost the reservation or already holds one of the products.
+        """
+        return StockReservations._ledger_write(
+            reservation_id, attempt, product_ids, 'ADD',
+            '#status = :reserving', 'NOT contains(#held, {})', {':reserving': RESERVING}
+        )
+
+    @staticmethod
+    def unhold(reservation_id, attempt, product_ids):
+        """Transact items recording that stock for product_ids was given back; they fail unless all were held"""
+        return StockReservations._ledger_write(
+            reservation_id, attempt, product_ids, 'DELETE',
+            '#status IN (:reserving, :releasing)', 'contains(#held, {})',
+            {':reserving': RESERVING, ':releasing': RELEASING}
+        )
+
+    @staticmethod
+    def _ledger_write(reservation_id, attempt, product_ids, action, status_condition, product_condition, values):
+        if not reservation_id or not product_ids:
+            return []
+        names = [f':p{i}' for i in range(len(product_ids))]
+        condition = ' AND '.join(['#attempt = :attempt', status_condition] +
+                                 [product_condition.format(name) for name in names])
+        return [{'Update': {
+            'TableName': RESERVATIONS_TABLE,
+            'Key': {'reservation_id': reservation_id},
+            'UpdateExpression': f'{action} #held :ids',
+            'ConditionExpression': condition,
+            'ExpressionAttributeNames': {'#held': 'held', '#attempt': 'attempt', '#status': 'status'},
+            'ExpressionAttributeValues': dict(values, **dict(zip(names, product_ids)), **{
+                ':ids': set(product_ids),
+                ':attempt': attempt
+            })
+        }}]
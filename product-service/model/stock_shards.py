@@ -0,0 +1,463 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from util.db_utils import DynamoDB
+
+PRODUCTS_TABLE = 'Products'
+SHARDS_TABLE = 'ProductStockShards'
+MAX_SHARDS = 50
+REGISTRY_TTL = int(os.environ.get('STOCK_SHARD_REGISTRY_TTL', 30))
+RECONCILE_INTERVAL = int(os.environ.get('STOCK_SHARD_RECONCILE_INTERVAL', 60))
+MAX_CONFLICT_RETRIES = 5
+
+
+class InsufficientShardedStockError(Exception):
+    pass
+
+
+class NotShardedError(Exception):
+    """Raised when a product this worker thought was sharded has been folded back"""
+    pass
+
+
+class ProductNotFoundError(ValueError):
+    pass
+
+
+class LinkedConditionError(Exception):
+    """Raised when an item written together with a stock change failed its condition"""
+    pass
+
+
+def shard_key(product_id, shard):
+    # Each shard has its own partition key so writes spread over partitions
+    return f"{product_id}#{shard}"
+
+
+def split_evenly(total, shards):
+    base, remainder = divmod(int(total), shards)
+    return [base + (1 if i < remainder else 0) for i in range(shards)]
+
+
+def _is_conflict(e):
+    code = e.response['Error']['Code']
+    return code in ('ConditionalCheckFailedException', 'TransactionCanceledException')
+
+
+def _condition_failed(e):
+    # A transaction can also be cancelled by a concurrent one, which is worth retrying
+    if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+        return True
+    return any(reason.get('Code') == 'ConditionalCheckFailed'
+               for reason in e.response.get('CancellationReasons', []))
+
+
+def check_linked(e, offset):
+    """Raise LinkedConditionError if a cancelled transaction failed on an item at or after offset"""
+    if e.response['Error']['Code'] != 'TransactionCanceledException':
+        return
+    reasons = e.response.get('CancellationReasons', [])[offset:]
+    if any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons):
+        raise LinkedConditionError(f"Linked write failed its condition: {str(e)}")
+
+
+class ShardedStock:
+    """
+    Sharded stock counters for hot products.
+    While a product is sharded its base item keeps stock at 0 and records the
+    shard count in stock_shards; the real stock is spread over that many items
+    in the ProductStockShards table. Decrements pick a random shard, reads sum
+    the shards, and reconcile() folds the shards back into the base item.
+    Shard counts of the sharded products are cached per process, so the hot
+    paths never read the base item. The cached registry is never changed in
+    place: a refresh or a change builds a new dict and swaps it in, so
+    readers use it without taking a lock or copying it.
+    """
+    _registry = {}
+    _registry_loaded_at = 0
+    _registry_lock = threading.Lock()
+    _registry_refreshing = False
+
+    @staticmethod
+    def _client():
+        return DynamoDB.get_connection().meta.client
+
+    @staticmethod
+    def _shards_table():
+        return DynamoDB.get_connection().Table(SHARDS_TABLE)
+
+    @classmethod
+    def _load_registry(cls):
+        """Scan the shards table and swap in the new registry"""
+        table = cls._shards_table()
+        counts = {}
+        scan_kwargs = {'ProjectionExpression': 'product_id'}
+        while True:
+            response = table.scan(**scan_kwargs)
+            for item in response.get('Items', []):
+                counts[item['product_id']] = counts.get(item['product_id'], 0) + 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        with cls._registry_lock:
+            cls._registry = counts
+            cls._registry_loaded_at = time.time()
+        return counts
+
+    @classmethod
+    def _refresh_registry(cls):
+        try:
+            cls._load_registry()
+        except Exception as e:
+            print(f"Error refreshing the stock shard registry: {str(e)}")
+            # Keep the registry we have and try again after another REGISTRY_TTL
+            with cls._registry_lock:
+                cls._registry_loaded_at = time.time()
+        finally:
+            with cls._registry_lock:
+                cls._registry_refreshing = False
+
+    @classmethod
+    def shard_counts(cls, refresh=False):
+        """
+        product_id -> shard count of every sharded product, cached per process.
+        Once the cache is REGISTRY_TTL seconds old, a background thread scans
+        for a new one while callers keep using the current one; only the first
+        load and refresh=True scan on the caller. Do not modify the result.
+        """
+        if refresh or not cls._registry_loaded_at:
+            return cls._load_registry()
+        if time.time() - cls._registry_loaded_at >= REGISTRY_TTL:
+            with cls._registry_lock:
+                start = not cls._registry_refreshing
+                cls._registry_refreshing = True
+            if start:
+                threading.Thread(target=cls._refresh_registry, name='stock-shard-registry', daemon=True).start()
+        return cls._registry
+
+    @classmethod
+    def sharded_product_ids(cls, refresh=False):
+        return cls.shard_counts(refresh).keys()
+
+    @classmethod
+    def shard_count(cls, product_id):
+        """Cached shard count of a product, 0 when it is not sharded"""
+        return cls.shard_counts().get(product_id, 0)
+
+    @classmethod
+    def is_sharded(cls, product_id):
+        return product_id in cls.shard_counts()
+
+    @classmethod
+    def _forget(cls, product_id):
+        with cls._registry_lock:
+            if product_id in cls._registry:
+                cls._registry = {pid: n for pid, n in cls._registry.items() if pid != product_id}
+
+    @classmethod
+    def _read_shards(cls, product_id, shards):
+        """Current stock of every shard indexed by shard number, and how many shards exist"""
+        con = DynamoDB.get_connection()
+        keys = [{'shard_key': shard_key(product_id, i)} for i in range(shards)]
+        response = con.batch_get_item(RequestItems={SHARDS_TABLE: {'Keys': keys, 'ConsistentRead': True}})
+        items = list(response.get('Responses', {}).get(SHARDS_TABLE, []))
+        unprocessed = response.get('UnprocessedKeys', {}).get(SHARDS_TABLE)
+        if unprocessed:
+            for key in unprocessed['Keys']:
+                item = cls._shards_table().get_item(Key=key, ConsistentRead=True).get('Item')
+                if item:
+                    items.append(item)
+        values = [0] * shards
+        for item in items:
+            values[int(item['shard'])] = int(item['stock'])
+        return values, len(items)
+
+    @classmethod
+    def read_shards(cls, product_id, shards):
+        """Current stock of every shard, as a list indexed by shard number"""
+        return cls._read_shards(product_id, shards)[0]
+
+    @staticmethod
+    def _shard_count(product_id):
+        """Authoritative shard count and base item; only for admin paths and to confirm a cache miss"""
+        table = DynamoDB.get_connection().Table(PRODUCTS_TABLE)
+        item = table.get_item(Key={'product_id': product_id}, ConsistentRead=True).get('Item')
+        if item is None:
+            raise ProductNotFoundError(f"Product {product_id} not found")
+        return int(item.get('stock_shards', 0)), item
+
+    @classmethod
+    def _folded_back(cls, product_id):
+        # enable() writes every shard, so missing shards mean reconcile() removed them
+        cls._forget(product_id)
+        return NotShardedError(f"Product {product_id} is not sharded")
+
+    @classmethod
+    def get_stock(cls, product_id):
+        """Summed stock of a sharded product"""
+        shards, item = cls._shard_count(product_id)
+        if not shards:
+            return int(item.get('stock', 0))
+        return int(item.get('stock', 0)) + sum(cls.read_shards(product_id, shards))
+
+    @classmethod
+    def overlay(cls, items):
+        """
+        Replace the placeholder stock of sharded items with the summed shard stock.
+        Items read without stock_shards (projected reads) use the cached shard counts.
+        """
+        if not items:
+            return items
+        counts = cls.shard_counts()
+        for item in items:
+            if 'stock' not in item:
+                continue
+            shards = int(item.get('stock_shards', 0) or 0) or counts.get(item.get('product_id'), 0)
+            if shards:
+                item['stock'] = int(item.get('stock', 0)) + sum(cls.read_shards(item['product_id'], shards))
+        return items
+
+    @classmethod
+    def enable(cls, product_id, shards, until=None):
+        """Move a product's stock into shards until the given ISO time (or until reconciled)"""
+        if shards < 2 or shards > MAX_SHARDS:
+            raise ValueError(f"Shard count must be between 2 and {MAX_SHARDS}")
+        current, item = cls._shard_count(product_id)
+        if current:
+            raise ValueError(f"Product {product_id} is already sharded")
+        stock = int(item.get('stock', 0))
+
+        base_update = {
+            'TableName': PRODUCTS_TABLE,
+            'Key': {'product_id': product_id},
+            'UpdateExpression': 'SET stock = :zero, stock_shards = :shards, updated_at = :updated_at',
+            'ConditionExpression': 'stock = :stock AND attribute_not_exists(stock_shards)',
+            'ExpressionAttributeValues': {
+                ':zero': 0,
+                ':shards': shards,
+                ':stock': item.get('stock', 0),
+                ':updated_at': datetime.now(timezone.utc).isoformat()
+            }
+        }
+        if until:
+            base_update['UpdateExpression'] += ', stock_sharded_until = :until'
+            base_update['ExpressionAttributeValues'][':until'] = until
+        transact_items = [{'Update': base_update}] + [
+            {'Put': {
+                'TableName': SHARDS_TABLE,
+                'Item': {'shard_key': shard_key(product_id, i), 'product_id': product_id, 'shard': i, 'stock': value}
+            }}
+            for i, value in enumerate(split_evenly(stock, shards))
+        ]
+        cls._client().transact_write_items(TransactItems=transact_items)
+        with cls._registry_lock:
+            cls._registry = {**cls._registry, product_id: shards}
+        return stock
+
+    @classmethod
+    def _write(cls, update, linked=()):
+        """One shard update, in a transaction with the linked items if there are any"""
+        if not linked:
+            cls._shards_table().update_item(**update)
+            return
+        cls._transact([{'Update': dict(update, TableName=SHARDS_TABLE)}], linked)
+
+    @classmethod
+    def _transact(cls, transact_items, linked=()):
+        try:
+            cls._client().transact_write_items(TransactItems=transact_items + list(linked))
+        except ClientError as e:
+            if linked:
+                check_linked(e, len(transact_items))
+            raise
+
+    @classmethod
+    def decrement(cls, product_id, qty, shards=None, linked=()):
+        """
+        Take qty from the shards, trying random shards before spreading over several.
+        linked transact items are written atomically with the decrement; if one
+        of them fails its condition LinkedConditionError is raised.
+        """
+        if shards is None:
+            shards = cls.shard_count(product_id)
+        if not shards:
+            raise NotShardedError(f"Product {product_id} is not sharded")
+        order = list(range(shards))
+        random.shuffle(order)
+        for shard in order:
+            try:
+                cls._write({
+                    'Key': {'shard_key': shard_key(product_id, shard)},
+                    'UpdateExpression': 'ADD stock :delta',
+                    'ConditionExpression': 'attribute_exists(shard_key) AND stock >= :qty',
+                    'ExpressionAttributeValues': {':delta': -qty, ':qty': qty}
+                }, linked)
+                return
+            except ClientError as e:
+                if not _is_conflict(e):
+                    raise
+
+        # No single shard holds enough: take from several in one transaction
+        for _ in range(MAX_CONFLICT_RETRIES):
+            values, found = cls._read_shards(product_id, shards)
+            if not found:
+                raise cls._folded_back(product_id)
+            if sum(values) < qty:
+                raise InsufficientShardedStockError(f"Insufficient stock for {product_id}")
+            remaining = qty
+            transact_items = []
+            for shard in sorted(range(shards), key=lambda i: -values[i]):
+                if remaining <= 0:
+                    break
+                take = min(values[shard], remaining)
+                if take <= 0:
+                    continue
+                remaining -= take
+                transact_items.append({'Update': {
+                    'TableName': SHARDS_TABLE,
+                    'Key': {'shard_key': shard_key(product_id, shard)},
+                    'UpdateExpression': 'ADD stock :delta',
+                    'ConditionExpression': 'stock >= :take',
+                    'ExpressionAttributeValues': {':delta': -take, ':take': take}
+                }})
+            try:
+                cls._transact(transact_items, linked)
+                return
+            except ClientError as e:
+                if not _is_conflict(e):
+                    raise
+        raise InsufficientShardedStockError(f"Could not reserve stock for {product_id} under contention")
+
+    @classmethod
+    def increment(cls, product_id, qty, shards=None, linked=()):
+        """Return qty to a random shard, atomically with the linked transact items"""
+        if shards is None:
+            shards = cls.shard_count(product_id)
+        if not shards:
+            raise NotShardedError(f"Product {product_id} is not sharded")
+        for _ in range(MAX_CONFLICT_RETRIES):
+            try:
+                cls._write({
+                    'Key': {'shard_key': shard_key(product_id, random.randrange(shards))},
+                    'UpdateExpression': 'ADD stock :delta',
+                    'ConditionExpression': 'attribute_exists(shard_key)',
+                    'ExpressionAttributeValues': {':delta': qty}
+                }, linked)
+                return
+            except ClientError as e:
+                if not _is_conflict(e):
+                    raise
+                if _condition_failed(e):
+                    # The shard is gone: never recreate it outside of enable()
+                    raise cls._folded_back(product_id)
+        raise Exception(f"Could not return stock for {product_id} under contention")
+
+    @classmethod
+    def set_stock(cls, product_id, stock, shards=None):
+        """Overwrite the total stock of a sharded product, redistributing it evenly"""
+        if shards is None:
+            shards, _ = cls._shard_count(product_id)
+        if not shards:
+            cls._forget(product_id)
+            raise NotShardedError(f"Product {product_id} is not sharded")
+        for _ in range(MAX_CONFLICT_RETRIES):
+            values = cls.read_shards(product_id, shards)
+            transact_items = [
+                {'Put': {
+                    'TableName': SHARDS_TABLE,
+                    'Item': {'shard_key': shard_key(product_id, i), 'product_id': product_id, 'shard': i, 'stock': value},
+                    'ConditionExpression': 'attribute_not_exists(shard_key) OR stock = :observed',
+                    'ExpressionAttributeValues': {':observed': values[i]}
+                }}
+                for i, value in enumerate(split_evenly(stock, shards))
+            ]
+            try:
+                cls._client().transact_write_items(TransactItems=transact_items)
+                return
+            except ClientError as e:
+                if not _is_conflict(e):
+                    raise
+        raise Exception(f"Could not set stock for {product_id} under contention")
+
+    @classmethod
+    def reconcile(cls, product_id):
+        """Fold the shards back into the base item and stop sharding the product"""
+        shards, _ = cls._shard_count(product_id)
+        if not shards:
+            return None
+        for _ in range(MAX_CONFLICT_RETRIES):
+            values = cls.read_shards(product_id, shards)
+            transact_items = [{'Update': {
+                'TableName': PRODUCTS_TABLE,
+                'Key': {'product_id': product_id},
+                'UpdateExpression': 'SET updated_at = :updated_at ADD stock :total REMOVE stock_shards, stock_sharded_until',
+                'ConditionExpression': 'stock_shards = :shards',
+                'ExpressionAttributeValues': {
+                    ':total': sum(values),
+                    ':shards': shards,
+                    ':updated_at': datetime.now(timezone.utc).isoformat()
+                }
+            }}] + [
+                {'Delete': {
+                    'TableName': SHARDS_TABLE,
+                    'Key': {'shard_key': shard_key(product_id, i)},
+                    'ConditionExpression': 'attribute_not_exists(shard_key) OR stock = :observed',
+                    'ExpressionAttributeValues': {':observed': value}
+                }}
+                for i, value in enumerate(values)
+            ]
+            try:
+                cls._client().transact_write_items(TransactItems=transact_items)
+                cls._forget(product_id)
+                return sum(values)
+            except ClientError as e:
+                if not _is_conflict(e):
+                    raise
+        raise Exception(f"Could not reconcile stock for {product_id} under contention")
+
+    @classmethod
+    def reconcile_expired(cls):
+        """Fold back every product whose sale window (stock_sharded_until) has passed"""
+        now = datetime.now(timezone.utc).isoformat()
+        folded = []
+        for product_id in cls.sharded_product_ids(refresh=True):
+            try:
+                _, item = cls._shard_count(product_id)
+                until = item.get('stock_sharded_until')
+                if until and until <= now:
+                    cls.reconcile(product_id)
+                    folded.append(product_id)
+            except Exception as e:
+                print(f"Error reconciling stock shards for {product_id}: {str(e)}")
+        return folded
+
+
+class ShardReconciler:
+    """Background thread that periodically folds expired stock shards back"""
+
+    def __init__(self, interval=RECONCILE_INTERVAL, on_reconciled=None):
+        self.interval = interval
+        self.on_reconciled = on_reconciled
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                folded = ShardedStock.reconcile_expired()
+                if folded and self.on_reconciled:
+                    self.on_reconciled(folded)
+            except Exception as e:
+                print(f"Stock shard reconciler error: {str(e)}")
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='stock-shard-reconciler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,150 @@
+import bisect
+import threading
+
+# Cap on index positions examined per lookup so one-letter prefixes stay cheap
+MAX_SCAN = 2000
+# Names are suggested before brands, like the OpenSearch path puts completions first
+TYPE_PRIORITY = {'completion': 0, 'brand': 1}
+
+
+def normalize(text):
+    return ' '.join(str(text).lower().split())
+
+
+class SuggestIndex:
+    """
+    In-process autocomplete index over product names and brands.
+    Every word start of a name or brand is kept in one sorted array, so a
+    prefix lookup is a binary search plus a short scan. Names come before
+    brands; within each, suggestions are ranked by popularity, the summed
+    popularity(product_id) of the products behind them, and then by how
+    many products share them.
+    """
+
+    def __init__(self, popularity=None):
+        self.popularity = popularity
+        self._lock = threading.RLock()
+        self._terms = []        # sorted (term, entry_key)
+        self._entries = {}      # entry_key -> suggestion entry
+        self._products = {}     # product_id -> entry keys the product contributes to
+        self._unsorted = None   # terms collected by build(), sorted once at the end
+        self.ready = False
+
+    @staticmethod
+    def _positions(text):
+        words = text.split(' ')
+        return {' '.join(words[i:]) for i in range(len(words))}
+
+    def _add_entry(self, key, text, suggestion_type, product_id, metadata=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {'text': text, 'type': suggestion_type, 'product_ids': set(), 'metadata': metadata}
+            self._entries[key] = entry
+            for term in self._positions(key[1]):
+                if self._unsorted is not None:
+                    self._unsorted.append((term, key))
+                else:
+                    bisect.insort(self._terms, (term, key))
+        elif metadata is not None:
+            entry['metadata'] = metadata
+        entry['product_ids'].add(product_id)
+
+    def _remove_entry(self, key, product_id):
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry['product_ids'].discard(product_id)
+        if entry['product_ids']:
+            return
+        del self._entries[key]
+        for term in self._positions(key[1]):
+            i = bisect.bisect_left(self._terms, (term, key))
+            if i < len(self._terms) and self._terms[i] == (term, key):
+                del self._terms[i]
+
+    def add_product(self, product):
+        """Index or re-index a product after it was written"""
+        product_id = product.get('product_id')
+        if not product_id:
+            return
+        with self._lock:
+            self.remove_product(product_id)
+            keys = []
+            if product.get('name'):
+                key = ('completion', normalize(product['name']))
+                self._add_entry(key, product['name'], 'completion', product_id, metadata={
+                    'brand': product.get('brand_name'),
+                    'price': float(product['price']) if product.get('price') is not None else None,
+                    'category_id': product.get('category_id')
+                })
+                keys.append(key)
+            if product.get('brand_name'):
+                key = ('brand', normalize(product['brand_name']))
+                self._add_entry(key, product['brand_name'], 'brand', product_id)
+                keys.append(key)
+            self._products[product_id] = keys
+
+    def remove_product(self, product_id):
+        with self._lock:
+            for key in self._products.pop(product_id, []):
+                self._remove_entry(key, product_id)
+
+    def build(self, products):
+        """
+        Rebuild the whole index from an iterable of catalog items.
+        Terms are collected and sorted once instead of inserted one by one,
+        which would be quadratic in the catalog size.
+        """
+        latest = {}
+        for product in products:
+            if product.get('product_id'):
+                latest[product['product_id']] = product
+        fresh = SuggestIndex(self.popularity)
+        fresh._unsorted = []
+        for product in latest.values():
+            fresh.add_product(product)
+        fresh._terms = sorted(fresh._unsorted)
+        fresh._unsorted = None
+        with self._lock:
+            self._terms = fresh._terms
+            self._entries = fresh._entries
+            self._products = fresh._products
+            self.ready = True
+
+    def lookup(self, prefix, size=10):
+        """Return up to size suggestions for the prefix, names first, most popular first"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            matches = {}
+            i = bisect.bisect_left(self._terms, (prefix,))
+            end = min(len(self._terms), i + MAX_SCAN)
+            while i < end and self._terms[i][0].startswith(prefix):
+                key = self._terms[i][1]
+                matches[key] = self._entries[key]
+                i += 1
+
+            popularity = self.popularity
+            scored = []
+            for entry in matches.values():
+                score = sum(popularity(pid) for pid in entry['product_ids']) if popularity else 0
+                scored.append((TYPE_PRIORITY[entry['type']], -score, -len(entry['product_ids']), entry['text'], entry))
+            scored.sort(key=lambda s: s[:4])
+            results = []
+            for _, score, _, _, entry in scored[:size]:
+                suggestion = {
+                    'text': entry['text'],
+                    'type': entry['type'],
+                    'score': round(-score, 3)
+                }
+                if entry['metadata'] is not None:
+                    suggestion['metadata'] = dict(entry['metadata'])
+                results.append(suggestion)
+            return results
+
+    def __len__(self):
+        return len(self._entries)
+
+
+suggest_index = SuggestIndex()
@@ -0,0 +1,52 @@
+"""
+Rebuild the products OpenSearch index from DynamoDB and swap it in.
+
+    python reindex.py [--segments 8] [--page-size 1000] [--max-errors 0] [--keep-old]
+                      [--replace-concrete-index]
+
+The Products table is read with a parallel Scan, one thread per segment,
+and every page is streamed into _bulk requests against a new timestamped
+index built from the current mapping. When the load is complete the
+products alias is moved to it atomically, so searches keep running on the
+old index until then. Changes the search sync applies during the rebuild
+are written to the new index too. Use it to ship mapping changes.
+
+The first run replaces the original concrete products index, which the
+swap has to delete; pass --replace-concrete-index to allow that.
+"""
+import argparse
+import json
+from model.reindex import ProductReindexer, REINDEX_SEGMENTS, REINDEX_PAGE_SIZE, PRODUCTS_ALIAS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=REINDEX_SEGMENTS,
+                        help='parallel scan segments, one thread each')
+    parser.add_argument('--page-size', type=int, default=REINDEX_PAGE_SIZE,
+                        help='items per DynamoDB scan page')
+    parser.add_argument('--alias', default=PRODUCTS_ALIAS)
+    parser.add_argument('--max-errors', type=int, default=0,
+                        help='products allowed to fail indexing before the swap is abandoned')
+    parser.add_argument('--keep-old', action='store_true',
+                        help='keep the previous index instead of deleting it after the swap')
+    parser.add_argument('--replace-concrete-index', action='store_true',
+                        help='allow the first swap to delete the concrete products index')
+    args = parser.parse_args()
+
+    reindexer = ProductReindexer(
+        segments=args.segments,
+        page_size=args.page_size,
+        alias=args.alias,
+        max_errors=args.max_errors,
+        keep_old=args.keep_old,
+        replace_concrete=args.replace_concrete_index
+    )
+    stats = reindexer.run()
+    for product_id, error in list(reindexer.errors.items())[:20]:
+        print(f"Failed to index {product_id}: {error}")
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+# Tests import the service modules the way app.py does, from the service root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_dynamodb import FakeDynamoDB  # noqa: E402
+from model.stock_shards import ShardedStock  # noqa: E402
+from util.db_utils import DynamoDB  # noqa: E402
+
+
+@pytest.fixture
+def fake_db():
+    """Every DynamoDB.get_connection() returns one in-memory FakeDynamoDB"""
+    db = FakeDynamoDB()
+    with mock.patch.object(DynamoDB, 'get_connection', return_value=db), \
+            mock.patch.object(ShardedStock, '_registry', {}), \
+            mock.patch.object(ShardedStock, '_registry_loaded_at', 0):
+        yield db
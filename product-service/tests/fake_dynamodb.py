@@ -0,0 +1,244 @@
+"""
+In-memory stand-in for the boto3 DynamoDB resource, covering the calls and
+the expression forms the service uses. Conditions are conjunctions of
+attribute_exists, attribute_not_exists, [NOT] contains, IN, = and >=,
+optionally joined with OR. Queries support an equality key condition on the
+table or one of its global secondary indexes; scans and queries are paged
+with Limit and ExclusiveStartKey, in key order.
+"""
+import copy
+import re
+
+from botocore.exceptions import ClientError
+
+KEYS = {
+    'Products': 'product_id',
+    'ProductStockShards': 'shard_key',
+    'StockReservations': 'reservation_id',
+}
+# Hash key of each global secondary index
+INDEXES = {
+    'CategoryIndex': 'category_id',
+}
+
+
+def client_error(code, message='', **extra):
+    return ClientError(dict({'Error': {'Code': code, 'Message': message}}, **extra), 'FakeOperation')
+
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.tables = {name: {} for name in KEYS}
+        self.meta = _Meta(self)
+        # Callables run around every write request, to inject failures
+        self.before_write = []
+        self.after_write = []
+
+    def Table(self, name):
+        return FakeTable(self, name)
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for name, request in RequestItems.items():
+            key = KEYS[name]
+            items = [self.tables[name].get(k[key]) for k in request['Keys']]
+            responses[name] = [copy.deepcopy(item) for item in items if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def _run(self, hooks, request):
+        for hook in list(hooks):
+            hook(request)
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        self._run(self.before_write, TransactItems)
+        staged = {name: copy.deepcopy(items) for name, items in self.tables.items()}
+        reasons = []
+        failed = False
+        for entry in TransactItems:
+            (kind, request), = entry.items()
+            try:
+                _apply(staged, kind, request)
+                reasons.append({'Code': 'None'})
+            except ClientError as e:
+                failed = True
+                reason = {'Code': 'ConditionalCheckFailed'}
+                if request.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD':
+                    old = staged[request['TableName']].get(_key(request))
+                    if old is not None:
+                        reason['Item'] = copy.deepcopy(old)
+                reasons.append(reason)
+        if failed:
+            raise client_error('TransactionCanceledException', 'Transaction cancelled',
+                               CancellationReasons=reasons)
+        self.tables = staged
+        self._run(self.after_write, TransactItems)
+        return {}
+
+
+class _Meta:
+    def __init__(self, db):
+        self.client = db
+
+
+class FakeTable:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def get_item(self, Key, **kwargs):
+        item = self.db.tables[self.name].get(Key[KEYS[self.name]])
+        return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, **request):
+        self._write('Put', request)
+        return {}
+
+    def update_item(self, **request):
+        self._write('Update', request)
+        if request.get('ReturnValues') == 'ALL_NEW':
+            return {'Attributes': copy.deepcopy(self.db.tables[self.name][_key(dict(request, TableName=self.name))])}
+        return {}
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return _BatchWriter(self)
+
+    def _write(self, kind, request):
+        request = dict(request, TableName=self.name)
+        self.db._run(self.db.before_write, [{kind: request}])
+        _apply(self.db.tables, kind, request)
+        self.db._run(self.db.after_write, [{kind: request}])
+
+    def scan(self, Segment=0, TotalSegments=1, **kwargs):
+        key = KEYS[self.name]
+        items = sorted(self.db.tables[self.name].values(), key=lambda item: item[key])
+        return self._page(items[Segment::TotalSegments], (key,), **kwargs)
+
+    def query(self, KeyConditionExpression, IndexName=None, **kwargs):
+        key = KEYS[self.name]
+        hash_key = INDEXES[IndexName] if IndexName else key
+        condition = KeyConditionExpression.get_expression()
+        attribute, value = condition['values']
+        assert condition['operator'] == '=' and attribute.name == hash_key, 'only hash key equality is supported'
+        # Items sharing an index hash key come back in table key order
+        items = sorted((item for item in self.db.tables[self.name].values() if item.get(hash_key) == value),
+                       key=lambda item: item[key])
+        return self._page(items, {key, hash_key}, **kwargs)
+
+    def _page(self, items, key_attributes, Limit=None, ExclusiveStartKey=None, **kwargs):
+        key = KEYS[self.name]
+        if ExclusiveStartKey:
+            items = [item for item in items if item[key] > ExclusiveStartKey[key]]
+        response = {}
+        if Limit is not None and len(items) >= Limit:
+            # Like DynamoDB, a full page always carries a LastEvaluatedKey, even if it was the last
+            items = items[:Limit]
+            response['LastEvaluatedKey'] = {k: items[-1][k] for k in key_attributes}
+        response['Items'] = [_project(item, kwargs) for item in items]
+        return response
+
+
+class _BatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+
+def _project(item, request):
+    if 'ProjectionExpression' not in request:
+        return copy.deepcopy(item)
+    names = request.get('ExpressionAttributeNames', {})
+    attributes = [_name(token.strip(), names) for token in request['ProjectionExpression'].split(',')]
+    return {attr: copy.deepcopy(item[attr]) for attr in attributes if attr in item}
+
+
+def _key(request):
+    if 'Item' in request:
+        return request['Item'][KEYS[request['TableName']]]
+    return request['Key'][KEYS[request['TableName']]]
+
+
+def _apply(tables, kind, request):
+    table = tables[request['TableName']]
+    key = _key(request)
+    current = table.get(key)
+    names = request.get('ExpressionAttributeNames', {})
+    values = request.get('ExpressionAttributeValues', {})
+    if request.get('ConditionExpression') and not _check(request['ConditionExpression'], current, names, values):
+        raise client_error('ConditionalCheckFailedException', 'The conditional request failed')
+    if kind == 'Put':
+        table[key] = copy.deepcopy(request['Item'])
+    elif kind == 'Delete':
+        table.pop(key, None)
+    else:
+        item = copy.deepcopy(current) if current is not None else dict(request['Key'])
+        _update(item, request['UpdateExpression'], names, values)
+        table[key] = item
+
+
+def _name(token, names):
+    return names.get(token, token)
+
+
+def _check(expression, item, names, values):
+    return any(_check_all(part, item or {}, names, values) for part in expression.split(' OR '))
+
+
+def _check_all(expression, item, names, values):
+    for atom in expression.split(' AND '):
+        atom = atom.strip()
+        negate = atom.startswith('NOT ')
+        if negate:
+            atom = atom[4:]
+        match = re.fullmatch(r'(attribute_exists|attribute_not_exists)\((\S+)\)', atom)
+        if match:
+            exists = _name(match.group(2), names) in item
+            result = exists if match.group(1) == 'attribute_exists' else not exists
+        elif atom.startswith('contains('):
+            attr, value = [part.strip() for part in atom[len('contains('):-1].split(',')]
+            result = values[value] in item.get(_name(attr, names), ())
+        else:
+            match = re.fullmatch(r'(\S+) (=|>=|IN) (.+)', atom)
+            current = item.get(_name(match.group(1), names))
+            if match.group(2) == 'IN':
+                options = [values[v.strip()] for v in match.group(3).strip('()').split(',')]
+                result = current in options
+            elif match.group(2) == '=':
+                result = current == values[match.group(3)]
+            else:
+                result = current is not None and current >= values[match.group(3)]
+        if result == negate:
+            return False
+    return True
+
+
+def _update(item, expression, names, values):
+    for action, body in re.findall(r'(SET|ADD|DELETE|REMOVE) (.*?)(?= (?:SET|ADD|DELETE|REMOVE) |$)', expression):
+        for clause in body.split(','):
+            clause = clause.strip()
+            if action == 'SET':
+                attr, value = [part.strip() for part in clause.split('=')]
+                item[_name(attr, names)] = values[value]
+            elif action == 'REMOVE':
+                item.pop(_name(clause, names), None)
+            else:
+                attr, value = clause.split()
+                attr = _name(attr, names)
+                value = values[value]
+                if action == 'ADD' and isinstance(value, set):
+                    item[attr] = set(item.get(attr, set())) | value
+                elif action == 'ADD':
+                    item[attr] = item.get(attr, 0) + value
+                else:
+                    remaining = set(item.get(attr, set())) - value
+                    if remaining:
+                        item[attr] = remaining
+                    else:
+                        item.pop(attr, None)
@@ -0,0 +1,36 @@
+import asyncio
+import threading
+from unittest import mock
+
+from model import async_product_search
+from model.async_product_search import AsyncProductSearch
+from model.product_search_utils import ProductSearch
+
+
+def test_async_search_shares_the_sync_caches():
+    sync = ProductSearch()
+    search = AsyncProductSearch(cache=sync.cache, facet_cache=sync.facet_cache)
+    sync.cache.cache_results({'search_term': 'shoe'}, {'hits': []})
+    assert search.get_cached_search({'search_term': 'shoe'}) == {'hits': []}
+    sync.cache.clear()
+    assert search.get_cached_search({'search_term': 'shoe'}) is None
+
+
+def test_local_fallback_runs_off_the_event_loop():
+    search = AsyncProductSearch()
+    threads = []
+
+    def local(query_params):
+        threads.append(threading.current_thread())
+        return {'degraded': True}
+
+    async def run():
+        with mock.patch.object(search, 'search_available', return_value=False), \
+                mock.patch.object(async_product_search, 'local_search') as local_search:
+            local_search.search.side_effect = local
+            result = await search.search_products({'search_term': 'shoe'})
+        return result, threading.current_thread()
+
+    result, loop_thread = asyncio.run(run())
+    assert result == {'degraded': True}
+    assert threads and threads[0] is not loop_thread
@@ -0,0 +1,69 @@
+from unittest import mock
+
+import pytest
+
+import app as product_app
+from model.product import ProductModel
+
+
+@pytest.fixture
+def client(fake_db):
+    product_app.response_cache.clear()
+    yield product_app.app.test_client()
+
+
+def add_products(db, count):
+    ids = [f'p{i:03d}' for i in range(count)]
+    for product_id in ids:
+        db.tables['Products'][product_id] = {'product_id': product_id, 'name': product_id, 'stock': 1}
+    return ids
+
+
+def test_keys_are_fetched_in_chunks_and_unprocessed_keys_retried(fake_db, monkeypatch):
+    ids = add_products(fake_db, 250)
+    requests = []
+    batch_get_item = fake_db.batch_get_item
+
+    def throttled(RequestItems):
+        keys = RequestItems['Products']['Keys']
+        requests.append(len(keys))
+        # The first request only gets half of its keys processed
+        if len(requests) == 1:
+            response = batch_get_item({'Products': {'Keys': keys[:50]}})
+            response['UnprocessedKeys'] = {'Products': {'Keys': keys[50:]}}
+            return response
+        return batch_get_item(RequestItems)
+    monkeypatch.setattr(fake_db, 'batch_get_item', throttled)
+
+    with mock.patch('model.product.time.sleep'):
+        products = ProductModel.batch_get_products(ids + ['nope'])
+
+    assert requests == [100, 50, 100, 51]
+    assert sorted(products) == ids
+
+
+def test_cached_products_are_served_without_dynamodb(client, fake_db, monkeypatch):
+    add_products(fake_db, 3)
+    client.get('/products/p000')
+    requested = []
+    batch_get_item = fake_db.batch_get_item
+    monkeypatch.setattr(fake_db, 'batch_get_item', lambda RequestItems: requested.extend(
+        key['product_id'] for key in RequestItems['Products']['Keys']) or batch_get_item(RequestItems))
+
+    response = client.post('/products/batch', json={'ids': ['p001', 'p000', 'nope', 'p001']})
+
+    assert response.status_code == 200
+    assert requested == ['p001', 'nope']
+    body = response.get_json()
+    assert body['missing'] == ['nope']
+    assert sorted(body['products']) == ['p000', 'p001']
+    assert body['products']['p001']['name'] == 'p001'
+    # What the batch read is now cached for single lookups
+    assert client.get('/products/p001').headers['X-Cache'] == 'HIT'
+
+
+@pytest.mark.parametrize('body', [{}, {'ids': []}, {'ids': 'p1'}, {'ids': ['p1', '']},
+                                  {'ids': [f'p{i}' for i in range(product_app.MAX_BATCH_IDS + 1)]}])
+def test_invalid_id_lists_are_a_bad_request(client, fake_db, body):
+    response = client.post('/products/batch', json=body)
+    assert response.status_code == 400
@@ -0,0 +1,81 @@
+import time
+from unittest import mock
+
+import pytest
+
+import app as product_app
+from util.cache_warmer import AccessTracker, CacheWarmer
+from util.response_cache import ResponseCache
+
+
+def test_tracker_ranks_by_decaying_access_counts():
+    tracker = AccessTracker(half_life=10, min_count=1)
+    for _ in range(4):
+        tracker.record('product:a', '/products/a')
+    tracker.record('product:b', '/products/b')
+    tracker.register('products:category:c?', '/products/productsbycategory/c')
+
+    assert tracker.top(2) == [('product:a', '/products/a'), ('products:category:c?', '/products/productsbycategory/c')]
+
+    # One half-life later b has decayed below min_count and is forgotten
+    tracker._decayed_at -= 10
+    tracker.decay()
+    assert tracker.count('product:a') == 2
+    assert tracker.count('product:b') == 0
+    assert len(tracker) == 2
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(default_timeout=60)
+
+
+def test_warmer_refreshes_hot_entries_about_to_expire(cache):
+    refreshed = []
+    warmer = CacheWarmer(cache, refreshed.append, top_n=3, lead=30)
+    for key, accesses in (('hot-expiring', 5), ('hot-fresh', 4), ('hot-missing', 3), ('cold', 1)):
+        for _ in range(accesses):
+            cache.access_tracker.record(key, f'/{key}')
+    cache.set('hot-expiring', {}, timeout=10)
+    cache.set('hot-fresh', {}, timeout=300)
+    cache.set('cold', {}, timeout=1)
+
+    assert warmer.run_once() == 2
+    assert refreshed == ['/hot-expiring', '/hot-missing']
+
+
+def test_refresh_errors_are_counted_and_do_not_stop_the_run(cache):
+    def refresh(path):
+        if path == '/a':
+            raise RuntimeError('DynamoDB is down')
+    warmer = CacheWarmer(cache, refresh, top_n=2)
+    cache.access_tracker.record('a', '/a')
+    cache.access_tracker.record('b', '/b')
+
+    assert warmer.run_once() == 1
+    assert warmer.get_stats() == {'refreshed': 1, 'errors': 1, 'runs': 1, 'tracked_keys': 2}
+
+
+def test_category_listings_are_pre_warmed_and_refreshed_without_counting_as_traffic(fake_db):
+    product_app.response_cache.clear()
+    fake_db.tables['Products']['p1'] = {
+        'product_id': 'p1', 'name': 'Lamp', 'price': 10, 'stock': 3, 'category_id': 'lighting', 'brand_name': 'Acme'
+    }
+    key = 'products:category:lighting?'
+    tracker = product_app.response_cache.access_tracker
+    tracker.forget(key)
+
+    product_app.prewarm_category_listings({'lighting', None})
+    assert product_app.response_cache.get(key) is not None
+    assert tracker.count(key) == tracker.seed_count
+
+    fake_db.tables['Products']['p2'] = dict(fake_db.tables['Products']['p1'], product_id='p2')
+    product_app.response_cache._entries[key].expires_at = time.time() + 1
+    with mock.patch.object(product_app.cache_warmer, 'top_n', 1000):
+        product_app.cache_warmer.run_once()
+
+    listing = product_app.app.test_client().get('/products/productsbycategory/lighting')
+    assert listing.headers['X-Cache'] == 'HIT'
+    assert sorted(product['product_id'] for product in listing.get_json()) == ['p1', 'p2']
+    # Only the client request above counted as an access
+    assert tracker.count(key) == tracker.seed_count + 1
@@ -0,0 +1,105 @@
+import os
+from decimal import Decimal
+
+import pytest
+
+from model.catalog_snapshot import (CatalogSnapshot, CatalogSnapshotWriter, SnapshotError,
+                                    load_snapshot, write_snapshot)
+from model.product_data import load_product_records
+
+ITEMS = [
+    {'product_id': 'p1', 'name': 'Lampe à poser', 'price': Decimal('19.99'), 'stock': Decimal(3),
+     'category_id': 'lighting', 'brand_name': 'Acme', 'description': 'Warm light',
+     'product_image_url': 'https://example.com/p1.jpg',
+     'created_at': '2024-01-01T00:00:00+00:00', 'updated_at': '2024-01-02T00:00:00+00:00'},
+    {'product_id': 'p2', 'name': 'Desk', 'price': Decimal('120'), 'stock': Decimal(0),
+     'category_id': 'furniture', 'brand_name': 'Acme'},
+]
+
+
+def test_round_trip_keeps_every_field(tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    assert write_snapshot(ITEMS, path) == 2
+
+    with CatalogSnapshot(path) as snapshot:
+        assert len(snapshot) == 2
+        assert list(snapshot) == ITEMS
+
+
+def test_product_records_can_be_written(tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    write_snapshot(load_product_records(ITEMS), path)
+    with CatalogSnapshot(path) as snapshot:
+        assert list(snapshot) == ITEMS
+
+
+def test_empty_catalog(tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    write_snapshot([], path)
+    with CatalogSnapshot(path) as snapshot:
+        assert list(snapshot) == []
+
+
+def test_unusable_snapshots_are_ignored(tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    assert load_snapshot(path) is None
+
+    open(path, 'wb').close()
+    assert load_snapshot(path) is None
+
+    with open(path, 'wb') as f:
+        f.write(b'not a snapshot')
+    assert load_snapshot(path) is None
+    with pytest.raises(SnapshotError):
+        CatalogSnapshot(path)
+
+    write_snapshot(ITEMS, path)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 1)
+    assert load_snapshot(path) is None
+
+
+def test_old_snapshots_are_ignored(tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    write_snapshot(ITEMS, path)
+    assert load_snapshot(path, max_age=0.000001) is None
+    with load_snapshot(path, max_age=60) as snapshot:
+        assert len(snapshot) == 2
+
+
+def test_writer_reads_snapshots_written_by_other_workers(tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    writer = CatalogSnapshotWriter(lambda: ITEMS, path=path)
+    other = CatalogSnapshotWriter(lambda: ITEMS, path=path)
+
+    assert writer.write() == ITEMS
+    assert writer.is_fresh()
+    # Its own snapshot is not news to the worker that wrote it
+    assert writer.read() is None
+    assert other.read() == ITEMS
+    assert other.read() is None
+
+
+def test_round_trip_keeps_other_attributes_and_missing_stock(tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    items = [
+        {'product_id': 'p3', 'name': 'Chair', 'price': Decimal('45.5'), 'category_id': 'furniture',
+         'brand_name': 'Acme', 'tags': ['oak', 'dining'],
+         'specifications': [{'name': 'weight', 'value': Decimal('4.5')}],
+         'variants': [{'sku': 'p3-red', 'stock': Decimal(2)}]},
+    ]
+    write_snapshot(items, path)
+    with CatalogSnapshot(path) as snapshot:
+        assert list(snapshot) == items
+
+
+def test_product_records_keep_the_other_attributes(tmp_path):
+    items = [dict(ITEMS[1], tags=['oak'], variants=[{'sku': 'p2-l', 'stock': Decimal(1)}])]
+    records = load_product_records(items)
+    assert records[0].get('tags') == ['oak']
+    assert records[0].to_dict() == items[0]
+
+    path = str(tmp_path / 'catalog.snap')
+    write_snapshot(records, path)
+    with CatalogSnapshot(path) as snapshot:
+        assert list(snapshot) == items
@@ -0,0 +1,52 @@
+import pytest
+from flask import Flask
+from flask_caching import Cache
+
+from util import catalog_version
+from util.catalog_version import CatalogVersion
+from util.search_cache import SearchCache
+
+
+def test_unbound_token_carries_the_process_id():
+    version = CatalogVersion()
+    before = version.token
+    version.bump()
+    assert version.token != before
+    assert version.token.startswith(f'{CatalogVersion._process_id}-')
+
+
+@pytest.fixture
+def shared_store(monkeypatch):
+    monkeypatch.setattr(catalog_version, 'CATALOG_VERSION_POLL', 0)
+    store = Cache(Flask(__name__), config={'CACHE_TYPE': 'SimpleCache'}).cache
+    CatalogVersion().bind(store)
+    yield store
+    CatalogVersion().bind(None)
+
+
+def test_bound_generation_follows_writes_made_by_other_workers(shared_store):
+    version = CatalogVersion()
+    before = version.bump()
+    cache = SearchCache()
+    cache.cache_results('lamp', ['p1'])
+
+    # Another worker handles a write
+    shared_store.inc(catalog_version.GENERATION_KEY)
+
+    assert version.generation == before + 1
+    assert cache.get_cached_results('lamp') is None
+
+
+def test_bound_generation_is_not_reread_within_the_poll_interval(shared_store, monkeypatch):
+    monkeypatch.setattr(catalog_version, 'CATALOG_VERSION_POLL', 60)
+    version = CatalogVersion()
+    generation = version.bump()
+    shared_store.inc(catalog_version.GENERATION_KEY)
+    assert version.generation == generation
+
+
+def test_bound_token_is_the_shared_generation(shared_store):
+    version = CatalogVersion()
+    version.bump()
+    assert version.shared
+    assert version.token == str(shared_store.get(catalog_version.GENERATION_KEY))
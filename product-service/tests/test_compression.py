@@ -0,0 +1,88 @@
+import gzip
+
+import pytest
+from flask import Flask, Response
+
+from util import compression
+from util.compression import COMPRESS_MIN_SIZE, choose_encoding, init_compression
+from util.response_cache import ResponseCache, cached_response
+
+LARGE_BODY = b'{"products":[' + b','.join([b'{"name":"Lamp"}'] * 200) + b']}'
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    (None, None),
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('gzip;q=1.0, br;q=0.5', 'gzip'),
+    ('gzip, br', 'br'),
+    ('*', 'br'),
+    ('br;q=0, gzip', 'gzip'),
+])
+def test_choose_encoding_honours_quality_values(monkeypatch, accept_encoding, expected):
+    monkeypatch.setattr(compression, 'PREFERRED_ENCODINGS', ['br', 'gzip'])
+    assert choose_encoding(accept_encoding) == expected
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    init_compression(app)
+
+    @app.route('/large')
+    def large():
+        response = Response(LARGE_BODY, mimetype='application/json')
+        response.set_etag('v1')
+        return response
+
+    @app.route('/small')
+    def small():
+        return Response(b'{"ok":true}', mimetype='application/json')
+
+    @app.route('/image')
+    def image():
+        return Response(b'\0' * COMPRESS_MIN_SIZE * 2, mimetype='image/png')
+
+    return app.test_client()
+
+
+def test_large_json_is_compressed_with_a_weak_etag(client):
+    response = client.get('/large', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == LARGE_BODY
+    assert response.headers['ETag'] == 'W/"v1"'
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_identity_is_sent_when_nothing_acceptable_is_offered(client):
+    response = client.get('/large', headers={'Accept-Encoding': 'compress'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == LARGE_BODY
+    assert response.headers['ETag'] == '"v1"'
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_small_and_binary_responses_are_left_alone(client):
+    for path in ('/small', '/image'):
+        response = client.get(path, headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+
+
+def test_cached_entries_are_compressed_once_per_encoding():
+    cache = ResponseCache()
+    app = Flask(__name__)
+    init_compression(app)
+    app.add_url_rule('/cached', 'cached', cached_response(cache, lambda: 'cached')(
+        lambda: {'products': [{'name': 'Lamp'}] * 200}
+    ))
+    client = app.test_client()
+
+    first = client.get('/cached', headers={'Accept-Encoding': 'gzip'})
+    second = client.get('/cached', headers={'Accept-Encoding': 'gzip'})
+    assert first.headers['Content-Encoding'] == second.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(second.data) == cache.get('cached').body
+    assert list(cache.get('cached').encoded) == ['gzip']
+    # A weak ETag still revalidates
+    response = client.get('/cached', headers={'If-None-Match': second.headers['ETag']})
+    assert response.status_code == 304
@@ -0,0 +1,76 @@
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from fake_dynamodb import FakeDynamoDB
+from util.circuit_breaker import CircuitBreaker, CircuitState
+from util.db_utils import DynamoDBUnavailableError, GuardedResource
+
+
+def client_error(code, status=400):
+    return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'GetItem')
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker('test-dynamodb', failure_threshold=2, reset_timeout=60)
+
+
+@pytest.fixture
+def db():
+    db = FakeDynamoDB()
+    db.tables['Products']['p1'] = {'product_id': 'p1', 'stock': 3}
+    return db
+
+
+def test_table_calls_pass_through(db, breaker):
+    table = GuardedResource(db, breaker).Table('Products')
+    assert table.get_item(Key={'product_id': 'p1'})['Item']['stock'] == 3
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_failing_requests_open_the_circuit(db, breaker, monkeypatch):
+    table = GuardedResource(db, breaker).Table('Products')
+    calls = []
+
+    def unreachable(**kwargs):
+        calls.append(kwargs)
+        raise EndpointConnectionError(endpoint_url='https://dynamodb')
+    monkeypatch.setattr(table._target, 'get_item', unreachable)
+
+    for _ in range(2):
+        with pytest.raises(EndpointConnectionError):
+            table.get_item(Key={'product_id': 'p1'})
+    assert breaker.state == CircuitState.OPEN
+    with pytest.raises(DynamoDBUnavailableError):
+        table.get_item(Key={'product_id': 'p1'})
+    assert len(calls) == 2
+
+
+def test_refused_conditions_do_not_count_but_throttling_does(db, breaker, monkeypatch):
+    table = GuardedResource(db, breaker).Table('Products')
+    errors = iter([client_error('ConditionalCheckFailedException'), client_error('ConditionalCheckFailedException'),
+                   client_error('ValidationException'), client_error('ThrottlingException'),
+                   client_error('InternalServerError', 500)])
+
+    def refused(**kwargs):
+        raise next(errors)
+    monkeypatch.setattr(table._target, 'update_item', refused)
+
+    for _ in range(3):
+        with pytest.raises(ClientError):
+            table.update_item(Key={'product_id': 'p1'})
+    assert breaker.state == CircuitState.CLOSED
+    for _ in range(2):
+        with pytest.raises(ClientError):
+            table.update_item(Key={'product_id': 'p1'})
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_batch_and_transaction_calls_are_guarded(db, breaker):
+    breaker.state = CircuitState.OPEN
+    breaker.last_failure_time = float('inf')
+    resource = GuardedResource(db, breaker)
+    with pytest.raises(DynamoDBUnavailableError):
+        resource.batch_get_item(RequestItems={'Products': {'Keys': [{'product_id': 'p1'}]}})
+    with pytest.raises(DynamoDBUnavailableError):
+        resource.meta.client.transact_write_items(TransactItems=[])
@@ -0,0 +1,107 @@
+from decimal import Decimal
+
+import pytest
+
+from model.local_search import LocalSearchEngine
+from model.product_search import SearchAPI
+
+PRODUCTS = [
+    {'product_id': 'p1', 'name': 'Desk Lamp', 'brand_name': 'Acme', 'category_id': 'lighting',
+     'description': 'LED lamp', 'price': Decimal('40'), 'stock': 5, 'created_at': '2024-01-01T00:00:00'},
+    {'product_id': 'p2', 'name': 'Floor Lamp', 'brand_name': 'Lumen', 'category_id': 'lighting',
+     'description': 'Tall lamp', 'price': Decimal('150'), 'stock': 2, 'created_at': '2024-02-01T00:00:00'},
+    {'product_id': 'p3', 'name': 'Oak Desk', 'brand_name': 'Acme', 'category_id': 'furniture',
+     'description': 'Solid oak', 'price': Decimal('600'), 'stock': 1, 'created_at': '2024-03-01T00:00:00'},
+    {'product_id': 'p4', 'name': 'Lamp Shade', 'brand_name': 'Acme', 'category_id': 'lighting',
+     'price': Decimal('20'), 'stock': 9, 'created_at': '2024-04-01T00:00:00'},
+]
+
+
+@pytest.fixture
+def engine():
+    engine = LocalSearchEngine()
+    engine.build(PRODUCTS)
+    return engine
+
+
+def ids(results):
+    return [hit['_source']['product_id'] for hit in results['hits']]
+
+
+def test_not_ready_until_built():
+    engine = LocalSearchEngine()
+    assert not engine.ready
+    with pytest.raises(Exception):
+        engine.search({'page': 1, 'size': 10})
+
+
+def test_every_term_must_match_and_the_last_one_is_a_prefix(engine):
+    assert sorted(ids(engine.search({'search_term': 'lamp', 'page': 1, 'size': 10}))) == ['p1', 'p2', 'p4']
+    assert ids(engine.search({'search_term': 'desk la', 'page': 1, 'size': 10})) == ['p1']
+    assert engine.search({'search_term': 'lamp oak', 'page': 1, 'size': 10})['total'] == 0
+
+
+def test_scores_use_the_opensearch_field_boosts(engine):
+    # "led" is only in p1's description, "acme" is a brand
+    results = engine.search({'search_term': 'led', 'page': 1, 'size': 10})
+    assert ids(results) == ['p1']
+    assert results['hits'][0]['_score'] == pytest.approx(0.2)
+    assert engine.search({'search_term': 'acme', 'page': 1, 'size': 10})['hits'][0]['_score'] == 4.0
+
+
+def test_filters_and_facets(engine):
+    results = engine.search({
+        'category_id': 'lighting', 'price_ranges': '[{"min": 30, "max": 200}]', 'page': 1, 'size': 10
+    })
+    assert sorted(ids(results)) == ['p1', 'p2']
+    facets = results['aggregations']
+    assert facets['brands']['buckets'] == [{'key': 'Acme', 'doc_count': 1}, {'key': 'Lumen', 'doc_count': 1}]
+    assert facets['categories']['buckets'] == [{'key': 'lighting', 'doc_count': 2}]
+    assert [bucket['doc_count'] for bucket in facets['price_ranges']['buckets']] == [1, 1, 0, 0, 0, 0]
+    assert results['degraded'] is True
+
+
+def test_results_format_like_opensearch_results(engine):
+    response = SearchAPI().format_response(engine.search({'search_term': 'lamp', 'page': 1, 'size': 2}))
+    assert response['metadata']['total'] == 3
+    assert response['metadata']['total_pages'] == 2
+    assert response['metadata']['degraded'] is True
+
+
+def test_sorting_and_page_pagination(engine):
+    params = {'sort_by': 'price', 'sort_order': 'asc', 'size': 2}
+    assert ids(engine.search(dict(params, page=1))) == ['p4', 'p1']
+    assert ids(engine.search(dict(params, page=2))) == ['p2', 'p3']
+    assert ids(engine.search({'sort_by': 'name.keyword', 'sort_order': 'asc', 'page': 1, 'size': 4})) == [
+        'p1', 'p2', 'p4', 'p3'
+    ]
+
+
+def test_cursor_pagination_walks_every_result_once(engine):
+    params = {'sort_by': 'created_at', 'sort_order': 'desc', 'size': 3, 'cursor': ''}
+    first = engine.search(params)
+    assert ids(first) == ['p4', 'p3', 'p2']
+    second = engine.search(dict(params, cursor=first['next_cursor']))
+    assert ids(second) == ['p1']
+    assert second['next_cursor'] is None
+
+
+def test_sparse_fieldsets_limit_the_source(engine):
+    results = engine.search({'search_term': 'oak', 'fields': ['name', 'product_id'], 'page': 1, 'size': 10})
+    assert results['hits'][0]['_source'] == {'product_id': 'p3', 'name': 'Oak Desk'}
+
+
+def test_sparse_fieldsets_leave_out_score_and_highlights_unless_named(engine):
+    api = SearchAPI()
+    params, error = api.validate_search_params({'search_term': 'lamp', 'fields': 'name'})
+    assert error is None
+    product = api.format_response(engine.search(params), params['fields'])['products'][0]
+    assert set(product) == {'product_id', 'name', 'updated_at'}
+
+    params, _ = api.validate_search_params({'search_term': 'lamp', 'fields': 'name,score'})
+    product = api.format_response(engine.search(params), params['fields'])['products'][0]
+    assert set(product) == {'product_id', 'name', 'updated_at', 'score'}
+
+    params, _ = api.validate_search_params({'search_term': 'lamp'})
+    product = api.format_response(engine.search(params))['products'][0]
+    assert {'score', 'highlights'} <= set(product)
@@ -0,0 +1,253 @@
+import json
+from unittest import mock
+
+import pytest
+
+import app as product_app
+from fake_dynamodb import FakeTable
+from model.catalog_snapshot import CatalogSnapshot, write_snapshot
+from model.search_sync import LocalChangeQueue, SearchIndexSyncer
+
+AUTH = {'Authorization': 'Bearer token'}
+
+
+@pytest.fixture
+def client(fake_db):
+    product_app.response_cache.clear()
+    with mock.patch('util.auth_utils.validate_token_with_user_service', return_value={'user_id': 'u1'}), \
+            mock.patch.object(product_app, 'search_sync', SearchIndexSyncer(LocalChangeQueue())):
+        yield product_app.app.test_client()
+
+
+def test_create_product_without_optional_fields_is_queued_for_indexing(client, fake_db):
+    response = client.post('/products/create', headers=AUTH, json=[
+        {'product_id': 'p1', 'name': 'Lamp', 'price': 10, 'stock': 3, 'category_id': 'c1', 'brand_name': 'Acme'},
+        {'product_id': 'p2', 'name': 'Desk', 'price': 90, 'stock': 1, 'category_id': 'c1', 'brand_name': 'Acme',
+         'description': 'Oak desk', 'product_image_url': 'https://example.com/p2.jpg'},
+    ])
+
+    assert response.status_code == 200
+    assert [item['queued_for_indexing'] for item in response.get_json()['results']] == [True, True]
+    assert set(fake_db.tables['Products']) == {'p1', 'p2'}
+    events = {message.event['product_id']: message.event
+              for message in product_app.search_sync.queue.receive(wait_seconds=0)}
+    assert events['p1']['doc']['description'] == ''
+    assert events['p1']['doc']['product_image_url'] == ''
+
+
+def test_reserving_a_sharded_product_changes_its_etag(client, fake_db):
+    fake_db.tables['Products']['p1'] = {
+        'product_id': 'p1', 'name': 'Lamp', 'price': 10, 'stock': 10,
+        'category_id': 'c1', 'brand_name': 'Acme', 'updated_at': '2024-01-01T00:00:00+00:00'
+    }
+    product_app.ShardedStock.enable('p1', 2)
+    before = client.get('/products/p1')
+    assert before.last_modified is None
+
+    client.post('/products/stock/reserve', headers=AUTH, json={'items': [{'product_id': 'p1', 'qty': 3}]})
+    after = client.get('/products/p1', headers={'If-None-Match': before.headers['ETag']})
+
+    assert after.status_code == 200
+    assert after.get_json()['stock'] == 7
+
+
+@pytest.mark.parametrize('reservation_id', ['', 42, ['r1'], {'id': 'r1'}])
+def test_invalid_reservation_id_is_a_bad_request(client, fake_db, reservation_id):
+    fake_db.tables['Products']['p1'] = {'product_id': 'p1', 'stock': 10}
+    for path in ('/products/stock/reserve', '/products/stock/release'):
+        response = client.post(path, headers=AUTH, json={
+            'items': [{'product_id': 'p1', 'qty': 1}], 'reservation_id': reservation_id
+        })
+        assert response.status_code == 400
+    assert fake_db.tables['Products']['p1']['stock'] == 10
+
+
+def test_cold_start_builds_the_snapshot_from_the_warm_up_scan(fake_db, tmp_path, monkeypatch):
+    fake_db.tables['Products']['p1'] = {
+        'product_id': 'p1', 'name': 'Lamp', 'price': 10, 'stock': 3, 'category_id': 'c1', 'brand_name': 'Acme'
+    }
+    scans = []
+    products_table = fake_db.Table('Products')
+    monkeypatch.setattr(fake_db, 'Table', lambda name: products_table if name == 'Products' else FakeTable(fake_db, name))
+    monkeypatch.setattr(products_table, 'scan', lambda **kwargs: scans.append(kwargs) or {
+        'Items': list(fake_db.tables['Products'].values())
+    })
+    writer = product_app.catalog_snapshot_writer
+    monkeypatch.setattr(writer, 'path', str(tmp_path / 'catalog.snap'))
+    with mock.patch.object(writer, 'start') as start, \
+            mock.patch.object(product_app, 'prewarm_category_listings'):
+        product_app.warm_on_startup()
+
+    assert len(scans) == 1
+    start.assert_called_once()
+    with product_app.load_snapshot(writer.path) as snapshot:
+        assert [item['product_id'] for item in snapshot] == ['p1']
+    # The writer's first round finds the snapshot it would have written
+    assert writer.read() is None
+
+
+def test_refused_search_publish_is_reported_and_kept(client, fake_db):
+    fake_db.tables['Products']['p1'] = {
+        'product_id': 'p1', 'name': 'Lamp', 'price': 10, 'stock': 10,
+        'category_id': 'c1', 'brand_name': 'Acme', 'updated_at': '2024-01-01T00:00:00+00:00'
+    }
+    with mock.patch.object(product_app.search_sync.queue, 'publish', side_effect=ConnectionError('down')):
+        response = client.patch('/products/p1/stock', headers=AUTH, json={'stock': 4})
+
+    assert response.status_code == 200
+    assert response.headers['Warning'] == product_app.SEARCH_SYNC_WARNING
+    assert fake_db.tables['Products']['p1']['stock'] == 4
+    stats = product_app.search_sync.get_stats()
+    assert (stats['publish_failed'], stats['unpublished']) == (1, 1)
+
+
+def test_listing_etag_matches_on_a_worker_that_did_not_mint_it(client, fake_db):
+    fake_db.tables['Products']['p1'] = {
+        'product_id': 'p1', 'name': 'Lamp', 'price': 10, 'stock': 3, 'category_id': 'c1', 'brand_name': 'Acme'
+    }
+    etag = client.get('/products/get').headers['ETag']
+    # A different worker has nothing cached and its own catalog generation
+    product_app.response_cache.clear()
+    product_app.CatalogVersion().bump()
+
+    response = client.get('/products/get', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_products_seeded_from_a_snapshot_do_not_share_the_live_etag(client, fake_db, tmp_path, monkeypatch):
+    item = {
+        'product_id': 'p1', 'name': 'Lamp', 'price': 10, 'stock': 3, 'category_id': 'c1',
+        'brand_name': 'Acme', 'updated_at': '2024-01-01T00:00:00+00:00'
+    }
+    fake_db.tables['Products']['p1'] = dict(item)
+    path = str(tmp_path / 'catalog.snap')
+    write_snapshot([item], path)
+    monkeypatch.setattr(product_app, 'load_snapshot', lambda: CatalogSnapshot(path))
+    monkeypatch.setattr(product_app.catalog_snapshot_writer, 'path', path)
+    with mock.patch.object(product_app, 'warm_suggest_index'):
+        assert product_app.warm_caches_from_snapshot()
+
+    seeded = client.get('/products/p1')
+    assert seeded.headers['X-Cache'] == 'HIT'
+    product_app.response_cache.clear()
+    live = client.get('/products/p1', headers={'If-None-Match': seeded.headers['ETag']})
+    assert live.status_code == 200
+    assert live.headers['ETag'] != seeded.headers['ETag']
+
+
+def test_create_rejects_unknown_attributes(client, fake_db):
+    response = client.post('/products/create', headers=AUTH, json=[
+        {'product_id': 'p1', 'name': 'Lamp', 'price': 10, 'stock': 3, 'category_id': 'c1', 'brand_name': 'Acme',
+         'colour': 'red'},
+    ])
+
+    assert response.status_code == 207
+    result = response.get_json()['results'][0]
+    assert result['stored'] is False
+    assert result['error'].startswith('Invalid product')
+    assert fake_db.tables['Products'] == {}
+
+
+def test_category_listing_pages_through_the_category_index(client, fake_db):
+    for i in range(5):
+        fake_db.tables['Products'][f'p{i}'] = {
+            'product_id': f'p{i}', 'name': f'Lamp {i}', 'price': 10, 'stock': 3,
+            'category_id': 'lighting', 'brand_name': 'Acme'
+        }
+    fake_db.tables['Products']['d1'] = {
+        'product_id': 'd1', 'name': 'Desk', 'price': 90, 'stock': 1, 'category_id': 'furniture', 'brand_name': 'Acme'
+    }
+
+    pages = []
+    cursor = ''
+    while True:
+        body = client.get(f'/products/productsbycategory/lighting?limit=2&fields=name&cursor={cursor}').get_json()
+        pages.append([product['product_id'] for product in body['products']])
+        assert all(set(product) <= {'product_id', 'name', 'updated_at'} for product in body['products'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+
+    assert pages == [['p0', 'p1'], ['p2', 'p3'], ['p4']]
+    unpaged = client.get('/products/productsbycategory/lighting').get_json()
+    assert sorted(product['product_id'] for product in unpaged) == ['p0', 'p1', 'p2', 'p3', 'p4']
+    assert client.get('/products/productsbycategory/lighting?cursor=not-a-cursor').status_code == 400
+
+
+def seed_catalog(fake_db, count):
+    for i in range(count):
+        fake_db.tables['Products'][f'p{i}'] = {
+            'product_id': f'p{i}', 'name': f'Lamp {i}', 'price': 10, 'stock': 3,
+            'category_id': 'lighting', 'brand_name': 'Acme'
+        }
+
+
+def test_catalog_pages_by_cursor(client, fake_db):
+    seed_catalog(fake_db, 5)
+
+    pages = []
+    cursor = ''
+    while True:
+        body = client.get(f'/products/get?limit=2&cursor={cursor}').get_json()
+        pages.append([product['product_id'] for product in body['products']])
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+
+    assert pages == [['p0', 'p1'], ['p2', 'p3'], ['p4']]
+
+
+def test_catalog_streams_one_product_per_line_page_by_page(client, fake_db, monkeypatch):
+    seed_catalog(fake_db, 5)
+    scans = []
+    scan = FakeTable.scan
+
+    def recording_scan(self, **kwargs):
+        if self.name == 'Products':
+            scans.append(kwargs)
+        return scan(self, **kwargs)
+    monkeypatch.setattr(FakeTable, 'scan', recording_scan)
+
+    response = client.get('/products/get?format=ndjson&limit=2')
+
+    assert response.mimetype == 'application/x-ndjson'
+    assert 'X-Cache' not in response.headers
+    lines = response.data.split(b'\n')
+    assert lines[-1] == b''
+    assert [json.loads(line)['product_id'] for line in lines[:-1]] == ['p0', 'p1', 'p2', 'p3', 'p4']
+    assert [kwargs['Limit'] for kwargs in scans] == [2, 2, 2]
+    accept = client.get('/products/get', headers={'Accept': 'application/x-ndjson'})
+    assert accept.data.count(b'\n') == 5
+
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=101', 'limit=ten', 'cursor=not-a-cursor', 'cursor=WzFd'])
+def test_invalid_catalog_paging_parameters_are_a_bad_request(client, fake_db, query):
+    response = client.get(f'/products/get?{query}')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid parameters'
+
+
+def test_create_writes_in_batches_and_reports_a_failed_batch(client, fake_db, monkeypatch):
+    writers = []
+    batch_writer = FakeTable.batch_writer
+
+    def counting_batch_writer(self, **kwargs):
+        writers.append(kwargs)
+        if len(writers) == 2:
+            raise ConnectionError('write failed')
+        return batch_writer(self, **kwargs)
+    monkeypatch.setattr(FakeTable, 'batch_writer', counting_batch_writer)
+
+    products = [{'product_id': f'p{i:02d}', 'name': 'Lamp', 'price': 10, 'stock': 1,
+                 'category_id': 'c1', 'brand_name': 'Acme'} for i in range(60)]
+    response = client.post('/products/create', headers=AUTH, json=products)
+
+    assert response.status_code == 207
+    assert len(writers) == 3
+    body = response.get_json()
+    assert (body['succeeded'], body['failed']) == (35, 25)
+    stored = [item['stored'] for item in body['results']]
+    assert stored == [True] * 25 + [False] * 25 + [True] * 10
+    assert len(fake_db.tables['Products']) == 35
+    queued = product_app.search_sync.queue.receive(max_messages=100, wait_seconds=0)
+    assert len(queued) == 35
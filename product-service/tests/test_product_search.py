@@ -0,0 +1,195 @@
+from unittest import mock
+
+import pytest
+from opensearchpy.exceptions import ConnectionTimeout, NotFoundError, RequestError, TransportError
+
+from model import product_search_utils
+from model.product_search import SearchAPI
+from model.product_search_utils import InvalidSearchRequestError, ProductSearch
+from util.circuit_breaker import CircuitBreaker
+from util.pagination import encode_cursor
+
+
+@pytest.fixture
+def search():
+    search = ProductSearch()
+    search.breaker = CircuitBreaker('test-search', failure_threshold=2)
+    client = mock.Mock()
+    with mock.patch.object(ProductSearch, 'client', new=client), \
+            mock.patch.object(product_search_utils, 'local_search') as local:
+        local.ready = True
+        local.search.return_value = {'degraded': True}
+        search.local = local
+        search.mock_client = client
+        yield search
+
+
+def test_rejected_cursor_is_a_bad_request_and_leaves_the_breaker_closed(search):
+    search.mock_client.search.side_effect = RequestError(400, 'parse_exception', {})
+    cursor = encode_cursor({'search_after': ['bogus']})
+    for _ in range(5):
+        with pytest.raises(InvalidSearchRequestError):
+            search.search_products({'cursor': cursor, 'page': 1, 'size': 20})
+    assert search.breaker.failures == 0
+    assert search.breaker.can_execute()
+    search.local.search.assert_not_called()
+
+
+def test_expired_point_in_time_is_a_bad_request(search):
+    search.mock_client.search.side_effect = NotFoundError(404, 'search_context_missing_exception', {})
+    with pytest.raises(InvalidSearchRequestError):
+        search.search_products({'page': 1, 'size': 20})
+    assert search.breaker.failures == 0
+
+
+@pytest.mark.parametrize('error', [
+    ConnectionTimeout('TIMEOUT', 'timed out', None),
+    TransportError(503, 'unavailable', {}),
+    NotFoundError(404, 'index_not_found_exception', {}),
+])
+def test_outages_open_the_breaker_and_fall_back(search, error):
+    search.mock_client.search.side_effect = error
+    assert search.search_products({'page': 1, 'size': 20}) == {'degraded': True}
+    assert search.search_products({'page': 2, 'size': 20}) == {'degraded': True}
+    assert not search.breaker.can_execute()
+
+
+def test_success_resets_consecutive_failures(search):
+    search.mock_client.search.side_effect = [TransportError(500, 'boom', {}), {
+        'hits': {'hits': [], 'total': {'value': 0}},
+        'aggregations': {}
+    }]
+    search.search_products({'page': 1, 'size': 20})
+    search.search_products({'page': 1, 'size': 21})
+    assert search.breaker.failures == 0
+
+
+def test_malformed_cursor_shape_is_rejected_up_front():
+    api = SearchAPI()
+    cursor = encode_cursor({'search_after': 'not-a-list'})
+    params, error = api.validate_search_params({'cursor': cursor})
+    assert params is None
+    assert error == 'Invalid cursor'
+
+
+@pytest.fixture
+def local_suggest():
+    with mock.patch.object(product_search_utils, 'suggest_index') as index:
+        index.ready = True
+        index.lookup.return_value = []
+        yield index
+
+
+def test_suggest_outage_opens_the_breaker_and_falls_back(search, local_suggest):
+    search.mock_client.msearch.side_effect = ConnectionTimeout('TIMEOUT', 'timed out', None)
+    assert search.suggest_products('lam', 5) == []
+    assert search.suggest_products('lamp', 5) == []
+    assert not search.breaker.can_execute()
+    assert search.mock_client.msearch.call_args.kwargs['request_timeout'] == product_search_utils.SEARCH_REQUEST_TIMEOUT
+
+    # While the circuit is open OpenSearch is not asked at all
+    search.suggest_products('lamps', 5)
+    assert search.mock_client.msearch.call_count == 2
+
+
+def test_rejected_suggest_leaves_the_breaker_closed(search, local_suggest):
+    search.mock_client.msearch.side_effect = RequestError(400, 'parse_exception', {})
+    with pytest.raises(RequestError):
+        search.suggest_products('lam', 5)
+    assert search.breaker.failures == 0
+
+
+FACETS = {
+    'price_ranges': {'buckets': [{'key': '*-100.0', 'doc_count': 2}]},
+    'brands': {'buckets': [{'key': 'Acme', 'doc_count': 2}]},
+    'categories': {'buckets': [{'key': 'lighting', 'doc_count': 2}]},
+}
+
+
+def search_response(*product_ids, aggregations=FACETS, pit_id=None):
+    hits = [{'_id': pid, '_score': 1.0, '_source': {'product_id': pid}, 'sort': [1.0, pid]} for pid in product_ids]
+    response = {'hits': {'hits': hits, 'total': {'value': 10}}}
+    if aggregations is not None:
+        response['aggregations'] = aggregations
+    if pit_id:
+        response['pit_id'] = pit_id
+    return response
+
+
+def test_facets_are_computed_once_per_query_and_filters(search):
+    search.mock_client.search.side_effect = [
+        search_response('p1', 'p2'), search_response('p3', 'p4', aggregations=None), search_response('p5')
+    ]
+    params = {'search_term': 'lamp', 'category_id': 'lighting', 'size': 2}
+
+    search.search_products(dict(params, page=1))
+    second = search.search_products(dict(params, page=2, sort_by='price', sort_order='asc'))
+    search.search_products(dict(params, category_id='furniture', page=1))
+
+    bodies = [call.kwargs['body'] for call in search.mock_client.search.call_args_list]
+    assert ['aggs' in body for body in bodies] == [True, False, True]
+    assert not any(body.get('explain') for body in bodies)
+    # Later pages are answered with the facets of the first one
+    assert second['aggregations'] == FACETS
+    assert SearchAPI().format_response(second)['aggregations']['brands'] == [{'key': 'Acme', 'doc_count': 2}]
+
+
+def test_cursor_pages_use_search_after_with_a_product_id_tiebreaker(search):
+    search.mock_client.search.side_effect = [search_response('p1', 'p2'), search_response('p3')]
+    params, error = SearchAPI().validate_search_params({'q': 'lamp', 'size': '2', 'cursor': ''})
+    assert error is None
+
+    first = search.search_products(params)
+    second = search.search_products(dict(params, cursor=first['next_cursor']))
+
+    first_body, second_body = [call.kwargs['body'] for call in search.mock_client.search.call_args_list]
+    assert 'from' not in first_body and 'search_after' not in first_body
+    assert first_body['sort'][-1] == {'product_id': {'order': 'asc'}}
+    assert second_body['search_after'] == [1.0, 'p2']
+    assert 'from' not in second_body
+    # A short page is the last one
+    assert second['next_cursor'] is None
+    assert SearchAPI().format_response(first)['metadata']['next_cursor'] == first['next_cursor']
+
+
+def test_point_in_time_is_opened_once_and_carried_in_the_cursor(search):
+    search.mock_client.create_pit.return_value = {'pit_id': 'pit-1'}
+    search.mock_client.search.side_effect = [search_response('p1', 'p2', pit_id='pit-2'), search_response('p3')]
+    params = {'search_term': 'lamp', 'page': 1, 'size': 2, 'cursor': '', 'pit': True}
+
+    first = search.search_products(params)
+    search.search_products(dict(params, cursor=first['next_cursor']))
+
+    search.mock_client.create_pit.assert_called_once()
+    calls = search.mock_client.search.call_args_list
+    # A point-in-time search must not name the index
+    assert [call.kwargs['index'] for call in calls] == [None, None]
+    assert calls[0].kwargs['body']['pit']['id'] == 'pit-1'
+    assert calls[1].kwargs['body']['pit']['id'] == 'pit-2'
+
+
+def suggest_msearch_response(names, popular, popular_error=None):
+    options = [{'_score': 2.0, '_source': {'name': name, 'brand_name': 'Acme'}} for name in names]
+    popular_response = {'error': popular_error} if popular_error else {
+        'aggregations': {'popular_searches': {'buckets': [{'key': key, 'doc_count': 3} for key in popular]}}
+    }
+    return {'responses': [{'suggest': {'name_completion': [{'options': options}]}}, popular_response]}
+
+
+def test_suggestions_and_popular_searches_share_one_round_trip(search, local_suggest):
+    search.mock_client.msearch.return_value = suggest_msearch_response(['Lamp'], ['lamp', 'Lamp Shade'])
+
+    suggestions = search.suggest_products('lam', 3)
+
+    assert [(s['text'], s['type']) for s in suggestions] == [('Lamp', 'completion'), ('Lamp Shade', 'popular')]
+    search.mock_client.msearch.assert_called_once()
+    search.mock_client.search.assert_not_called()
+    body = search.mock_client.msearch.call_args.kwargs['body']
+    assert body[::2] == [{'index': 'products'}, {'index': 'products'}]
+    assert 'popular_searches' in body[3]['aggs']
+
+
+def test_failed_popular_searches_leave_the_suggestions(search, local_suggest):
+    search.mock_client.msearch.return_value = suggest_msearch_response(['Lamp'], [], popular_error='boom')
+    assert [s['text'] for s in search.suggest_products('lam', 3)] == ['Lamp']
+    search.mock_client.search.assert_not_called()
@@ -0,0 +1,83 @@
+from unittest import mock
+
+import pytest
+
+from model import product, reindex
+from model.reindex import ProductReindexer, ReindexError
+from model.search_sync import REINDEX_ALIAS
+
+
+class RecordingBulk:
+    def __init__(self, failing=()):
+        self.actions = []
+        self.failing = failing
+
+    def __call__(self, client, actions, **kwargs):
+        for action in actions:
+            self.actions.append(action)
+            if action['_id'] in self.failing:
+                yield False, {'index': {'_id': action['_id'], 'status': 400, 'error': 'mapper_parsing_exception'}}
+            else:
+                yield True, {}
+
+
+@pytest.fixture
+def client(fake_db, monkeypatch):
+    for i in range(10):
+        fake_db.tables['Products'][f'p{i}'] = {
+            'product_id': f'p{i}', 'name': f'Lamp {i}', 'price': 10, 'stock': 1, 'category_id': 'c1',
+            'brand_name': 'Acme', 'updated_at': '2024-01-01T00:00:00+00:00'
+        }
+    client = mock.Mock()
+    client.indices.exists_alias.return_value = True
+    client.indices.get_alias.return_value = {'products-old': {}}
+    client.count.return_value = {'count': 10}
+    monkeypatch.setattr(product.ProductModel, 'get_opensearch_client', lambda: client)
+    monkeypatch.setattr(reindex.time, 'sleep', lambda seconds: None)
+    return client
+
+
+def test_segments_are_loaded_in_parallel_and_the_alias_swapped_atomically(client, monkeypatch):
+    bulk = RecordingBulk()
+    monkeypatch.setattr(product.helpers, 'streaming_bulk', bulk)
+
+    stats = ProductReindexer(segments=3, page_size=2, progress_interval=60).run()
+
+    index = stats['index']
+    assert sorted(action['_id'] for action in bulk.actions) == sorted(f'p{i}' for i in range(10))
+    assert {action['_index'] for action in bulk.actions} == {index}
+    assert all(action['version_type'] == 'external' for action in bulk.actions)
+    assert (stats['scanned'], stats['segments_done'], stats['errors']) == (10, 3, 0)
+    assert stats['previous'] == ['products-old']
+
+    created = client.indices.create.call_args.kwargs
+    assert created['index'] == index
+    assert created['body']['aliases'] == {REINDEX_ALIAS: {}}
+    client.indices.update_aliases.assert_called_once_with(body={'actions': [
+        {'remove': {'index': 'products-old', 'alias': 'products'}},
+        {'add': {'index': index, 'alias': 'products'}},
+        {'remove': {'index': index, 'alias': REINDEX_ALIAS}},
+    ]})
+    client.indices.delete.assert_called_once_with(index='products-old', ignore=[404])
+
+
+def test_failed_load_deletes_the_new_index_and_keeps_the_alias(client, monkeypatch):
+    monkeypatch.setattr(product.helpers, 'streaming_bulk', RecordingBulk(failing={'p3'}))
+    reindexer = ProductReindexer(segments=2, page_size=4, progress_interval=60)
+
+    with pytest.raises(ReindexError):
+        reindexer.run()
+
+    assert list(reindexer.errors) == ['p3']
+    client.indices.update_aliases.assert_not_called()
+    new_index = client.indices.create.call_args.kwargs['index']
+    client.indices.delete.assert_called_once_with(index=new_index, ignore=[404])
+
+
+def test_concrete_index_is_only_replaced_when_confirmed(client):
+    client.indices.exists_alias.return_value = False
+    client.indices.exists.return_value = True
+
+    with pytest.raises(ReindexError):
+        ProductReindexer(segments=1).run()
+    client.indices.create.assert_not_called()
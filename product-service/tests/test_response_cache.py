@@ -0,0 +1,164 @@
+import datetime
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify
+
+from test_single_flight import CountingEvent
+from util.response_cache import ResponseCache, cached_response, encode_json, STALE_WARNING
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(default_timeout=60)
+
+
+def make_app(cache, view, validators=None):
+    app = Flask(__name__)
+    app.add_url_rule('/items/<item_id>', 'item', cached_response(
+        cache, lambda item_id: f'item:{item_id}', validators=validators
+    )(view))
+    return app.test_client()
+
+
+def test_hits_are_served_from_the_encoded_bytes(cache):
+    calls = []
+
+    def view(item_id):
+        calls.append(item_id)
+        return {'id': item_id, 'price': 1.5}
+
+    client = make_app(cache, view)
+    first = client.get('/items/a')
+    second = client.get('/items/a')
+
+    assert calls == ['a']
+    assert (first.headers['X-Cache'], second.headers['X-Cache']) == ('MISS', 'HIT')
+    assert second.data == first.data == encode_json({'id': 'a', 'price': 1.5})
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert second.headers['Content-Length'] == str(len(first.data))
+
+
+def test_matching_if_none_match_is_answered_with_304(cache):
+    client = make_app(cache, lambda item_id: {'id': item_id})
+    etag = client.get('/items/a').headers['ETag']
+
+    response = client.get('/items/a', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    assert client.get('/items/a', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_validators_known_up_front_skip_the_view(cache):
+    calls = []
+    modified = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def view(item_id):
+        calls.append(item_id)
+        return {'id': item_id}
+
+    client = make_app(cache, view, validators=lambda payload: ('v1', modified))
+    response = client.get('/items/a', headers={'If-None-Match': '"v1"'})
+
+    assert response.status_code == 304
+    assert response.headers['X-Cache'] == 'MISS'
+    assert calls == []
+    response = client.get('/items/a', headers={'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+    assert response.status_code == 304
+
+
+def test_responses_and_error_tuples_are_not_cached(cache):
+    client = make_app(cache, lambda item_id: (jsonify({'error': 'Not found'}), 404))
+    assert client.get('/items/a').status_code == 404
+    assert cache.get('item:a') is None
+
+
+def test_concurrent_misses_run_the_view_once(cache):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def view(item_id):
+        calls.append(item_id)
+        started.set()
+        release.wait(5)
+        return {'id': item_id}
+
+    client = make_app(cache, view)
+    responses = []
+    leader = threading.Thread(target=lambda: responses.append(client.get('/items/a')))
+    leader.start()
+    started.wait(5)
+    done = cache.flight._calls['item:a'].done = CountingEvent()
+    waiter = threading.Thread(target=lambda: responses.append(client.get('/items/a')))
+    waiter.start()
+    while not done.waiting:
+        pass
+    release.set()
+    leader.join()
+    waiter.join()
+
+    assert calls == ['a']
+    assert sorted(response.headers['X-Cache'] for response in responses) == ['COALESCED', 'MISS']
+    assert responses[0].data == responses[1].data
+
+
+def expire(cache, key, seconds_ago=1):
+    cache._entries[key].expires_at = time.time() - seconds_ago
+
+
+def failing_after_first(result):
+    calls = []
+
+    def view(item_id):
+        calls.append(item_id)
+        if len(calls) > 1:
+            return result()
+        return {'id': item_id, 'stock': 3}
+    return view
+
+
+def test_expired_entry_is_served_stale_when_the_view_raises(cache):
+    def outage():
+        raise RuntimeError('circuit open')
+
+    client = make_app(cache, failing_after_first(outage))
+    fresh = client.get('/items/a')
+    expire(cache, 'item:a')
+
+    response = client.get('/items/a')
+    assert response.status_code == 200
+    assert response.data == fresh.data
+    assert response.headers['X-Cache'] == 'STALE'
+    assert response.headers['Warning'] == STALE_WARNING
+
+
+def test_expired_entry_is_served_stale_on_a_server_error(cache):
+    client = make_app(cache, failing_after_first(lambda: (jsonify({'error': 'boom'}), 503)))
+    client.get('/items/a')
+    expire(cache, 'item:a')
+
+    response = client.get('/items/a')
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'STALE'
+
+
+def test_entries_past_the_stale_grace_are_not_served(cache):
+    def outage():
+        raise RuntimeError('circuit open')
+
+    client = make_app(cache, failing_after_first(outage))
+    client.get('/items/a')
+    expire(cache, 'item:a', seconds_ago=cache.stale_grace + 1)
+
+    assert client.get('/items/a').status_code == 500
+    assert cache.get_stale('item:a') is None
+
+
+def test_expired_entries_are_misses_for_get(cache):
+    cache.set('item:a', {'id': 'a'})
+    expire(cache, 'item:a')
+    assert cache.get('item:a') is None
+    assert cache.get_stale('item:a').body == encode_json({'id': 'a'})
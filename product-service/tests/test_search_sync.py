@@ -0,0 +1,221 @@
+from model import search_sync
+from model.search_sync import LocalChangeQueue, SearchIndexSyncer, coalesce
+
+
+def event(product_id, op, ts, **extra):
+    return dict({'product_id': product_id, 'op': op, 'ts': ts}, **extra)
+
+
+def test_coalesce_refresh_replaces_an_earlier_document():
+    changes = coalesce([
+        event('p1', 'index', 1.0, doc={'product_id': 'p1', 'stock': 3}, version=1000000),
+        event('p1', 'refresh', 2.0),
+    ])
+    change = changes['p1']
+    assert change['op'] == 'refresh'
+    assert change['first_ts'] == 1.0
+
+
+def test_coalesce_index_after_refresh_is_read_again():
+    changes = coalesce([
+        event('p1', 'refresh', 1.0),
+        event('p1', 'index', 2.0, doc={'product_id': 'p1', 'stock': 3}, version=2000000),
+    ])
+    assert changes['p1']['op'] == 'refresh'
+    assert changes['p1']['first_ts'] == 1.0
+
+
+def test_coalesce_reads_legacy_partial_updates_again():
+    changes = coalesce([event('p1', 'update', 1.0, doc={'price': 5.0})])
+    assert changes['p1']['op'] == 'refresh'
+
+
+def test_coalesce_refresh_after_delete_is_ignored():
+    changes = coalesce([
+        event('p1', 'delete', 1.0),
+        event('p1', 'refresh', 2.0),
+    ])
+    assert changes['p1']['op'] == 'delete'
+    assert changes['p1']['first_ts'] == 1.0
+
+
+class FakeBulk:
+    def __init__(self):
+        self.actions = []
+
+    def __call__(self, client, actions, **kwargs):
+        for action in actions:
+            self.actions.append(action)
+            yield True, {}
+
+
+def make_syncer(monkeypatch, items):
+    bulk = FakeBulk()
+    monkeypatch.setattr(search_sync.helpers, 'streaming_bulk', bulk)
+    monkeypatch.setattr(search_sync.ProductModel, 'batch_get_products',
+                        lambda product_ids, **kwargs: {pid: items[pid] for pid in product_ids if pid in items})
+    queue = LocalChangeQueue()
+    syncer = SearchIndexSyncer(queue, client_factory=lambda: None)
+    # No cluster here; the index is assumed to exist and no reindex is running
+    syncer._index_ready = True
+    monkeypatch.setattr(syncer, 'target_indices', lambda: ['products'])
+    return syncer, queue, bulk
+
+
+def test_run_once_indexes_refreshed_products_versioned_by_updated_at(monkeypatch):
+    item = {'product_id': 'p1', 'name': 'Lamp', 'brand_name': 'Acme', 'category_id': 'c1', 'price': 5, 'stock': 7,
+            'updated_at': '2024-01-02T00:00:00+00:00'}
+    syncer, queue, bulk = make_syncer(monkeypatch, {'p1': item})
+    queue.publish(event('p1', 'refresh', 1.0))
+    queue.publish(event('p1', 'refresh', 2.0))
+    queue.publish(event('p2', 'index', 3.0, doc={'product_id': 'p2', 'stock': 1}, version=4000000))
+    queue.publish(event('p3', 'refresh', 4.0))
+
+    assert syncer.run_once(wait_seconds=0) == 4
+    assert queue.pending() == 0
+    by_id = {action['_id']: action for action in bulk.actions}
+    # p3 is gone from DynamoDB, so there is nothing to index
+    assert set(by_id) == {'p1', 'p2'}
+    version = search_sync.ProductModel.search_version(item)
+    assert by_id['p1']['_op_type'] == 'index'
+    assert by_id['p1']['_source']['stock'] == 7
+    assert by_id['p1']['_source']['sync_version'] == by_id['p1']['version'] == version
+    assert by_id['p1']['version_type'] == 'external_gte'
+    assert by_id['p2']['_source'] == {'product_id': 'p2', 'stock': 1, 'sync_version': 4000000}
+    stats = syncer.get_stats()
+    assert stats['applied'] == 2
+    assert stats['last_lag_seconds'] is not None
+
+
+def test_upsert_event_is_versioned_by_the_stored_updated_at():
+    item = {'product_id': 'p1', 'name': 'Lamp', 'brand_name': 'Acme', 'category_id': 'c1', 'price': 5, 'stock': 7,
+            'updated_at': '2024-01-02T00:00:00+00:00'}
+    change = search_sync.upsert_event(item)
+    assert search_sync.to_bulk_action(change)['version'] == search_sync.ProductModel.search_version(item)
+
+
+def test_deletes_are_versioned_by_event_time():
+    change = {'product_id': 'p1', 'op': 'delete', 'ts': 1.5}
+    action = search_sync.to_bulk_action(change)
+    assert action['version'] == 1500000
+    assert action['version_type'] == 'external'
+
+
+def test_refused_publishes_are_counted_and_published_again(monkeypatch):
+    class FlakyQueue(LocalChangeQueue):
+        down = True
+
+        def publish(self, event):
+            if self.down:
+                raise ConnectionError('queue unavailable')
+            super().publish(event)
+
+    queue = FlakyQueue()
+    syncer = SearchIndexSyncer(queue, client_factory=lambda: None)
+    syncer._index_ready = True
+    monkeypatch.setattr(syncer, 'apply', lambda changes: {})
+    change = event('p1', 'delete', 1.0)
+    try:
+        syncer.publish(change)
+    except ConnectionError:
+        pass
+    assert syncer.get_stats()['publish_failed'] == 1
+    assert syncer.get_stats()['unpublished'] == 1
+
+    queue.down = False
+    assert syncer.run_once(wait_seconds=0) == 1
+    assert syncer.get_stats()['unpublished'] == 0
+
+
+def test_sqs_is_the_default_change_queue(monkeypatch):
+    monkeypatch.setattr(search_sync, 'SEARCH_SYNC_QUEUE', 'sqs')
+    assert isinstance(search_sync.create_change_queue(), search_sync.SQSChangeQueue)
+    monkeypatch.setattr(search_sync, 'SEARCH_SYNC_QUEUE', 'local')
+    assert isinstance(search_sync.create_change_queue(), LocalChangeQueue)
+
+
+def test_version_conflicts_are_not_failures(monkeypatch):
+    def conflicting_bulk(client, actions, **kwargs):
+        for action in actions:
+            yield False, {action['_op_type']: {'_id': action['_id'], 'status': 409}}
+
+    monkeypatch.setattr(search_sync.helpers, 'streaming_bulk', conflicting_bulk)
+    syncer = SearchIndexSyncer(LocalChangeQueue(), client_factory=lambda: None)
+    changes = coalesce([event('p1', 'index', 1.0, doc={'product_id': 'p1'})])
+    assert syncer.apply(changes) == {}
+
+
+def test_changes_are_written_to_an_index_being_rebuilt(monkeypatch):
+    item = {
+        'product_id': 'p1', 'name': 'Lamp', 'brand_name': 'Acme', 'category_id': 'c1',
+        'description': 'A lamp', 'product_image_url': 'https://example.com/p1.jpg',
+        'price': 10, 'stock': 4, 'updated_at': '2024-01-02T00:00:00+00:00'
+    }
+    syncer, queue, bulk = make_syncer(monkeypatch, {'p1': item})
+    monkeypatch.setattr(syncer, 'target_indices', lambda: ['products', 'products-new'])
+    queue.publish(event('p1', 'refresh', 1.0))
+    queue.publish(event('p2', 'delete', 2.0))
+
+    assert syncer.run_once(wait_seconds=0) == 2
+    rebuilt = {(action['_id'], action['_op_type']): action
+               for action in bulk.actions if action['_index'] == 'products-new'}
+    full = rebuilt[('p1', 'index')]
+    assert full['_source']['stock'] == 4
+    assert full['version'] == search_sync.ProductModel.search_version(item)
+    assert rebuilt[('p2', 'delete')]['version'] == 2000000
+
+
+def test_on_applied_runs_after_the_batch_is_written(monkeypatch):
+    applied = []
+    syncer, queue, bulk = make_syncer(monkeypatch, {})
+    syncer.on_applied = lambda product_ids: applied.append((sorted(product_ids), len(bulk.actions)))
+    queue.publish(event('p1', 'index', 1.0, doc={'product_id': 'p1'}))
+    queue.publish(event('p2', 'delete', 2.0))
+
+    syncer.run_once(wait_seconds=0)
+    assert applied == [(['p1', 'p2'], 2)]
+
+
+def test_on_applied_skips_failed_changes(monkeypatch):
+    def failing_bulk(client, actions, **kwargs):
+        for action in actions:
+            yield False, {action['_op_type']: {'_id': action['_id'], 'status': 400}}
+
+    applied = []
+    monkeypatch.setattr(search_sync.helpers, 'streaming_bulk', failing_bulk)
+    syncer = SearchIndexSyncer(LocalChangeQueue(), client_factory=lambda: None, on_applied=applied.append)
+    syncer._index_ready = True
+    monkeypatch.setattr(syncer, 'target_indices', lambda: ['products'])
+    syncer.publish(event('p1', 'index', 1.0, doc={'product_id': 'p1'}))
+
+    syncer.run_once(wait_seconds=0)
+    assert applied == []
+
+
+def test_retryable_bulk_failures_are_retried_and_others_reported(monkeypatch):
+    attempts = []
+    refreshes = []
+
+    def flaky_bulk(client, actions, refresh=None, **kwargs):
+        actions = list(actions)
+        attempts.append(sorted(action['_id'] for action in actions))
+        refreshes.append(refresh)
+        for action in actions:
+            # p1 is throttled once, p2's document is rejected
+            if action['_id'] == 'p1' and len(attempts) == 1:
+                yield False, {'index': {'_id': 'p1', 'status': 429, 'error': 'throttled'}}
+            elif action['_id'] == 'p2':
+                yield False, {'index': {'_id': 'p2', 'status': 400, 'error': 'mapper_parsing_exception'}}
+            else:
+                yield True, {}
+
+    monkeypatch.setattr(search_sync.helpers, 'streaming_bulk', flaky_bulk)
+    monkeypatch.setattr(search_sync.time, 'sleep', lambda seconds: None)
+    syncer = SearchIndexSyncer(LocalChangeQueue(), client_factory=lambda: None)
+    monkeypatch.setattr(syncer, 'target_indices', lambda: ['products'])
+    changes = coalesce([event(pid, 'index', 1.0, doc={'product_id': pid}) for pid in ('p1', 'p2', 'p3')])
+
+    assert syncer.apply(changes) == {'p2': False}
+    assert attempts == [['p1', 'p2', 'p3'], ['p1']]
+    # Each bulk request waits for a refresh instead of forcing one per document
+    assert refreshes == ['wait_for', 'wait_for']
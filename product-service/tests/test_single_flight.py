@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from util.single_flight import SingleFlight, jittered
+
+
+def run_concurrently(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+class CountingEvent(threading.Event):
+    """An Event that counts the threads waiting on it"""
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = 0
+
+    def wait(self, timeout=None):
+        self.waiting += 1
+        return super().wait(timeout)
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'value'
+
+    leader = run_concurrently(1, lambda: results.append(flight.do('key', compute, timeout=5)))[0]
+    started.wait(5)
+    done = flight._calls['key'].done = CountingEvent()
+    waiters = run_concurrently(4, lambda: results.append(flight.do('key', compute, timeout=5)))
+    while done.waiting < 4:
+        pass
+    release.set()
+    for thread in [leader] + waiters:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [('value', False)] + [('value', True)] * 4
+
+
+def test_waiters_get_the_leaders_exception():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError('backend down')
+
+    def call():
+        try:
+            flight.do('key', fail, timeout=5)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = run_concurrently(1, call)[0]
+    started.wait(5)
+    waiter = run_concurrently(1, call)[0]
+    release.set()
+    leader.join()
+    waiter.join()
+    assert errors == ['backend down', 'backend down']
+
+
+def test_a_waiter_that_times_out_computes_itself():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'leader'
+
+    leader = run_concurrently(1, lambda: flight.do('key', slow))[0]
+    started.wait(5)
+    assert flight.do('key', lambda: 'waiter', timeout=0.01) == ('waiter', False)
+    release.set()
+    leader.join()
+
+
+@pytest.mark.parametrize('ttl', [10, 300])
+def test_jittered_ttls_stay_within_the_jitter(ttl):
+    values = [jittered(ttl, jitter=0.1) for _ in range(100)]
+    assert all(ttl * 0.9 <= value <= ttl for value in values)
+    assert jittered(ttl, jitter=0) == ttl
@@ -0,0 +1,142 @@
+from unittest import mock
+
+import pytest
+
+from fake_dynamodb import client_error
+from model.product import ProductModel, StockReservationError, STOCK_CHUNK_ITEMS
+from model.stock_reservations import (StockReservations, ReservationConflictError,
+                                      RESERVING, RESERVED, FAILED, RELEASED)
+from model.stock_shards import ShardedStock, LinkedConditionError
+
+
+class Crash(BaseException):
+    """The worker dying mid-request; no except Exception handler runs"""
+
+
+def add_products(db, stock, count=1):
+    ids = [f'p{i}' for i in range(count)]
+    for product_id in ids:
+        db.tables['Products'][product_id] = {'product_id': product_id, 'stock': stock}
+    return ids
+
+
+def stock(db, product_id):
+    return db.tables['Products'][product_id]['stock']
+
+
+def record(db, reservation_id):
+    return db.tables['StockReservations'][reservation_id]
+
+
+def fail_once_after(db, table, error):
+    """Raise error once, right after a write to table was applied"""
+    def hook(request):
+        if any(list(entry.values())[0]['TableName'] == table for entry in request):
+            db.after_write.remove(hook)
+            raise error
+    db.after_write.append(hook)
+
+
+def test_retry_of_a_reserved_reservation_does_not_take_stock_again(fake_db):
+    add_products(fake_db, 10)
+    ProductModel.reserve_stock([('p0', 3)], reservation_id='r1')
+    ProductModel.reserve_stock([('p0', 3)], reservation_id='r1')
+    assert stock(fake_db, 'p0') == 7
+    assert record(fake_db, 'r1')['status'] == RESERVED
+    assert record(fake_db, 'r1')['held'] == {'p0'}
+
+
+def test_retry_after_dying_before_the_record_was_marked_reserved(fake_db):
+    add_products(fake_db, 10)
+    transition = StockReservations.transition
+    with mock.patch.object(StockReservations, 'transition', side_effect=Crash):
+        with pytest.raises(Crash):
+            ProductModel.reserve_stock([('p0', 3)], reservation_id='r1')
+    assert record(fake_db, 'r1')['status'] == RESERVING
+    assert stock(fake_db, 'p0') == 7
+
+    with mock.patch.object(StockReservations, 'transition', side_effect=transition):
+        ProductModel.reserve_stock([('p0', 3)], reservation_id='r1')
+    assert stock(fake_db, 'p0') == 7
+    assert record(fake_db, 'r1')['status'] == RESERVED
+
+
+def test_a_stuck_reservation_can_be_released(fake_db):
+    add_products(fake_db, 10)
+    with mock.patch.object(StockReservations, 'transition', side_effect=Crash):
+        with pytest.raises(Crash):
+            ProductModel.reserve_stock([('p0', 3)], reservation_id='r1')
+
+    ProductModel.release_stock([('p0', 3)], reservation_id='r1')
+    ProductModel.release_stock([('p0', 3)], reservation_id='r1')
+    assert stock(fake_db, 'p0') == 10
+    assert record(fake_db, 'r1')['status'] == RELEASED
+    with pytest.raises(ReservationConflictError):
+        ProductModel.reserve_stock([('p0', 3)], reservation_id='r1')
+
+
+def test_ambiguous_chunk_failure_is_compensated_and_retryable(fake_db):
+    ids = add_products(fake_db, 5, count=STOCK_CHUNK_ITEMS + 1)
+    items = [(product_id, 1) for product_id in ids]
+    # The second chunk commits but the caller only sees a timeout
+    commits = []
+
+    def timeout_on_second_chunk(request):
+        if any(list(entry.values())[0]['TableName'] == 'Products' for entry in request):
+            commits.append(request)
+            if len(commits) == 2:
+                raise client_error('RequestTimeout', 'timed out after commit')
+    fake_db.after_write.append(timeout_on_second_chunk)
+
+    with pytest.raises(Exception):
+        ProductModel.reserve_stock(items, reservation_id='r1')
+    assert all(stock(fake_db, product_id) == 5 for product_id in ids)
+    assert record(fake_db, 'r1')['status'] == FAILED
+    assert 'held' not in record(fake_db, 'r1')
+
+    fake_db.after_write.clear()
+    ProductModel.reserve_stock(items, reservation_id='r1')
+    assert all(stock(fake_db, product_id) == 4 for product_id in ids)
+    assert record(fake_db, 'r1')['status'] == RESERVED
+
+
+def test_insufficient_stock_fails_the_reservation_without_leaking(fake_db):
+    add_products(fake_db, 2, count=2)
+    with pytest.raises(StockReservationError) as e:
+        ProductModel.reserve_stock([('p0', 1), ('p1', 5)], reservation_id='r1')
+    assert e.value.failed_product_ids == ['p1']
+    assert stock(fake_db, 'p0') == 2
+    assert record(fake_db, 'r1')['status'] == FAILED
+
+
+def test_reusing_a_reservation_id_for_other_items_conflicts(fake_db):
+    add_products(fake_db, 10, count=2)
+    ProductModel.reserve_stock([('p0', 1)], reservation_id='r1')
+    with pytest.raises(ReservationConflictError):
+        ProductModel.reserve_stock([('p1', 1)], reservation_id='r1')
+    with pytest.raises(ReservationConflictError):
+        ProductModel.release_stock([('p1', 1)], reservation_id='r1')
+    assert stock(fake_db, 'p1') == 10
+
+
+def test_a_superseded_attempt_cannot_take_stock(fake_db):
+    add_products(fake_db, 10)
+    StockReservations.begin('r1', [('p0', 1)], 'old')
+    ProductModel.release_stock([('p0', 1)], reservation_id='r1')
+    with pytest.raises(LinkedConditionError):
+        ProductModel._reserve([('p0', 1)], 'r1', 'old')
+    assert stock(fake_db, 'p0') == 10
+
+
+def test_sharded_product_retry_after_commit_timeout(fake_db):
+    add_products(fake_db, 10)
+    ShardedStock.enable('p0', 2)
+    fail_once_after(fake_db, 'ProductStockShards', client_error('RequestTimeout', 'timed out after commit'))
+    with pytest.raises(Exception):
+        ProductModel.reserve_stock([('p0', 4)], reservation_id='r1')
+    assert sum(item['stock'] for item in fake_db.tables['ProductStockShards'].values()) == 10
+
+    ProductModel.reserve_stock([('p0', 4)], reservation_id='r1')
+    ProductModel.release_stock([('p0', 4)], reservation_id='r1')
+    ProductModel.release_stock([('p0', 4)], reservation_id='r1')
+    assert sum(item['stock'] for item in fake_db.tables['ProductStockShards'].values()) == 10
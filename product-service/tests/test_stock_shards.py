@@ -0,0 +1,68 @@
+import threading
+import time
+
+from model import stock_shards
+from model.product import ProductModel
+from model.stock_shards import ShardedStock
+
+
+def add_product(db, product_id='p1', stock=10):
+    db.tables['Products'][product_id] = {
+        'product_id': product_id, 'name': 'Lamp', 'price': 10, 'stock': stock,
+        'category_id': 'c1', 'brand_name': 'Acme', 'updated_at': '2024-01-01T00:00:00+00:00'
+    }
+
+
+def test_update_product_sets_the_total_of_a_sharded_product(fake_db):
+    add_product(fake_db)
+    ShardedStock.enable('p1', 2)
+    ProductModel.reserve_stock([('p1', 3)])
+
+    updated = ProductModel.update_product('p1', {
+        'product_id': 'p1', 'name': 'Lamp', 'price': 12, 'stock': 20,
+        'category_id': 'c1', 'brand_name': 'Acme', 'description': 'A lamp'
+    })
+
+    assert updated['stock'] == 20
+    assert 'stock_shards' not in updated
+    assert fake_db.tables['Products']['p1']['stock'] == 0
+    assert fake_db.tables['Products']['p1']['description'] == 'A lamp'
+    assert ShardedStock.get_stock('p1') == 20
+
+
+def test_update_product_falls_back_when_sharded_by_another_worker(fake_db, monkeypatch):
+    add_product(fake_db)
+    ShardedStock.enable('p1', 2)
+    # This worker has not seen the product being sharded yet
+    monkeypatch.setattr(ShardedStock, '_registry', {})
+    monkeypatch.setattr(ShardedStock, '_registry_loaded_at', time.time())
+
+    updated = ProductModel.update_product('p1', {
+        'product_id': 'p1', 'name': 'Lamp', 'price': 12, 'stock': 20,
+        'category_id': 'c1', 'brand_name': 'Acme'
+    })
+
+    assert updated['stock'] == 20
+    assert ShardedStock.get_stock('p1') == 20
+
+
+def test_stale_registry_is_refreshed_in_the_background(fake_db, monkeypatch):
+    add_product(fake_db)
+    ShardedStock.enable('p1', 2)
+    registry = ShardedStock.shard_counts()
+    scanned = threading.Event()
+    release = threading.Event()
+
+    def slow_scan():
+        scanned.set()
+        release.wait(5)
+        return {}
+
+    monkeypatch.setattr(ShardedStock, '_registry_loaded_at', time.time() - stock_shards.REGISTRY_TTL)
+    monkeypatch.setattr(ShardedStock, '_load_registry', slow_scan)
+
+    # Readers keep the current registry, without a copy, while the scan runs
+    assert ShardedStock.shard_counts() is registry
+    assert scanned.wait(5)
+    assert ShardedStock.is_sharded('p1')
+    release.set()
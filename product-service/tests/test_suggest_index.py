@@ -0,0 +1,39 @@
+from model.suggest_index import SuggestIndex
+
+
+def product(product_id, name, brand_name='Acme'):
+    return {'product_id': product_id, 'name': name, 'brand_name': brand_name, 'price': 10, 'category_id': 'c1'}
+
+
+def test_lookup_suggests_names_before_brands():
+    index = SuggestIndex()
+    index.build([product('p1', 'Lamp'), product('p2', 'Desk', brand_name='Lampworks'),
+                 product('p3', 'Chair', brand_name='Lampworks')])
+
+    suggestions = index.lookup('lamp')
+    assert [(s['text'], s['type']) for s in suggestions] == [('Lamp', 'completion'), ('Lampworks', 'brand')]
+    assert suggestions[0]['metadata'] == {'brand': 'Acme', 'price': 10.0, 'category_id': 'c1'}
+
+
+def test_lookup_matches_word_starts_and_ranks_shared_names_first():
+    index = SuggestIndex()
+    index.build([product('p1', 'Desk Lamp'), product('p2', 'Lamp Shade'), product('p3', 'Lamp Shade')])
+
+    assert [s['text'] for s in index.lookup('lamp')] == ['Lamp Shade', 'Desk Lamp']
+
+
+def test_popular_products_rank_first():
+    views = {'p1': 40.0, 'p2': 2.0, 'p3': 1.0}
+    index = SuggestIndex(popularity=lambda product_id: views.get(product_id, 0))
+    index.build([product('p1', 'Desk Lamp'), product('p2', 'Lamp Shade'), product('p3', 'Lamp Shade')])
+
+    suggestions = index.lookup('lamp')
+    assert [(s['text'], s['score']) for s in suggestions] == [('Desk Lamp', 40.0), ('Lamp Shade', 3.0)]
+
+
+def test_removed_products_are_no_longer_suggested():
+    index = SuggestIndex()
+    index.build([product('p1', 'Lamp', brand_name='Lampworks')])
+    index.remove_product('p1')
+    assert index.lookup('lamp') == []
+    assert len(index) == 0
@@ -0,0 +1,141 @@
+# utils/cache_warmer.py
+import os
+import threading
+import time
+
+CACHE_WARM_TOP_N = int(os.environ.get('CACHE_WARM_TOP_N', 200))
+# Refresh hot entries this many seconds before they expire
+CACHE_WARM_LEAD = int(os.environ.get('CACHE_WARM_LEAD', 30))
+CACHE_WARM_INTERVAL = int(os.environ.get('CACHE_WARM_INTERVAL', 10))
+# Access counts are halved every this many seconds so popularity follows current traffic
+CACHE_WARM_HALF_LIFE = int(os.environ.get('CACHE_WARM_HALF_LIFE', 300))
+# Pre-warmed keys start with this many accesses, so they are refreshed for a
+# few half-lives even before real traffic reaches them
+CACHE_WARM_SEED_COUNT = float(os.environ.get('CACHE_WARM_SEED_COUNT', 4))
+# Keys whose decayed count falls below this are forgotten
+CACHE_WARM_MIN_COUNT = float(os.environ.get('CACHE_WARM_MIN_COUNT', 1))
+
+
+class AccessTracker:
+    """
+    Decaying access counts per cache key, plus the request path that
+    produces each key so it can be recomputed outside a request.
+    """
+
+    def __init__(self, half_life=CACHE_WARM_HALF_LIFE, max_keys=50000,
+                 seed_count=CACHE_WARM_SEED_COUNT, min_count=CACHE_WARM_MIN_COUNT):
+        self.half_life = half_life
+        self.max_keys = max_keys
+        self.seed_count = seed_count
+        self.min_count = min_count
+        self._counts = {}
+        self._paths = {}
+        self._decayed_at = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, key, path):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self._paths[key] = path
+
+    def register(self, key, path):
+        """Make a pre-warmed key refreshable, seeding it with seed_count accesses"""
+        with self._lock:
+            self._counts[key] = max(self._counts.get(key, 0), self.seed_count)
+            self._paths[key] = path
+
+    def decay(self):
+        with self._lock:
+            now = time.time()
+            halvings = int((now - self._decayed_at) / self.half_life)
+            if not halvings:
+                return
+            self._decayed_at += halvings * self.half_life
+            factor = 0.5 ** halvings
+            for key in list(self._counts):
+                self._counts[key] *= factor
+                # Keys nobody asks for any more stop being refresh candidates
+                if self._counts[key] < self.min_count:
+                    del self._counts[key]
+                    self._paths.pop(key, None)
+            if len(self._counts) > self.max_keys:
+                keep = sorted(self._counts, key=self._counts.get, reverse=True)[:self.max_keys]
+                self._counts = {key: self._counts[key] for key in keep}
+                self._paths = {key: self._paths[key] for key in keep}
+
+    def count(self, key):
+        """Decayed access count of a key, 0 when it is not tracked"""
+        return self._counts.get(key, 0)
+
+    def top(self, n):
+        """The n most accessed keys with their paths, most popular first"""
+        with self._lock:
+            keys = sorted((k for k, c in self._counts.items() if c > 0), key=self._counts.get, reverse=True)[:n]
+            return [(key, self._paths[key]) for key in keys]
+
+    def forget(self, prefix=''):
+        with self._lock:
+            for key in [k for k in self._counts if k.startswith(prefix)]:
+                del self._counts[key]
+                self._paths.pop(key, None)
+
+    def __len__(self):
+        return len(self._counts)
+
+
+class CacheWarmer:
+    """
+    Background thread that keeps the most popular cache entries fresh.
+    Every interval it takes the top_n keys by recent access count and, for any
+    that expire within lead seconds or are already gone, calls refresh(path)
+    to recompute the entry before a request has to.
+    """
+
+    def __init__(self, response_cache, refresh, top_n=CACHE_WARM_TOP_N,
+                 lead=CACHE_WARM_LEAD, interval=CACHE_WARM_INTERVAL):
+        self.response_cache = response_cache
+        self.refresh = refresh
+        self.top_n = top_n
+        self.lead = lead
+        self.interval = interval
+        self.stats = {'refreshed': 0, 'errors': 0, 'runs': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        tracker = self.response_cache.access_tracker
+        tracker.decay()
+        refresh_before = time.time() + self.lead
+        refreshed = 0
+        for key, path in tracker.top(self.top_n):
+            entry = self.response_cache.get(key)
+            if entry is not None and entry.expires_at > refresh_before:
+                continue
+            try:
+                self.refresh(path)
+                refreshed += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Error refreshing cache entry {key}: {str(e)}")
+        self.stats['refreshed'] += refreshed
+        self.stats['runs'] += 1
+        return refreshed
+
+    def run_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Cache warmer error: {str(e)}")
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='cache-warmer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get_stats(self):
+        return dict(self.stats, tracked_keys=len(self.response_cache.access_tracker))
@@ -0,0 +1,92 @@
+# utils/catalog_version.py
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+GENERATION_KEY = 'catalog:generation'
+LAST_MODIFIED_KEY = 'catalog:last_modified'
+# How long a worker trusts the shared generation it last read
+CATALOG_VERSION_POLL = float(os.environ.get('CATALOG_VERSION_POLL', 1))
+
+
+class CatalogVersion:
+    """
+    Catalog generation counter, bumped on every product write.
+    Bound to a shared Flask-Caching backend (Redis, Memcached), the counter
+    lives there: a write on any worker reaches every worker within
+    CATALOG_VERSION_POLL seconds. Unbound, it is per process and the token
+    is prefixed with a per-process id so that generations from different
+    workers or restarts never compare equal.
+    """
+    _instance = None
+    _lock = threading.Lock()
+    _process_id = os.urandom(4).hex()
+    _generation = 0
+    _last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+    _store = None
+    _polled_at = 0.0
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(CatalogVersion, cls).__new__(cls)
+        return cls._instance
+
+    def bind(self, store):
+        """Keep the generation in a cache backend shared by all workers; None unbinds"""
+        with self._lock:
+            CatalogVersion._store = store
+            CatalogVersion._polled_at = 0.0
+
+    def bump(self):
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        generation = None
+        if self._store is not None:
+            try:
+                # Seeded from the clock, so a flushed counter never repeats an old generation
+                self._store.add(GENERATION_KEY, int(time.time() * 1000), timeout=0)
+                generation = self._store.inc(GENERATION_KEY)
+                self._store.set(LAST_MODIFIED_KEY, now.timestamp(), timeout=0)
+            except Exception as e:
+                print(f"Error bumping the shared catalog generation: {str(e)}")
+        with self._lock:
+            CatalogVersion._generation = generation if generation is not None else self._generation + 1
+            CatalogVersion._last_modified = now
+            CatalogVersion._polled_at = time.monotonic()
+            return CatalogVersion._generation
+
+    def _poll(self):
+        """Pick up writes other workers made since the last read"""
+        try:
+            generation, modified = self._store.get_many(GENERATION_KEY, LAST_MODIFIED_KEY)
+        except Exception as e:
+            print(f"Error reading the shared catalog generation: {str(e)}")
+            generation = modified = None
+        with self._lock:
+            CatalogVersion._polled_at = time.monotonic()
+            if generation is not None and generation != self._generation:
+                CatalogVersion._generation = generation
+                if modified is not None:
+                    CatalogVersion._last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+
+    @property
+    def generation(self):
+        if self._store is not None and time.monotonic() - self._polled_at >= CATALOG_VERSION_POLL:
+            self._poll()
+        return self._generation
+
+    @property
+    def shared(self):
+        return self._store is not None
+
+    @property
+    def token(self):
+        """The shared generation, or the per-process one prefixed with the process id"""
+        if self.shared:
+            return str(self.generation)
+        return f"{self._process_id}-{self._generation}"
+
+    @property
+    def last_modified(self):
+        self.generation
+        return self._last_modified
@@ -71,6 +71,9 @@ class CircuitBreaker:
                 self.state = CircuitState.CLOSED
                 self.failures = 0
                 logger.info(f"Circuit {self.name} CLOSED after successful execution")
+            elif self.state == CircuitState.CLOSED:
+                # Only consecutive failures open the circuit
+                self.failures = 0
 
     def get_state(self):
         """Get the current state of the circuit breaker"""
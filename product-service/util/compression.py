@@ -0,0 +1,81 @@
+# utils/compression.py
+import gzip
+import os
+from flask import request
+from werkzeug.http import parse_accept_header
+
+# Bodies smaller than this are sent as-is; compressing them costs more than it saves
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+
+def _gzip(body):
+    # mtime=0 keeps the output deterministic for identical bodies
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+ENCODERS = {'gzip': _gzip}
+
+# brotli and zstandard are optional; without them only gzip is offered
+try:
+    import brotli
+    ENCODERS['br'] = lambda body: brotli.compress(body, quality=5)
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    _zstd = zstandard.ZstdCompressor(level=3)
+    ENCODERS['zstd'] = _zstd.compress
+except ImportError:
+    pass
+
+# Server preference when the client accepts several encodings equally
+PREFERRED_ENCODINGS = [name for name in ('br', 'zstd', 'gzip') if name in ENCODERS]
+
+
+def choose_encoding(accept_encoding):
+    """Best encoding both sides support for an Accept-Encoding header, or None"""
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding).best_match(PREFERRED_ENCODINGS)
+
+
+def compress(body, encoding):
+    return ENCODERS[encoding](body)
+
+
+def is_compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_MIMETYPES)
+
+
+def compress_response(response):
+    """
+    after_request hook: compress large responses the client accepts compressed.
+    Cached responses are compressed when the entry is served (see
+    response_cache.make_response) and already carry a Content-Encoding.
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or not is_compressible(response.mimetype)):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    if response.get_etag()[0]:
+        # The compressed bytes differ from the identity representation
+        etag, _ = response.get_etag()
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
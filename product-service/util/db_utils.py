@@ -1,29 +1,110 @@
 import boto3
 import json
 import os
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 from util.secrets_utils import get_secret
-from util.circuit_breaker import circuit_breaker
+from util.circuit_breaker import circuit_breaker, CircuitBreakerRegistry
+
+DYNAMODB_BREAKER = 'dynamodb-products'
+# Data calls that go through the DynamoDB circuit breaker
+TABLE_CALLS = ('get_item', 'put_item', 'update_item', 'delete_item', 'query', 'scan')
+RESOURCE_CALLS = ('batch_get_item', 'batch_write_item')
+CLIENT_CALLS = ('transact_write_items', 'transact_get_items')
+# Error codes that mean DynamoDB is failing or overloaded, rather than refusing one request
+OUTAGE_ERROR_CODES = (
+    'InternalServerError', 'ServiceUnavailable', 'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded', 'ThrottlingException'
+)
 
 class DynamoDBError(Exception):
     """Custom exception for Secrets Manager errors"""
     pass
 
+class DynamoDBUnavailableError(DynamoDBError):
+    """Raised instead of connecting while the DynamoDB circuit is open"""
+    pass
+
+def _connection_circuit_open(*args, **kwargs):
+    raise DynamoDBUnavailableError("DynamoDB circuit is open")
+
+def is_outage(error):
+    """True for errors that should count towards opening the DynamoDB circuit"""
+    if isinstance(error, ClientError):
+        return (error.response['Error']['Code'] in OUTAGE_ERROR_CODES
+                or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500)
+    # Connection failures, timeouts and other transport errors
+    return isinstance(error, BotoCoreError)
+
+def _guarded(call, breaker):
+    def guarded(*args, **kwargs):
+        if not breaker.can_execute():
+            raise DynamoDBUnavailableError("DynamoDB circuit is open")
+        try:
+            result = call(*args, **kwargs)
+        except Exception as e:
+            # A failed condition or a validation error is an answer, not an outage
+            if is_outage(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        breaker.record_success()
+        return result
+    return guarded
+
+class Guarded:
+    """Proxy whose named data calls go through the DynamoDB circuit breaker"""
+
+    def __init__(self, target, breaker, calls=()):
+        self._target = target
+        self._breaker = breaker
+        self._calls = calls
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name in self._calls:
+            return _guarded(attr, self._breaker)
+        return attr
+
+class GuardedMeta(Guarded):
+    @property
+    def client(self):
+        return Guarded(self._target.client, self._breaker, CLIENT_CALLS)
+
+class GuardedResource(Guarded):
+    """
+    The boto3 DynamoDB resource with its tables, batch calls and
+    transactions behind the circuit breaker, so failing requests, not
+    connection setup, open it.
+    """
+
+    def __init__(self, resource, breaker):
+        super().__init__(resource, breaker, RESOURCE_CALLS)
+
+    def Table(self, name):
+        return Guarded(self._target.Table(name), self._breaker, TABLE_CALLS)
+
+    @property
+    def meta(self):
+        return GuardedMeta(self._target.meta, self._breaker)
+
 class DynamoDB:
 
     @classmethod
-    @circuit_breaker('dynamodb-products-connection', failure_threshold=5, reset_timeout=60,fallback_function=lambda: None)
+    @circuit_breaker('dynamodb-products-connection', failure_threshold=5, reset_timeout=60,fallback_function=_connection_circuit_open)
     def get_connection(self):
         if os.environ.get('dynamo_db_secret') is None:
             os.environ['dynamo_db_secret'] = json.dumps(get_secret(f"dev/dynamodb/config"))
 
         secret = json.loads(os.environ.get('dynamo_db_secret'))
 
-        return boto3.resource('dynamodb',
+        resource = boto3.resource('dynamodb',
             region_name=secret['region'],
             aws_access_key_id=secret['AWS_ACCESS_KEY_ID'],
             aws_secret_access_key=secret['AWS_SECRET_ACCESS_KEY']
         )
+        breaker = CircuitBreakerRegistry().get_circuit_breaker(DYNAMODB_BREAKER, failure_threshold=5, reset_timeout=60)
+        return GuardedResource(resource, breaker)
     
 
 def table_exists(con, table_name):
@@ -38,10 +119,82 @@ def table_exists(con, table_name):
             return False
         raise
      
+def init_stock_shards_table(con):
+    table_name = 'ProductStockShards'
+
+    if table_exists(con, table_name):
+        return con.Table(table_name)
+    try:
+        # One item per shard; the shard number is part of the partition key
+        # so a hot product's counters land on different partitions
+        table = con.create_table(
+            TableName=table_name,
+            KeySchema=[
+                {
+                    'AttributeName': 'shard_key',
+                    'KeyType': 'HASH'
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'shard_key',
+                    'AttributeType': 'S'
+                }
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+        print(f"Creating table {table_name}...")
+        table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
+        print(f"Table {table_name} created successfully!")
+        return table
+    except ClientError as e:
+        print(f"Error creating table: {e}")
+        raise
+
+def init_stock_reservations_table(con):
+    table_name = 'StockReservations'
+
+    if table_exists(con, table_name):
+        return con.Table(table_name)
+    try:
+        # One item per reservation_id, recording how far the reservation got
+        table = con.create_table(
+            TableName=table_name,
+            KeySchema=[
+                {
+                    'AttributeName': 'reservation_id',
+                    'KeyType': 'HASH'
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'reservation_id',
+                    'AttributeType': 'S'
+                }
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+        print(f"Creating table {table_name}...")
+        table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
+        # Old reservations are dropped by DynamoDB once expires_at has passed
+        table.meta.client.update_time_to_live(
+            TableName=table_name,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+        )
+        print(f"Table {table_name} created successfully!")
+        return table
+    except ClientError as e:
+        print(f"Error creating table: {e}")
+        raise
+
 def init_dynamodb():
     table_name = 'Products'
 
     con = DynamoDB.get_connection()
+    init_stock_shards_table(con)
+    init_stock_reservations_table(con)
 
     if not table_exists(con, table_name):
         try:
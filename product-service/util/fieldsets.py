@@ -0,0 +1,42 @@
+# utils/fieldsets.py
+from model.product_data import PRODUCT_FIELDS
+
+# Attributes a caller can ask for with ?fields=; the nested ones only exist on some products
+SELECTABLE_FIELDS = frozenset(PRODUCT_FIELDS + ('tags', 'specifications', 'variants'))
+# Always returned: the key, and the version that ETags are derived from
+REQUIRED_FIELDS = ('product_id', 'updated_at')
+# Per-hit attributes of search results, returned with a fieldset only when named in it
+SEARCH_HIT_FIELDS = ('score', 'highlights')
+
+
+class InvalidFieldsError(ValueError):
+    """Raised when a fields parameter names an unknown attribute"""
+    pass
+
+
+def parse_fields(value, extra=()):
+    """
+    Parse a sparse fieldset, given as "a,b,c" or a list of names.
+    extra names are accepted on top of the product attributes.
+    Returns a sorted tuple that always contains REQUIRED_FIELDS, or None
+    when no fieldset was requested (every attribute is returned).
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        names = [name.strip() for name in value.split(',')]
+    elif isinstance(value, (list, tuple)) and all(isinstance(name, str) for name in value):
+        names = [name.strip() for name in value]
+    else:
+        raise InvalidFieldsError('"fields" must be a comma separated list of attribute names')
+    names = {name for name in names if name}
+    if not names:
+        return None
+    allowed = SELECTABLE_FIELDS.union(extra)
+    unknown = names - allowed
+    if unknown:
+        raise InvalidFieldsError(
+            f"Unknown fields {sorted(unknown)}; allowed fields are {sorted(allowed)}"
+        )
+    return tuple(sorted(names.union(REQUIRED_FIELDS)))
+
@@ -0,0 +1,97 @@
+# utils/opensearch_utils.py
+import json
+import os
+import threading
+from opensearchpy import OpenSearch, Urllib3HttpConnection
+from util.secrets_utils import get_secret
+
+# Connections per worker process; keep-alive reuses them and their TLS sessions
+OPENSEARCH_POOL_MAXSIZE = int(os.environ.get('OPENSEARCH_POOL_MAXSIZE', 25))
+OPENSEARCH_TIMEOUT = int(os.environ.get('OPENSEARCH_TIMEOUT', 30))
+
+_client = None
+_search_client = None
+_client_lock = threading.Lock()
+_async_client = None
+
+
+def get_opensearch_config():
+    """Read the OpenSearch connection settings from Secrets Manager (cached in the environment)"""
+    if not os.environ.get('opensearch_secret'):
+        os.environ['opensearch_secret'] = json.dumps(get_secret('opensearch/config'))
+    return json.loads(os.environ.get('opensearch_secret'))
+
+
+def create_opensearch_client(**overrides):
+    secrets = get_opensearch_config()
+    options = {
+        'pool_maxsize': OPENSEARCH_POOL_MAXSIZE,
+        'timeout': OPENSEARCH_TIMEOUT,
+        'retry_on_timeout': True,
+        'max_retries': 3
+    }
+    options.update(overrides)
+    return OpenSearch(
+        hosts=[{'host': secrets.get('host'), 'port': 443}],
+        http_auth=(secrets.get('master_user_name'), secrets.get('master_user_password')),
+        use_ssl=True,
+        verify_certs=True,
+        connection_class=Urllib3HttpConnection,
+        **options
+    )
+
+
+def get_opensearch_client():
+    """Return the process-wide OpenSearch client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_opensearch_client()
+    return _client
+
+
+def get_search_opensearch_client():
+    """
+    Process-wide client for interactive search. It never retries, so a
+    request timeout really bounds a search and a hung cluster trips the
+    search circuit breaker after one timeout instead of four.
+    """
+    global _search_client
+    if _search_client is None:
+        with _client_lock:
+            if _search_client is None:
+                _search_client = create_opensearch_client(retry_on_timeout=False, max_retries=0)
+    return _search_client
+
+
+def get_async_opensearch_client():
+    """
+    Return the process-wide AsyncOpenSearch client used by the ASGI entry point.
+    It is created on first use from inside the running event loop. It only
+    serves interactive search, so like get_search_opensearch_client it never retries.
+    """
+    global _async_client
+    if _async_client is None:
+        # Imported lazily: the async client needs aiohttp, which the WSGI app does not
+        from opensearchpy import AsyncOpenSearch, AIOHttpConnection
+        secrets = get_opensearch_config()
+        _async_client = AsyncOpenSearch(
+            hosts=[{'host': secrets.get('host'), 'port': 443}],
+            http_auth=(secrets.get('master_user_name'), secrets.get('master_user_password')),
+            use_ssl=True,
+            verify_certs=True,
+            connection_class=AIOHttpConnection,
+            maxsize=OPENSEARCH_POOL_MAXSIZE,
+            timeout=OPENSEARCH_TIMEOUT,
+            retry_on_timeout=False,
+            max_retries=0
+        )
+    return _async_client
+
+
+async def close_async_opensearch_client():
+    global _async_client
+    client, _async_client = _async_client, None
+    if client is not None:
+        await client.close()
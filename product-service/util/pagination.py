@@ -0,0 +1,54 @@
+# utils/pagination.py
+import base64
+import json
+from decimal import Decimal
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a client supplied pagination cursor cannot be decoded"""
+    pass
+
+
+def _encode_key_value(obj):
+    if isinstance(obj, Decimal):
+        return {'__decimal__': str(obj)}
+    raise TypeError(f"Unsupported key attribute type: {type(obj)}")
+
+
+def _decode_key_value(obj):
+    if '__decimal__' in obj:
+        return Decimal(obj['__decimal__'])
+    return obj
+
+
+def encode_cursor(last_evaluated_key):
+    """Turn a DynamoDB LastEvaluatedKey into an opaque, url-safe cursor"""
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, default=_encode_key_value, separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor produced by encode_cursor back into an ExclusiveStartKey"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii'))
+        key = json.loads(raw.decode('utf-8'), object_hook=_decode_key_value)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {str(e)}")
+    if not isinstance(key, dict):
+        raise InvalidCursorError("Invalid cursor: expected an object")
+    return key
+
+
+def parse_limit(value, default=None, maximum=100):
+    """Validate a ?limit= query parameter, returning default when absent"""
+    if value is None or value == '':
+        return default
+    limit = int(value)
+    if limit < 1 or limit > maximum:
+        raise ValueError(f"Limit must be between 1 and {maximum}")
+    return limit
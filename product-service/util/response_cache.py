@@ -0,0 +1,265 @@
+# utils/response_cache.py
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from decimal import Decimal
+from flask import Response, request
+from functools import wraps
+from werkzeug.http import is_resource_modified
+from util.single_flight import SingleFlight, jittered
+from util.cache_warmer import AccessTracker
+from util.compression import COMPRESS_MIN_SIZE, choose_encoding, compress
+
+JSON_MIMETYPE = 'application/json'
+# How long a request waits for a concurrent request computing the same entry
+SINGLE_FLIGHT_WAIT = 30
+# How long expired entries are kept to be served if the backend is failing
+CACHE_STALE_GRACE = int(os.environ.get('CACHE_STALE_GRACE', 600))
+STALE_WARNING = '110 - "Response is Stale"'
+# WSGI environ flag set by the cache warmer to recompute an entry instead of reading it
+REFRESH_ENVIRON_KEY = 'response_cache.refresh'
+
+
+def json_default(obj):
+    """Single-pass encoding for the non-JSON types DynamoDB hands back"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def encode_json(payload):
+    """Encode a payload straight to UTF-8 JSON bytes"""
+    return json.dumps(
+        payload,
+        default=json_default,
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False
+    ).encode('utf-8')
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str
+    content_length: int
+    status: int
+    expires_at: float
+    last_modified: datetime.datetime = None
+    # Compressed copies of body by Content-Encoding, made on first use
+    encoded: dict = field(default_factory=dict)
+
+    def encoded_body(self, encoding):
+        body = self.encoded.get(encoding)
+        if body is None:
+            body = self.encoded[encoding] = compress(self.body, encoding)
+        return body
+
+
+class ResponseCache:
+    """
+    In-process cache of fully encoded JSON responses.
+    Entries hold the UTF-8 body plus its ETag and length, so a hit is written
+    to the client as-is without any JSON encoding or decoding. Timeouts are
+    jittered so entries written together do not all expire together.
+    Expired entries are kept for stale_grace more seconds; get() ignores
+    them but get_stale() returns them while the backend is failing.
+    """
+
+    def __init__(self, default_timeout=300, max_entries=10000, stale_grace=CACHE_STALE_GRACE):
+        self.default_timeout = default_timeout
+        self.max_entries = max_entries
+        self.stale_grace = stale_grace
+        self.flight = SingleFlight()
+        self.access_tracker = AccessTracker()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            now = time.time()
+            if entry.expires_at <= now:
+                if entry.expires_at + self.stale_grace <= now:
+                    del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def get_stale(self, key):
+        """The entry for key even if it expired less than stale_grace seconds ago"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at + self.stale_grace <= time.time():
+                del self._entries[key]
+                return None
+            return entry
+
+    def set(self, key, payload, timeout=None, status=200, etag=None, last_modified=None):
+        body = encode_json(payload)
+        entry = CachedResponse(
+            body=body,
+            etag=etag or hashlib.sha1(body).hexdigest(),
+            content_length=len(body),
+            status=status,
+            expires_at=time.time() + jittered(timeout or self.default_timeout),
+            last_modified=last_modified
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def is_not_modified(etag, last_modified=None):
+    """True when a conditional GET already holds this representation"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+
+def not_modified_response(etag, last_modified, cache_status):
+    response = Response(status=304)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+def make_response(entry, cache_status):
+    """
+    Build a Response that writes the cached buffer directly.
+    Large entries are sent in the best encoding the client accepts; each
+    encoding is compressed once per entry and reused by later hits.
+    """
+    if is_not_modified(entry.etag, entry.last_modified):
+        return not_modified_response(entry.etag, entry.last_modified, cache_status)
+    body = entry.body
+    encoding = None
+    if entry.content_length >= COMPRESS_MIN_SIZE:
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding:
+            body = entry.encoded_body(encoding)
+    response = Response(body, status=entry.status, mimetype=JSON_MIMETYPE)
+    response.headers['Content-Length'] = str(len(body))
+    # A compressed body is a different byte sequence, so only weakly the same entity
+    response.set_etag(entry.etag, weak=encoding is not None)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if entry.content_length >= COMPRESS_MIN_SIZE:
+        response.vary.add('Accept-Encoding')
+    if entry.last_modified:
+        response.last_modified = entry.last_modified
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+def is_server_error(result):
+    if isinstance(result, Response):
+        return result.status_code >= 500
+    if isinstance(result, tuple) and len(result) > 1 and isinstance(result[1], int):
+        return result[1] >= 500
+    return False
+
+
+def make_stale_response(entry):
+    """Serve an expired entry because the backend failed to produce a fresh one"""
+    response = make_response(entry, 'STALE')
+    response.headers['Warning'] = STALE_WARNING
+    return response
+
+
+def cached_response(response_cache, key_func, timeout=None, validators=None):
+    """
+    Cache a view's JSON payload as encoded bytes.
+    The view returns a plain payload to be cached; returning a Response or a
+    (body, status) tuple bypasses the cache, as does key_func returning None.
+
+    validators(payload) returns the (etag, last_modified) of a payload. It is
+    first called with None: if it can answer without the payload, matching
+    conditional requests get a 304 before the view runs at all. Otherwise a
+    miss runs the view and encodes the entry for the cache before the
+    conditional request is checked against it.
+
+    Concurrent misses for one key run the view once; the other requests wait
+    and are answered from the entry it stored (X-Cache: COALESCED).
+
+    If the view raises or answers with a 5xx, an expired entry still within
+    the stale grace period is served instead (X-Cache: STALE plus a Warning).
+
+    Every lookup is counted per key so the cache warmer can refresh popular
+    entries; requests flagged with REFRESH_ENVIRON_KEY skip the lookup.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = key_func(*args, **kwargs)
+            if key is None:
+                return f(*args, **kwargs)
+
+            refreshing = request.environ.get(REFRESH_ENVIRON_KEY, False)
+            if not refreshing:
+                response_cache.access_tracker.record(key, request.full_path)
+                entry = response_cache.get(key)
+                if entry is not None:
+                    return make_response(entry, 'HIT')
+
+            known = validators(None) if validators else None
+            if known and is_not_modified(*known):
+                return not_modified_response(*known, 'MISS')
+
+            def compute():
+                result = f(*args, **kwargs)
+                if isinstance(result, (Response, tuple)):
+                    return result
+                etag, last_modified = known or (validators(result) if validators else None) or (None, None)
+                return response_cache.set(key, result, timeout, etag=etag, last_modified=last_modified)
+
+            try:
+                result, shared = response_cache.flight.do(key, compute, timeout=SINGLE_FLIGHT_WAIT)
+            except Exception as e:
+                stale = response_cache.get_stale(key)
+                if stale is None:
+                    raise
+                print(f"Serving stale {key}: {str(e)}")
+                return make_stale_response(stale)
+            if is_server_error(result):
+                stale = response_cache.get_stale(key)
+                if stale is not None:
+                    return make_stale_response(stale)
+            if not isinstance(result, CachedResponse):
+                # Responses are per request; a waiter whose leader bypassed the cache runs the view itself
+                return f(*args, **kwargs) if shared else result
+            return make_response(result, 'COALESCED' if shared else 'MISS')
+        return wrapper
+    return decorator
@@ -0,0 +1,82 @@
+# utils/search_cache.py
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from util.catalog_version import CatalogVersion
+from util.single_flight import jittered
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', 5000))
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 60))
+
+
+def normalize_price_ranges(price_ranges):
+    """Parse price_ranges into a sorted list of (min, max) pairs so equal filters share a key"""
+    if isinstance(price_ranges, str):
+        price_ranges = json.loads(price_ranges)
+    normalized = set()
+    for price_range in price_ranges or []:
+        low = price_range.get('min')
+        high = price_range.get('max')
+        normalized.add((
+            float(low) if low is not None else None,
+            float(high) if high is not None else None
+        ))
+    return sorted(normalized, key=lambda r: (r[0] is not None, r[0] or 0, r[1] is None, r[1] or 0))
+
+
+def make_cache_key(query_params):
+    """Canonical key for validated search params (or a plain string key)"""
+    if isinstance(query_params, str):
+        return query_params
+    params = dict(query_params)
+    if params.get('price_ranges'):
+        params['price_ranges'] = normalize_price_ranges(params['price_ranges'])
+    if params.get('search_term'):
+        params['search_term'] = ' '.join(params['search_term'].lower().split())
+    return json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+
+
+class SearchCache:
+    """
+    Bounded LRU cache of search results with a TTL.
+    Each entry remembers the catalog generation it was computed under and is
+    treated as a miss once a product write has bumped the generation.
+    """
+
+    def __init__(self, max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl=SEARCH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_cached_results(self, query_params):
+        key = make_cache_key(query_params)
+        generation = CatalogVersion().generation
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, entry_generation, results = entry
+            if expires_at <= time.time() or entry_generation != generation:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return results
+
+    def cache_results(self, query_params, results, ttl=None, generation=None):
+        """Store results; pass the generation read before the search so a concurrent write is not masked"""
+        key = make_cache_key(query_params)
+        if generation is None:
+            generation = CatalogVersion().generation
+        expires_at = time.time() + jittered(ttl or self.ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, generation, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,65 @@
+# utils/single_flight.py
+import os
+import random
+import threading
+
+# Fraction of a TTL shaved off at random so entries written together expire apart
+CACHE_TTL_JITTER = float(os.environ.get('CACHE_TTL_JITTER', 0.1))
+
+
+def jittered(ttl, jitter=CACHE_TTL_JITTER):
+    """A TTL somewhere in [ttl * (1 - jitter), ttl]"""
+    if not jitter:
+        return ttl
+    return ttl * (1 - random.random() * jitter)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one.
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and get the same result (or exception) instead of
+    repeating the work.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """
+        Return (result, shared); shared is True when another caller computed it.
+        A waiter that gives up after timeout seconds runs fn itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            return fn(), False
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()